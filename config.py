@@ -30,6 +30,19 @@ DEFAULT_CONFIG = {
     'coordinate_precision': 6,
     'parameter_precision': 6,
     
+    # 合并参数相同的类型时的容差（相对值，绝对值小于1时按绝对误差）
+    'type_collapse_tolerance': 1e-6,
+    
+    # 输出文件的写入缓冲区大小（字节）
+    'write_buffer_size': 1 << 20,
+    
+    # 流式处理设置（每块原子数）
+    'stream_chunk_size': 1000000,
+    
+    # 拓扑缓存设置
+    'topology_cache_dir': '~/.cache/gro2mol2lmp/topology',
+    'topology_cache_max_mb': 2048,
+    
     # 转换选项
     'auto_detect_molecules': True,
     'validate_force_field': True,
@@ -184,9 +197,15 @@ def get_config():
     if 'GRO2LAMMPS_OUTPUT_DIR' in os.environ:
         config['output_dir'] = os.environ['GRO2LAMMPS_OUTPUT_DIR']
     
+    if 'GRO2LAMMPS_CACHE_DIR' in os.environ:
+        config['topology_cache_dir'] = os.environ['GRO2LAMMPS_CACHE_DIR']
+    
     if 'GRO2LAMMPS_FORCE_FIELD' in os.environ:
         config['default_force_field'] = os.environ['GRO2LAMMPS_FORCE_FIELD']
     
+    if 'GRO2LAMMPS_WRITE_BUFFER' in os.environ:
+        config['write_buffer_size'] = int(os.environ['GRO2LAMMPS_WRITE_BUFFER'])
+    
     return config
 
 
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+分子内原子的索引查找表
+原子索引 -> 名称编码、类型编码，供各成键项写出函数共用
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from parsers.interaction_table import canonical_codes
+
+
+def custom_ff_atom_name(atom: Dict) -> str:
+    """自定义力场.lt文件中的原子名称"""
+    return atom.get('name', f"{atom['type']}{atom['index']}")
+
+
+def standard_ff_atom_name(atom: Dict) -> str:
+    """标准力场Bond List中的原子名称（优先使用生成的唯一名称）"""
+    return atom.get('atom_name', atom.get('name', f"{atom['type']}{atom['index']}"))
+
+
+class AtomLookup:
+    """按原子索引查找名称与类型
+
+    每个分子构建一次：原子索引排序后保存为int64数组，名称与类型以整数
+    编码表示（names/types为编码对应的字符串），rows为原子在atoms列表中的位置。
+    type_ranks把类型编码换成按类型名字典序的编号（对应sorted_types）。
+    查找为一次二分搜索，成键项的写出因此与原子数、成键项数都成线性关系。
+    重复的原子索引以最后一个为准。
+    """
+
+    def __init__(self, atoms: List[Dict], name_of: Optional[Callable[[Dict], str]] = None):
+        name_of = name_of or custom_ff_atom_name
+
+        by_index = {}
+        for row, atom in enumerate(atoms):
+            by_index[atom['index']] = (row, atom)
+
+        self.names: List[str] = []
+        self.types: List[str] = []
+        name_codes: Dict[str, int] = {}
+        type_codes: Dict[str, int] = {}
+        n = len(by_index)
+        indices = np.empty(n, dtype=np.int64)
+        names = np.empty(n, dtype=np.int32)
+        types = np.empty(n, dtype=np.int32)
+        rows = np.empty(n, dtype=np.int64)
+
+        for i, (index, (row, atom)) in enumerate(by_index.items()):
+            name = name_of(atom)
+            code = name_codes.get(name)
+            if code is None:
+                code = name_codes[name] = len(self.names)
+                self.names.append(name)
+            names[i] = code
+
+            atom_type = atom['type']
+            code = type_codes.get(atom_type)
+            if code is None:
+                code = type_codes[atom_type] = len(self.types)
+                self.types.append(atom_type)
+            types[i] = code
+            indices[i] = index
+            rows[i] = row
+
+        # 类型编码 -> 按类型名字典序的编号，供成键类型组合取规范顺序
+        by_name = sorted(range(len(self.types)), key=self.types.__getitem__)
+        self.sorted_types: List[str] = [self.types[c] for c in by_name]
+        self.type_ranks = np.empty(len(self.types), dtype=np.int32)
+        self.type_ranks[by_name] = np.arange(len(by_name), dtype=np.int32)
+
+        order = np.argsort(indices, kind='stable')
+        self.indices = indices[order]
+        self.name_codes = names[order]
+        self.type_codes = types[order]
+        self.rows = rows[order]
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def locate(self, atom_indices: np.ndarray) -> np.ndarray:
+        """原子索引在查找表中的位置（同形状数组，未定义的原子为-1）"""
+        atom_indices = np.asarray(atom_indices)
+        if len(self.indices) == 0:
+            return np.full(atom_indices.shape, -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.indices, atom_indices), len(self.indices) - 1)
+        return np.where(self.indices[positions] == atom_indices, positions, -1)
+
+    def canonical_type_codes(self, positions: np.ndarray) -> np.ndarray:
+        """查找表位置组合对应的规范类型编码（编码指向sorted_types，正反方向取同一组合）"""
+        return canonical_codes(self.type_ranks[self.type_codes[positions]])
+
+    def canonical_type_names(self, atom_indices: np.ndarray,
+                             missing: str = 'UNK') -> Tuple[List[str], np.ndarray]:
+        """每行原子的类型组合取规范顺序后去重
+
+        返回(各组合的类型名, 每行对应的组合编号)；未定义的原子类型记为missing。
+        """
+        positions = self.locate(atom_indices)
+        found = positions >= 0
+        vocabulary = self.sorted_types
+        if len(self.type_codes):
+            ranks = np.where(found, self.type_ranks[self.type_codes[np.maximum(positions, 0)]], -1)
+        else:
+            ranks = np.full(positions.shape, -1, dtype=np.int64)
+        if not found.all():
+            # missing按字典序插入类型表，保持编码顺序与名称顺序一致
+            vocabulary = sorted(set(vocabulary) | {missing})
+            remap = np.array([vocabulary.index(name) for name in self.sorted_types] + [0],
+                             dtype=np.int64)
+            ranks = np.where(found, remap[ranks], vocabulary.index(missing))
+        combos, inverse = np.unique(canonical_codes(ranks), axis=0, return_inverse=True)
+        names = ['-'.join(vocabulary[c] for c in combo) for combo in combos.tolist()]
+        return names, inverse.reshape(-1)
+
+    def name_labels(self, atom_indices: np.ndarray) -> List[str]:
+        """一列原子索引对应的名称（未定义的原子为atom{索引}）"""
+        return self._labels(atom_indices, self.name_codes, self.names, None)
+
+    def type_labels(self, atom_indices: np.ndarray, missing: str = 'UNK') -> List[str]:
+        """一列原子索引对应的类型（未定义的原子为missing）"""
+        return self._labels(atom_indices, self.type_codes, self.types, missing)
+
+    def _labels(self, atom_indices: np.ndarray, codes: np.ndarray, values: List[str],
+                missing: Optional[str]) -> List[str]:
+        positions = self.locate(atom_indices)
+        found = positions >= 0
+        if found.all():
+            return [values[c] for c in codes[positions].tolist()]
+        gathered = np.where(found, codes[np.maximum(positions, 0)], -1) if len(codes) else positions
+        return [
+            values[c] if c >= 0 else (f"atom{i}" if missing is None else missing)
+            for c, i in zip(gathered.tolist(), np.asarray(atom_indices).tolist())
+        ]
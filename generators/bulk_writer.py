@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+批量文本写出
+各生成器共用的输出层：整段数据按块格式化为大字符串后一次写出，
+代替逐原子、逐相互作用的f.write调用；文件以大缓冲区打开
+"""
+
+from itertools import chain, islice
+from pathlib import Path
+from typing import IO, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+
+from generators.fixed_format import UnsupportedFormat, format_rows
+
+try:
+    from config import DEFAULT_CONFIG
+    WRITE_BUFFER_SIZE = DEFAULT_CONFIG['write_buffer_size']
+    COORDINATE_PRECISION = DEFAULT_CONFIG['coordinate_precision']
+except (ImportError, KeyError):
+    WRITE_BUFFER_SIZE = 1 << 20
+    COORDINATE_PRECISION = 6
+
+# 每次格式化写出的行数
+WRITE_BLOCK_ROWS = 100000
+
+# 速度（Angstrom/fs，量级约1e-3）的小数位数
+VELOCITY_PRECISION = 10
+
+Column = Union[np.ndarray, Sequence]
+
+
+def open_output(path: Union[str, Path], buffer_size: Optional[int] = None) -> IO[str]:
+    """以大写入缓冲区打开文本输出文件"""
+    return open(path, 'w', buffering=buffer_size or WRITE_BUFFER_SIZE)
+
+
+def write_rows(f, fmt: str, columns: List[Column], block_rows: int = WRITE_BLOCK_ROWS):
+    """按块批量格式化写出多列数据
+
+    fmt为一行的%格式串，columns为等长的列（numpy数组或列表）；
+    每块的所有行以一次%运算格式化，再以一次write写出。
+    """
+    n = len(columns[0]) if columns else 0
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        values = [_as_list(column[start:stop]) for column in columns]
+        f.write((fmt * (stop - start)) % tuple(chain.from_iterable(zip(*values))))
+
+
+def write_fixed_rows(f, fmt: str, columns: List[Column], block_rows: int = WRITE_BLOCK_ROWS):
+    """与write_rows相同，但以字节矩阵向量化格式化（见fixed_format）
+
+    fmt只能包含%s、%d与%.Nf；某一块的数据不能向量化时（非有限值、
+    非ASCII字符串等）该块回退到write_rows。
+    """
+    n = len(columns[0]) if columns else 0
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        block = [column[start:stop] for column in columns]
+        try:
+            text = format_rows(fmt, block)
+        except UnsupportedFormat:
+            write_rows(f, fmt, block, block_rows)
+        else:
+            f.write(text)
+
+
+def coordinate_format(precision: Optional[int] = None, n: int = 3) -> str:
+    """n个坐标分量的%格式串（以空格分隔，不含前后文本）"""
+    if precision is None:
+        precision = COORDINATE_PRECISION
+    return ' '.join([f"%.{int(precision)}f"] * n)
+
+
+def write_lines(f, lines: Iterable[str], block_rows: int = WRITE_BLOCK_ROWS):
+    """将逐行生成的文本按块拼接后写出"""
+    iterator = iter(lines)
+    while True:
+        block = list(islice(iterator, block_rows))
+        if not block:
+            break
+        f.write(''.join(block))
+
+
+def _as_list(column: Column) -> list:
+    if isinstance(column, np.ndarray):
+        # 定长字节串列（向量化路径使用的名称数组）按%s格式化前先解码
+        if column.dtype.kind == 'S':
+            return column.astype(str).tolist()
+        return column.tolist()
+    return list(column)
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+LAMMPS数据文件的坐标刷新
+拓扑不变、只有坐标变化（如新的平衡构象）时，直接改写已有data文件：
+只替换Atoms section各行的x/y/z列以及盒子边长（保留原有的xlo/ylo/zlo），
+坐标文件带速度时写入Velocities section，
+其余section按字节原样复制，不重新解析拓扑、不重新生成。
+Atoms行中原有的镜像标志会清零：新坐标取自坐标文件，
+原来的镜像标志对应的是旧构象，不再有意义
+"""
+
+import io
+import os
+import re
+import shutil
+import tempfile
+from itertools import islice
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from generators.bulk_writer import (
+    VELOCITY_PRECISION, WRITE_BLOCK_ROWS, WRITE_BUFFER_SIZE, coordinate_format
+)
+from generators.fixed_format import UnsupportedFormat, format_rows
+from parsers.coordinate_reader import index_coordinate_frames, read_coordinate_frame, select_frame
+
+# atom_style -> x坐标所在列（0起）
+ATOM_STYLE_X_COLUMN = {
+    'atomic': 2,
+    'charge': 3,
+    'bond': 3,
+    'angle': 3,
+    'molecular': 3,
+    'full': 4,
+}
+
+# 没有注明atom_style时按每行的列数推断（含或不含3列镜像标志）
+_X_COLUMN_BY_TOKENS = {5: 2, 8: 2, 6: 3, 9: 3, 7: 4, 10: 4}
+
+# Atoms行中坐标之前的文本的最大长度
+_MAX_PREFIX = 256
+
+_ATOMS_COUNT = re.compile(rb'^\s*(\d+)\s+atoms\b')
+_BOX_LINE = re.compile(rb'^\s*\S+\s+\S+\s+([xyz])lo\s+[xyz]hi\b')
+
+
+class DataCoordinateRefresher:
+    """用新的坐标文件刷新已有LAMMPS数据文件中的原子坐标"""
+
+    def __init__(self, logger, coordinate_precision: Optional[int] = None,
+                 buffer_size: Optional[int] = None, block_rows: int = WRITE_BLOCK_ROWS):
+        self.logger = logger
+        self.coordinate_format = coordinate_format(coordinate_precision)
+        self.buffer_size = buffer_size or WRITE_BUFFER_SIZE
+        self.block_rows = block_rows
+        # 当前文件中x坐标所在列（由Atoms标题的atom_style或首行列数确定）
+        self.x_column: Optional[int] = None
+
+    def refresh(self, data_file: str, coordinate_file: str,
+                output_file: Optional[str] = None, frame: int = 0) -> Dict:
+        """以coordinate_file中第frame帧的坐标改写data_file（output_file为None时原地改写）
+
+        data文件的原子数必须与坐标文件一致；第k个坐标对应ID为k的原子
+        （即生成data文件时的原子顺序）。返回{'atoms': 原子数, 'box': 是否更新了盒子}。
+        """
+        positions, box, velocities = read_frame(coordinate_file, frame)
+        self.logger.info(f"读取坐标文件: {coordinate_file} ({len(positions)} 个原子)")
+        return self.refresh_positions(data_file, positions, box, output_file, velocities)
+
+    def refresh_positions(self, data_file: str, positions: np.ndarray,
+                          box: Optional[List[float]] = None,
+                          output_file: Optional[str] = None,
+                          velocities: Optional[np.ndarray] = None) -> Dict:
+        """与refresh相同，但坐标(N,3)、盒子边长（Angstrom）与速度（Angstrom/fs）由调用方给出
+
+        给出velocities时替换data文件中的Velocities section（没有则紧接Atoms之后插入）。
+        """
+        data_file = Path(data_file)
+        output_file = Path(output_file) if output_file else data_file
+
+        fd, tmp_path = tempfile.mkstemp(dir=output_file.parent, prefix=f".{output_file.name}.",
+                                        suffix='.tmp')
+        try:
+            with open(data_file, 'rb') as src, \
+                    os.fdopen(fd, 'wb', buffering=self.buffer_size) as dst:
+                box_updated = self._copy_header(src, dst, positions, box)
+                rest = self._patch_atoms(src, dst, positions)
+                if velocities is not None:
+                    rest = self._replace_velocities(src, dst, rest, positions, velocities)
+                dst.write(rest)
+                shutil.copyfileobj(src, dst, self.buffer_size)
+            os.chmod(tmp_path, data_file.stat().st_mode & 0o7777)
+            os.replace(tmp_path, output_file)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        self.logger.info(f"已刷新数据文件坐标: {output_file}")
+        return {'atoms': len(positions), 'box': box_updated}
+
+    def _copy_header(self, src, dst, positions: np.ndarray, box: Optional[List[float]]) -> bool:
+        """复制到Atoms section的标题行（含），检查原子数并更新盒子边界"""
+        n_atoms = None
+        box_updated = False
+        for line in src:
+            match = _ATOMS_COUNT.match(line)
+            if match and n_atoms is None:
+                n_atoms = int(match.group(1))
+                if n_atoms != len(positions):
+                    raise ValueError(f"坐标文件原子数({len(positions)})与数据文件原子数({n_atoms})不一致")
+            match = _BOX_LINE.match(line)
+            if match and box:
+                # 保留原点，只按新的盒子边长改写上界
+                axis = match.group(1).decode()
+                length = box['xyz'.index(axis)]
+                lo = line.split()[0]
+                line = f"{lo.decode()} {float(lo) + length:.6f} {axis}lo {axis}hi\n".encode()
+                box_updated = True
+            dst.write(line)
+            keyword, _, comment = line.partition(b'#')
+            if keyword.strip() == b'Atoms':
+                if n_atoms is None:
+                    raise ValueError("数据文件头部缺少原子数")
+                self.x_column = self._x_column(comment.strip().decode())
+                return box_updated
+        raise ValueError("数据文件中没有Atoms section")
+
+    def _x_column(self, style: str) -> Optional[int]:
+        if not style:
+            return None
+        if style not in ATOM_STYLE_X_COLUMN:
+            raise ValueError(f"不支持的atom_style: {style}")
+        return ATOM_STYLE_X_COLUMN[style]
+
+    def _patch_atoms(self, src, dst, positions: np.ndarray) -> bytes:
+        """逐块改写Atoms section的坐标列，到section结束的空行为止
+
+        返回已从src读出、位于Atoms section之后的原始字节。
+        """
+        seen = np.zeros(len(positions), dtype=bool)
+        n_rows = 0
+        in_rows = False
+        rest = b''
+        while True:
+            lines = list(islice(src, self.block_rows))
+            if not lines:
+                break
+            if not in_rows:
+                # section标题后的空行
+                while lines and not lines[0].strip():
+                    dst.write(lines.pop(0))
+                if not lines:
+                    continue
+                in_rows = True
+            block = b''.join(lines)
+            if not block.endswith(b'\n'):
+                block += b'\n'
+            text, consumed, section_rest = self._patch_block(block, positions, seen)
+            dst.write(text)
+            n_rows += consumed
+            if section_rest is not None:
+                rest = section_rest
+                break
+
+        if n_rows != len(positions) or not seen.all():
+            raise ValueError(f"Atoms section有 {n_rows} 行，"
+                             f"与坐标文件的 {len(positions)} 个原子不能一一对应")
+        return rest
+
+    def _replace_velocities(self, src, dst, rest: bytes, positions: np.ndarray,
+                            velocities: np.ndarray) -> bytes:
+        """在Atoms section之后写出Velocities section
+
+        rest为_patch_atoms多读出的字节；紧随其后的若是原有的Velocities section则跳过它。
+        返回剩余的已读出字节。
+        """
+        if len(velocities) != len(positions):
+            raise ValueError(f"速度数({len(velocities)})与原子数({len(positions)})不一致")
+        head = io.BytesIO(rest)
+
+        def next_line() -> bytes:
+            return head.readline() or src.readline()
+
+        blanks = []
+        line = next_line()
+        while line and not line.strip():
+            blanks.append(line)
+            line = next_line()
+        if line.partition(b'#')[0].strip() == b'Velocities':
+            # 跳过标题、空行与原有各行，保留section结束的空行
+            line = next_line()
+            while line and not line.strip():
+                line = next_line()
+            while line.strip():
+                line = next_line()
+            blanks = []
+
+        fmt = f"%d {coordinate_format(VELOCITY_PRECISION)}\n"
+        ids = np.arange(1, len(velocities) + 1)
+        dst.write(b"\nVelocities\n\n")
+        for start in range(0, len(ids), self.block_rows):
+            stop = start + self.block_rows
+            columns = [ids[start:stop]] + [velocities[start:stop, k] for k in range(3)]
+            try:
+                text = format_rows(fmt, columns)
+            except UnsupportedFormat:
+                text = (fmt * len(columns[0])) % tuple(
+                    value for row in zip(*[c.tolist() for c in columns]) for value in row)
+            dst.write(text.encode('ascii'))
+        return b''.join(blanks) + line + head.read()
+
+    def _patch_block(self, block: bytes, positions: np.ndarray,
+                     seen: np.ndarray) -> Tuple[bytes, int, Optional[bytes]]:
+        """改写一块原子行
+
+        返回(改写后的字节, 改写的行数, section结束后剩余的原始字节或None)。
+        """
+        buf = np.frombuffer(block, dtype=np.uint8)
+        line_ends = np.flatnonzero(buf == ord('\n'))
+        line_starts = np.concatenate([[0], line_ends[:-1] + 1])
+
+        # 各行的词：起止位置与每行的词数（空行词数为0，表示section结束）
+        whitespace = buf <= ord(' ')
+        is_start = ~whitespace
+        is_start[1:] &= whitespace[:-1]
+        is_end = ~whitespace
+        is_end[:-1] &= whitespace[1:]
+        token_starts = np.flatnonzero(is_start)
+        token_ends = np.flatnonzero(is_end) + 1
+        counts = np.diff(np.append(np.searchsorted(token_starts, line_starts), len(token_starts)))
+        rest = None
+        if not counts.all():
+            end = int(np.argmin(counts))
+            rest = block[line_starts[end]:]
+            if end == 0:
+                return b'', 0, rest
+            block = block[:line_starts[end]]
+            buf = buf[:len(block)]
+            n_tokens = int(counts[:end].sum())
+            token_starts, token_ends = token_starts[:n_tokens], token_ends[:n_tokens]
+            line_starts, counts = line_starts[:end], counts[:end]
+        if b'#' in block:
+            raise ValueError("Atoms section的行中不支持注释")
+
+        x_column = self.x_column
+        if x_column is None:
+            x_column = _X_COLUMN_BY_TOKENS.get(int(counts[0]))
+            if x_column is None:
+                raise ValueError(f"无法从列数({counts[0]})推断atom_style")
+            self.x_column = x_column
+        if not np.isin(counts, (x_column + 3, x_column + 6)).all():
+            raise ValueError("Atoms section的列数不一致")
+        first = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+        padded = np.concatenate([buf, np.zeros(_MAX_PREFIX, dtype=np.uint8)])
+        ids = _parse_integers(padded, token_starts[first], token_ends[first])
+        if ids.min() < 1 or ids.max() > len(positions):
+            raise ValueError(f"原子ID超出1..{len(positions)}")
+        # 各块的ID互不重复；块内重复会使最终的seen不完整
+        if seen[ids - 1].any():
+            raise ValueError("Atoms section中有重复的原子ID")
+        seen[ids - 1] = True
+
+        # 坐标之前的各列原样保留，镜像标志清零
+        prefixes = _token_bytes(padded, line_starts, token_starts[first + x_column])
+        suffixes = np.where(counts == x_column + 6, b' 0 0 0', b'')
+        xyz = positions[ids - 1]
+        fmt = f"%s{self.coordinate_format}%s\n"
+        columns = [prefixes, xyz[:, 0], xyz[:, 1], xyz[:, 2], suffixes]
+        try:
+            text = format_rows(fmt, columns)
+        except UnsupportedFormat:
+            text = (fmt * len(ids)) % tuple(
+                value for row in zip(prefixes.astype(str).tolist(), *xyz.T.tolist(),
+                                     suffixes.astype(str).tolist()) for value in row)
+        return text.encode('ascii'), len(ids), rest
+
+
+def read_frame(coordinate_file: str, frame: int = 0
+               ) -> Tuple[np.ndarray, Optional[List[float]], Optional[np.ndarray]]:
+    """读取坐标文件第frame帧的坐标(N,3)、盒子边长（Angstrom）与速度（没有时为None）
+
+    各帧（包括第0帧）都按帧偏移索引经read_coordinate_frame读取，带速度的帧总是返回速度。
+    """
+    offset = select_frame(index_coordinate_frames(coordinate_file), frame, coordinate_file)
+    data = read_coordinate_frame(coordinate_file, offset)
+    if data['table'] is not None:
+        return data['table'].positions, data['box_vectors'], data['table'].velocities
+    if data['positions'] is None:
+        raise ValueError(f"该帧中没有坐标: {coordinate_file}")
+    return data['positions'], data['box_vectors'], data['velocities']
+
+
+def _token_bytes(padded: np.ndarray, starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """padded[starts[i]:stops[i]] -> 定长字节串数组（右侧以0填充）
+
+    padded末尾需有至少_MAX_PREFIX个0字节，各段从滑动窗口中整行取出。
+    """
+    lengths = stops - starts
+    width = int(lengths.max()) if len(lengths) else 0
+    if width > _MAX_PREFIX:
+        raise ValueError(f"Atoms section的行过长（坐标前有{width}个字符）")
+    width = max(width, 1)
+    windows = np.lib.stride_tricks.sliding_window_view(padded, width)[starts]
+    windows[np.arange(width) >= lengths[:, None]] = 0
+    return windows.view(f'S{width}').reshape(-1)
+
+
+def _parse_integers(padded: np.ndarray, starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """十进制正整数词 -> int64数组"""
+    lengths = stops - starts
+    width = int(lengths.max()) if len(lengths) else 0
+    if width > 18:
+        raise ValueError("Atoms section中原子ID过长")
+    digits = np.lib.stride_tricks.sliding_window_view(padded, max(width, 1))[starts].astype(np.int64)
+    digits -= ord('0')
+    values = np.zeros(len(starts), dtype=np.int64)
+    for column in range(width):
+        inside = column < lengths
+        if ((digits[:, column] < 0) | (digits[:, column] > 9))[inside].any():
+            raise ValueError("Atoms section中原子ID不是整数")
+        values = np.where(inside, values * 10 + digits[:, column], values)
+    return values
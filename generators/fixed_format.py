@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+定点数批量格式化
+将整块的字符串、整数与定点小数列直接拼成字节矩阵，不经过逐行的%运算：
+每列先转为定宽字节矩阵（多余位置填0字节），各列与分隔符横向拼接后
+去掉填充字节，得到与%格式化相同的文本
+"""
+
+import re
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+Column = Union[np.ndarray, Sequence]
+
+# 支持的转换：%s、%d、%.Nf
+_CONVERSION = re.compile(r'%(s|d|\.(\d+)f)')
+
+# 定点化后的整数上限，超过时无法用int64精确表示
+_MAX_SCALED = 2.0 ** 62
+
+# |x|*10^N 与 .5 的距离在（列内最大值的）该相对误差以内时视为可能的舍入边界
+_TIE_TOLERANCE = 4 * np.finfo(np.float64).eps
+
+_PAD = 0
+
+# 0000-9999的四位数字字节，每组按uint32存放以便一次取出
+_DIGIT_GROUPS = np.array([list(f"{i:04d}".encode()) for i in range(10000)],
+                         dtype=np.uint8).view(np.uint32).reshape(-1)
+
+_POWERS_OF_TEN = 10 ** np.arange(19, dtype=np.int64)
+
+
+class UnsupportedFormat(ValueError):
+    """格式串或数据不能走向量化路径（调用方应回退到%格式化）"""
+
+
+def parse_format(fmt: str) -> Tuple[List[str], List[Optional[int]]]:
+    """拆分一行的格式串
+
+    返回(字面文本列表, 转换列表)，字面文本比转换多一个；
+    转换为None表示%s，-1表示%d，非负整数为%.Nf的小数位数。
+    """
+    literals, conversions = [], []
+    position = 0
+    for match in _CONVERSION.finditer(fmt):
+        literals.append(fmt[position:match.start()])
+        if match.group(1) == 's':
+            conversions.append(None)
+        elif match.group(1) == 'd':
+            conversions.append(-1)
+        else:
+            conversions.append(int(match.group(2)))
+        position = match.end()
+    literals.append(fmt[position:])
+    if any('%' in literal or not literal.isascii() for literal in literals):
+        raise UnsupportedFormat(f"不支持的格式串: {fmt!r}")
+    return literals, conversions
+
+
+def format_rows(fmt: str, columns: List[Column]) -> str:
+    """以向量化方式按fmt格式化多列数据，结果与(fmt * n) % 行值 相同
+
+    非有限值、超出int64范围的值或非ASCII字符串抛出UnsupportedFormat。
+    """
+    literals, conversions = parse_format(fmt)
+    if len(conversions) != len(columns):
+        raise ValueError(f"格式串需要{len(conversions)}列，实际为{len(columns)}列")
+    n = len(columns[0]) if columns else 0
+    if n == 0:
+        return ''
+
+    parts = []
+    for literal, conversion, column in zip(literals, conversions, columns):
+        if literal:
+            parts.append(_literal_field(literal, n))
+        if conversion is None:
+            parts.append(text_field(column))
+        elif conversion < 0:
+            parts.extend(_integer_parts(column))
+        else:
+            parts.extend(_fixed_parts(column, conversion))
+    if literals[-1]:
+        parts.append(_literal_field(literals[-1], n))
+
+    buffer = np.concatenate(parts, axis=1).reshape(-1)
+    return buffer[buffer != _PAD].tobytes().decode('ascii')
+
+
+def format_coordinates(positions: np.ndarray, precision: int, separator: str = ' ') -> str:
+    """将(N,3)坐标数组格式化为每行三个定点数的文本"""
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    field = f"%.{int(precision)}f"
+    fmt = separator.join([field] * 3) + "\n"
+    return format_rows(fmt, [positions[:, 0], positions[:, 1], positions[:, 2]])
+
+
+def fixed_field(values: Column, precision: int) -> np.ndarray:
+    """定点小数列 -> (n, 宽度)字节矩阵，等价于'%.{precision}f'"""
+    return np.concatenate(_fixed_parts(values, precision), axis=1)
+
+
+def integer_field(values: Column) -> np.ndarray:
+    """整数列 -> (n, 宽度)字节矩阵，等价于'%d'"""
+    return np.concatenate(_integer_parts(values), axis=1)
+
+
+def text_field(values: Column) -> np.ndarray:
+    """字符串列 -> (n, 最大长度)字节矩阵，等价于'%s'"""
+    if isinstance(values, np.ndarray) and values.dtype.kind == 'S':
+        encoded = values
+    else:
+        try:
+            encoded = values.astype('S') if isinstance(values, np.ndarray) else \
+                np.array(values, dtype='S')
+        except UnicodeEncodeError:
+            raise UnsupportedFormat("包含非ASCII字符") from None
+    encoded = encoded.reshape(-1)
+    if encoded.dtype.itemsize == 0:
+        return np.zeros((len(encoded), 1), dtype=np.uint8)
+    return np.frombuffer(np.ascontiguousarray(encoded).tobytes(),
+                         dtype=np.uint8).reshape(len(encoded), encoded.dtype.itemsize)
+
+
+def _fixed_parts(values: Column, precision: int) -> List[np.ndarray]:
+    """定点小数列 -> [符号与整数部分, 小数点, 小数部分]字节矩阵
+
+    |x|*10^N 按round-half-even取整；乘法的舍入误差可能使恰好接近 .5 的值
+    舍入到另一侧，这些（极少的）值改用%格式化的结果，保证与C库逐位一致。
+    """
+    values = np.asarray(values, dtype=np.float64).reshape(-1)
+    if not np.isfinite(values).all():
+        raise UnsupportedFormat("包含非有限值")
+    scale = 10 ** precision
+    product = np.abs(values) * scale
+    largest = float(product.max()) if len(values) else 0.0
+    if largest >= _MAX_SCALED:
+        raise UnsupportedFormat("数值超出定点化范围")
+    rounded = np.rint(product)
+    scaled = rounded.astype(np.int64)
+    rounded -= product
+    np.abs(rounded, out=rounded)
+    for i in np.flatnonzero(rounded >= 0.5 - largest * _TIE_TOLERANCE).tolist():
+        scaled[i] = int(('%.*f' % (precision, abs(values[i]))).replace('.', ''))
+
+    if precision == 0:
+        return _digit_parts(scaled, np.signbit(values))
+    whole, fraction = np.divmod(scaled, scale)
+    return _digit_parts(whole, np.signbit(values)) + [
+        _literal_field('.', len(values)), _zero_padded(fraction, precision)]
+
+
+def _integer_parts(values: Column) -> List[np.ndarray]:
+    values = np.asarray(values)
+    if values.dtype.kind not in 'iub':
+        raise UnsupportedFormat(f"整数列的类型为{values.dtype}")
+    values = values.astype(np.int64).reshape(-1)
+    if len(values) and values.min() == np.iinfo(np.int64).min:
+        raise UnsupportedFormat("整数超出范围")
+    return _digit_parts(np.abs(values), values < 0)
+
+
+def _digit_parts(magnitude: np.ndarray, negative: np.ndarray) -> List[np.ndarray]:
+    """非负整数及符号 -> [符号, 右对齐的十进制数字]字节矩阵（前导位置为填充字节）"""
+    largest = int(magnitude.max()) if len(magnitude) else 0
+    width = len(str(largest))
+    sign = np.where(negative, np.uint8(ord('-')), np.uint8(_PAD))[:, None]
+    digits = _zero_padded(magnitude, width)
+    # 前导零改为填充字节，个位总是保留
+    if width > 1:
+        leading = magnitude[:, None] < _POWERS_OF_TEN[width - 1:0:-1]
+        np.copyto(digits[:, :width - 1], _PAD, where=leading)
+    return [sign, digits]
+
+
+def _zero_padded(values: np.ndarray, width: int) -> np.ndarray:
+    """非负整数 -> 补零到width位的(n, width)数字字节矩阵（按4位一组查表）"""
+    n_groups = -(-width // 4)
+    groups = np.empty((len(values), n_groups), dtype=np.uint32)
+    remaining = values
+    for group in range(n_groups - 1, -1, -1):
+        remaining, low = np.divmod(remaining, 10000)
+        groups[:, group] = _DIGIT_GROUPS[low]
+    return groups.view(np.uint8)[:, n_groups * 4 - width:]
+
+
+def _literal_field(literal: str, n: int) -> np.ndarray:
+    encoded = np.frombuffer(literal.encode('ascii'), dtype=np.uint8)
+    return np.broadcast_to(encoded, (n, len(encoded)))
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+多帧坐标（多帧.gro、多MODEL的.pdb、.trr）的逐帧输出
+拓扑只在第一帧上解析一次；其余各帧按帧偏移索引单独读取，每帧只做坐标读写：
+原生路线按帧改写已生成的data文件的坐标与速度（见DataCoordinateRefresher），
+moltemplate路线每帧写一个xyz文件。各帧相互独立，可在进程池中并行
+"""
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from generators.data_refresh import DataCoordinateRefresher
+from generators.moltemplate_generator import MoltemplateGenerator
+from parsers.coordinate_reader import CoordinateTable, index_coordinate_frames, read_coordinate_frame
+
+
+def frame_file(output_dir: Path, output_name: str, index: int, n_frames: int,
+               suffix: str) -> Path:
+    """第index帧的输出文件名，帧号按总帧数补零以便排序"""
+    width = len(str(max(n_frames - 1, 0)))
+    return Path(output_dir) / f"{output_name}_frame{index:0{width}d}{suffix}"
+
+
+def _write_frame_worker(task: Tuple) -> int:
+    """进程池任务：读取并写出一帧，返回该帧的原子数"""
+    settings, args = task
+    writer = FrameWriter(logging.getLogger('gro2mol2lmp'), **settings)
+    return writer.write_frame(*args)
+
+
+class FrameWriter:
+    """将多帧坐标文件的每一帧写为单独的输出文件"""
+
+    def __init__(self, logger, coordinate_precision: Optional[int] = None,
+                 buffer_size: Optional[int] = None, jobs: int = 1):
+        self.logger = logger
+        self.coordinate_precision = coordinate_precision
+        self.buffer_size = buffer_size
+        # 并行写出各帧的进程数
+        self.jobs = max(1, jobs)
+
+    def write_frames(self, coord_file: str, output_dir: Path, output_name: str,
+                     n_atoms: Optional[int] = None, data_file: Optional[Path] = None,
+                     reference: Optional[CoordinateTable] = None) -> List[Path]:
+        """逐帧写出{output_name}_frame{k}.data（给出data_file时）或{output_name}_frame{k}.xyz
+
+        n_atoms为拓扑中的原子数，每帧的原子数必须与之相同。
+        .trr帧不含原子名，写xyz时使用reference（已解析的第一帧）中的原子名。
+        """
+        offsets = index_coordinate_frames(coord_file)
+        suffix = '.data' if data_file else '.xyz'
+        outputs = [frame_file(output_dir, output_name, k, len(offsets), suffix)
+                   for k in range(len(offsets))]
+        self.logger.info(f"坐标文件 {coord_file} 共 {len(offsets)} 帧")
+
+        settings = {'coordinate_precision': self.coordinate_precision,
+                    'buffer_size': self.buffer_size}
+        if data_file or Path(coord_file).suffix.lower() != '.trr':
+            reference = None
+        tasks = [(settings, (str(coord_file), offset, str(output),
+                             str(data_file) if data_file else None, n_atoms, reference))
+                 for offset, output in zip(offsets, outputs)]
+
+        if self.jobs == 1 or len(tasks) == 1:
+            for _, args in tasks:
+                self.write_frame(*args)
+        else:
+            with ProcessPoolExecutor(max_workers=min(self.jobs, len(tasks))) as executor:
+                # 按帧顺序取回结果，任一帧出错时在此抛出
+                for _ in executor.map(_write_frame_worker, tasks):
+                    pass
+
+        self.logger.info(f"逐帧输出: {outputs[0].name} ... {outputs[-1].name}")
+        return outputs
+
+    def write_frame(self, coord_file: str, offset: int, output_file: str,
+                    data_file: Optional[str] = None, n_atoms: Optional[int] = None,
+                    reference: Optional[CoordinateTable] = None) -> int:
+        """读取从offset开始的一帧并写出，返回原子数"""
+        frame = read_coordinate_frame(coord_file, offset)
+        table = frame['table']
+        if table is not None:
+            positions, velocities = table.positions, table.velocities
+        else:
+            positions, velocities = frame['positions'], frame['velocities']
+            if positions is None:
+                raise ValueError(f"{Path(output_file).name}: 该帧中没有坐标")
+        if n_atoms is not None and len(positions) != n_atoms:
+            raise ValueError(f"{Path(output_file).name}: 该帧有 {len(positions)} 个原子，"
+                             f"与拓扑中的 {n_atoms} 个原子不一致")
+
+        if data_file:
+            refresher = DataCoordinateRefresher(self.logger,
+                                                coordinate_precision=self.coordinate_precision,
+                                                buffer_size=self.buffer_size)
+            refresher.refresh_positions(data_file, positions, frame['box_vectors'],
+                                        output_file, velocities)
+        else:
+            if table is None:
+                if reference is None:
+                    raise ValueError(f"{coord_file}: 帧中没有原子名，无法写出xyz")
+                table = reference.with_positions(positions, velocities)
+            self._write_xyz(Path(output_file), table)
+        return len(positions)
+
+    def _write_xyz(self, xyz_file: Path, table):
+        """与MoltemplateGenerator生成的xyz文件格式相同"""
+        generator = MoltemplateGenerator(self.logger, buffer_size=self.buffer_size,
+                                         coordinate_precision=self.coordinate_precision)
+        with generator._open_output(xyz_file) as f:
+            f.write(f"{len(table)}\n")
+            f.write(f"Generated from GROMACS files\n")
+            generator._write_xyz_table(f, table)
+        self.logger.debug(f"生成坐标文件: {xyz_file}")
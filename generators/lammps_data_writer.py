@@ -0,0 +1,486 @@
+# -*- coding: utf-8 -*-
+"""
+LAMMPS数据文件生成器
+自定义力场的全部参数在解析后即已确定，直接写出data与in.settings文件，
+不再经过moltemplate
+"""
+
+import sys
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# 添加父目录到路径以便导入config
+current_dir = Path(__file__).parent
+parent_dir = current_dir.parent
+sys.path.insert(0, str(parent_dir))
+
+from generators.atom_lookup import AtomLookup
+from generators.bulk_writer import (
+    VELOCITY_PRECISION, coordinate_format, open_output, write_fixed_rows, write_rows
+)
+from parsers.coordinate_reader import DEFAULT_DECODE_BLOCK
+from parsers.interaction_table import (
+    INTERACTION_ATOMS, as_interaction_table, canonical_type_name, canonical_type_table
+)
+from parsers.molecule_fingerprint import molecule_aliases
+
+try:
+    from config import UNIT_CONVERSIONS
+except ImportError:
+    # 如果无法导入，使用默认值
+    UNIT_CONVERSIONS = {
+        'length': 10.0,
+        'energy': 0.239006,
+        'bond_force': 0.239006 * 100,
+        'angle_force': 0.239006,
+        'sigma': 10.0,
+        'epsilon': 0.239006,
+        'mass': 1.0,
+        'charge': 1.0,
+    }
+
+# section名 -> (类型表名, data文件section标题, coeff命令)
+BONDED_SECTIONS = {
+    'bonds': ('bond_types', 'Bonds', 'bond_coeff'),
+    'angles': ('angle_types', 'Angles', 'angle_coeff'),
+    'dihedrals': ('dihedral_types', 'Dihedrals', 'dihedral_coeff'),
+}
+
+# section名 -> 每个成键项的原子数（含improper）
+SECTION_ATOMS = dict(INTERACTION_ATOMS, impropers=4)
+
+
+def bond_coeff(data: Dict) -> Optional[Tuple[str, str]]:
+    """键类型的名称与bond_coeff参数（与moltemplate路线相同的单位转换）"""
+    params = data.get('parameters', [])
+    if len(params) < 2:
+        return None
+    r0 = params[0] * UNIT_CONVERSIONS['length']
+    k_bond = params[1] * UNIT_CONVERSIONS['bond_force']
+    return canonical_type_name((data['atom1'], data['atom2'])), f"{k_bond:.6f} {r0:.6f}"
+
+
+def angle_coeff(data: Dict) -> Optional[Tuple[str, str]]:
+    """角度类型的名称与angle_coeff参数"""
+    params = data.get('parameters', [])
+    if len(params) < 2:
+        return None
+    k_angle = params[0] * UNIT_CONVERSIONS['angle_force']
+    theta0 = params[1]
+    name = canonical_type_name((data['atom1'], data['atom2'], data['atom3']))
+    return name, f"{k_angle:.6f} {theta0:.6f}"
+
+
+def dihedral_coeff(data: Dict) -> Optional[Tuple[str, str]]:
+    """二面角类型的名称与dihedral_coeff参数"""
+    params = data.get('parameters', [])
+    if len(params) < 3:
+        return None
+    k_dihedral = params[0] * UNIT_CONVERSIONS['energy']
+    multiplicity = int(params[1])
+    phase = params[2]
+    name = canonical_type_name((data['atom1'], data['atom2'], data['atom3'], data['atom4']))
+    return name, f"{k_dihedral:.6f} {multiplicity} {phase:.6f}"
+
+
+COEFF_FORMATTERS = {
+    'bond_types': bond_coeff,
+    'angle_types': angle_coeff,
+    'dihedral_types': dihedral_coeff,
+}
+
+
+class TypeTable:
+    """类型名 -> LAMMPS类型编号（从1开始，按首次定义或引用的顺序）
+
+    aliases为被合并的类型名 -> 保留的类型名，引用被合并的类型时使用保留类型的编号。
+    """
+
+    def __init__(self, aliases: Optional[Dict[str, str]] = None):
+        self.ids: Dict[str, int] = {}
+        # 类型名 -> coeff参数（部分力场每个类型有多行coeff）
+        self.coeffs: Dict[str, List[str]] = {}
+        self.aliases = aliases or {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def define(self, name: str, *coeffs: str):
+        """定义带参数的类型（重复定义时以最后一次为准，编号不变）"""
+        name = self.aliases.get(name, name)
+        self.use(name)
+        self.coeffs[name] = list(coeffs)
+
+    def use(self, name: str) -> int:
+        name = self.aliases.get(name, name)
+        type_id = self.ids.get(name)
+        if type_id is None:
+            type_id = self.ids[name] = len(self.ids) + 1
+        return type_id
+
+    def undefined(self) -> List[str]:
+        """被引用但没有参数的类型"""
+        return [name for name in self.ids if name not in self.coeffs]
+
+
+class MoleculeTemplate:
+    """一个分子类型的列式模板
+
+    原子按atoms列表顺序编号，成键项中的原子以模板内的行号（从0开始）表示，
+    实例化时只需加上原子偏移量。
+    """
+
+    def __init__(self, name: str, atom_types: np.ndarray, charges: np.ndarray,
+                 positions: np.ndarray, bonded: Dict[str, Tuple[np.ndarray, np.ndarray]]):
+        self.name = name
+        self.atom_types = atom_types
+        self.charges = charges
+        self.positions = positions
+        # section名 -> (行号数组(n, k), 类型编号数组)
+        self.bonded = bonded
+
+    @property
+    def n_atoms(self) -> int:
+        return len(self.atom_types)
+
+
+class LammpsDataWriter:
+    """直接生成LAMMPS数据文件（自定义力场）
+
+    子类可替换类型表、分子模板、质量和设置文件的生成方式，
+    实例展开、坐标和data文件的写出由本类完成。
+    """
+
+    # 写入data文件的成键section
+    bonded_sections = BONDED_SECTIONS
+
+    def __init__(self, logger, buffer_size: Optional[int] = None,
+                 coordinate_precision: Optional[int] = None, chunk_size: Optional[int] = None):
+        self.logger = logger
+        # 输出文件的写入缓冲区大小（None时使用配置中的write_buffer_size）
+        self.buffer_size = buffer_size
+        # 坐标的小数位数（None时使用配置中的coordinate_precision）
+        self.coordinate_format = coordinate_format(coordinate_precision)
+        # 每次展开写出的最大原子数（按完整分子取整），限制大体系的内存占用
+        self.chunk_size = chunk_size or DEFAULT_DECODE_BLOCK
+
+    def write_data_files(self, system_data: Dict, output_dir: Path,
+                         output_name: str) -> Dict[str, Path]:
+        """生成{output_name}.data与{output_name}.in.settings"""
+
+        output_dir.mkdir(exist_ok=True)
+
+        tables = self._build_type_tables(system_data)
+        # 拓扑相同的分子共用一个模板
+        templates = {}
+        for mol_name, canonical in molecule_aliases(system_data['molecules']).items():
+            if canonical in templates:
+                templates[mol_name] = templates[canonical]
+            else:
+                templates[mol_name] = self._build_template(
+                    mol_name, system_data['molecules'][mol_name], tables)
+        instances = self._expand_composition(system_data, templates)
+
+        self._warn_missing_parameters(tables)
+
+        data_file = output_dir / f"{output_name}.data"
+        settings_file = output_dir / f"{output_name}.in.settings"
+
+        self._write_data_file(data_file, system_data, instances, tables)
+        self._write_settings_file(settings_file, tables)
+
+        self.logger.info(f"生成LAMMPS数据文件: {data_file}")
+        self.logger.info(f"生成LAMMPS设置文件: {settings_file}")
+        files = {'data': data_file, 'settings': settings_file}
+        files.update(self._write_extra_files(output_dir, output_name, tables))
+        return files
+
+    def _warn_missing_parameters(self, tables: Dict[str, TypeTable]):
+        """写出前报告被引用但没有力场参数的类型
+
+        没有非键参数的原子类型不会写出pair_coeff，LAMMPS读入时会报
+        "All pair coeffs are not set"，因此原子类型同样检查。
+        """
+        for ff_type, table in tables.items():
+            missing = table.undefined()
+            if not missing:
+                continue
+            if ff_type == 'atom_types':
+                self.logger.warning(f"以下原子类型没有非键参数，不会写出pair_coeff"
+                                    f"（LAMMPS将报All pair coeffs are not set）: {', '.join(missing)}")
+            else:
+                self.logger.warning(f"以下{ff_type}没有力场参数: {', '.join(missing)}")
+
+    def _build_type_tables(self, system_data: Dict) -> Dict[str, TypeTable]:
+        """按力场中的定义顺序为各类类型编号（被合并的类型按type_aliases使用保留类型的编号）"""
+        global_ff = system_data.get('global_force_field', {})
+        aliases = system_data.get('type_aliases', {})
+        tables = {'atom_types': TypeTable(aliases.get('atom_types'))}
+
+        for atom_type, data in global_ff.get('atom_types', {}).items():
+            sigma = data.get('sigma', 0.0) * UNIT_CONVERSIONS['sigma']
+            epsilon = data.get('epsilon', 0.0) * UNIT_CONVERSIONS['epsilon']
+            tables['atom_types'].define(atom_type, f"{epsilon:.6f} {sigma:.6f}")
+
+        for section, (ff_type, _, _) in BONDED_SECTIONS.items():
+            formatter = COEFF_FORMATTERS[ff_type]
+            table = tables[ff_type] = TypeTable(aliases.get(ff_type))
+            types = canonical_type_table(global_ff.get(ff_type, {}), INTERACTION_ATOMS[section])
+            for data in types.values():
+                coeff = formatter(data)
+                if coeff is not None:
+                    table.define(*coeff)
+
+        return tables
+
+    def _build_template(self, mol_name: str, mol_data: Dict,
+                        tables: Dict[str, TypeTable]) -> MoleculeTemplate:
+        """由分子定义生成列式模板，成键项的类型名规则与.lt文件相同"""
+        atoms = mol_data.get('atoms', [])
+        lookup = AtomLookup(atoms)
+
+        atom_table = tables['atom_types']
+        atom_types = np.array([atom_table.use(atom['type']) for atom in atoms], dtype=np.int32)
+        charges = np.array([atom.get('charge', 0.0) * UNIT_CONVERSIONS['charge'] for atom in atoms],
+                           dtype=np.float64)
+        # 没有坐标文件时使用拓扑中的坐标（nm）
+        positions = np.array([[atom.get('x', 0.0), atom.get('y', 0.0), atom.get('z', 0.0)]
+                              for atom in atoms], dtype=np.float64).reshape(-1, 3)
+        positions *= UNIT_CONVERSIONS['length']
+
+        bonded = {}
+        for section, (ff_type, _, _) in BONDED_SECTIONS.items():
+            table = as_interaction_table(mol_data.get(section), INTERACTION_ATOMS[section])
+            located = lookup.locate(table.atoms)
+            found = (located >= 0).all(axis=1)
+
+            if section == 'bonds':
+                # 与.lt文件一致：跳过引用未定义原子的键和自成键
+                keep = found & (table.atoms[:, 0] != table.atoms[:, 1])
+            else:
+                if not found.all():
+                    bad = table.atoms[np.flatnonzero(~found)[0]].tolist()
+                    raise ValueError(f"分子 {mol_name} 的{section}引用了未定义的原子: {bad}")
+                keep = found
+
+            located = located[keep]
+            # 类型编码组合取规范顺序后去重，每种组合只查一次类型表
+            type_codes = lookup.canonical_type_codes(located)
+            combos, inverse = np.unique(type_codes, axis=0, return_inverse=True)
+            combo_ids = []
+            valid = []
+            for combo in combos.tolist():
+                names = [lookup.sorted_types[c] for c in combo]
+                valid.append(section != 'bonds' or all(names))
+                combo_ids.append(tables[ff_type].use('-'.join(names)) if valid[-1] else 0)
+            inverse = inverse.reshape(-1)
+            rows_keep = np.asarray(valid, dtype=bool)[inverse] if len(combos) else np.ones(0, dtype=bool)
+
+            bonded[section] = (
+                lookup.rows[located][rows_keep],
+                np.asarray(combo_ids, dtype=np.int32)[inverse][rows_keep]
+            )
+
+        return MoleculeTemplate(mol_name, atom_types, charges, positions, bonded)
+
+    def _expand_composition(self, system_data: Dict,
+                            templates: Dict[str, MoleculeTemplate]) -> List[Tuple[MoleculeTemplate, int]]:
+        """按system_composition展开为(模板, 数量)列表；没有组成信息时每个分子一个实例"""
+        composition = system_data.get('system_composition')
+        if not composition:
+            return [(template, 1) for template in templates.values()]
+
+        instances = []
+        for mol_name, mol_count in composition:
+            template = templates.get(mol_name)
+            if template is None:
+                self.logger.warning(f"分子 {mol_name} 未在ITP文件中定义，跳过 {mol_count} 个实例")
+                continue
+            instances.append((template, mol_count))
+        return instances
+
+    def _write_data_file(self, data_file: Path, system_data: Dict,
+                         instances: List[Tuple[MoleculeTemplate, int]],
+                         tables: Dict[str, TypeTable]):
+        """写出LAMMPS data文件（atom_style full）"""
+        instances = _split_instances(instances, self.chunk_size)
+        n_atoms = sum(t.n_atoms * count for t, count in instances)
+        counts = {
+            section: sum(len(t.bonded[section][1]) * count for t, count in instances)
+            for section in self.bonded_sections
+        }
+        coordinates = self._coordinate_source(system_data, instances, n_atoms)
+
+        with open_output(data_file, self.buffer_size) as f:
+            f.write(f"LAMMPS data file generated by gro2mol2lmp from GROMACS files\n\n")
+            f.write(f"{n_atoms} atoms\n")
+            for section in self.bonded_sections:
+                f.write(f"{counts[section]} {section}\n")
+            f.write("\n")
+            f.write(f"{len(tables['atom_types'])} atom types\n")
+            for section, (ff_type, _, _) in self.bonded_sections.items():
+                f.write(f"{len(tables[ff_type])} {section[:-1]} types\n")
+            f.write("\n")
+
+            box = self._box_bounds(system_data)
+            for (lo, hi), axis in zip(box, 'xyz'):
+                f.write(f"{lo:.6f} {hi:.6f} {axis}lo {axis}hi\n")
+
+            f.write("\nMasses\n\n")
+            masses = self._atom_type_masses(system_data)
+            for name, type_id in tables['atom_types'].ids.items():
+                f.write(f"{type_id} {masses.get(name, 1.0):.6f}  # {name}\n")
+
+            f.write("\nAtoms  # full\n\n")
+            atom_offset = 0
+            mol_offset = 0
+            for template, count in instances:
+                n = template.n_atoms * count
+                if n:
+                    ids = np.arange(atom_offset + 1, atom_offset + n + 1)
+                    mol_ids = np.repeat(np.arange(mol_offset + 1, mol_offset + count + 1),
+                                        template.n_atoms)
+                    positions = next(coordinates) if coordinates is not None else \
+                        np.tile(template.positions, (count, 1))
+                    write_fixed_rows(f, f"%d %d %d %.6f {self.coordinate_format}\n", [
+                        ids, mol_ids, np.tile(template.atom_types, count),
+                        np.tile(template.charges, count),
+                        positions[:, 0], positions[:, 1], positions[:, 2]
+                    ])
+                atom_offset += n
+                mol_offset += count
+
+            velocities = self._velocities(system_data, n_atoms)
+            if velocities is not None:
+                f.write("\nVelocities\n\n")
+                write_fixed_rows(f, f"%d {coordinate_format(VELOCITY_PRECISION)}\n", [
+                    np.arange(1, n_atoms + 1), velocities[:, 0], velocities[:, 1], velocities[:, 2]
+                ])
+
+            for section, (_, title, _) in self.bonded_sections.items():
+                if not counts[section]:
+                    continue
+                f.write(f"\n{title}\n\n")
+                fmt = "%d %d" + " %d" * SECTION_ATOMS[section] + "\n"
+                serial = 0
+                atom_offset = 0
+                for template, count in instances:
+                    rows, type_ids = template.bonded[section]
+                    n = len(type_ids) * count
+                    if n:
+                        # 第i个实例的原子编号 = 模板行号 + 偏移 + 1
+                        offsets = np.repeat(atom_offset + 1 + template.n_atoms * np.arange(count),
+                                            len(type_ids))
+                        atoms = np.tile(rows, (count, 1)) + offsets[:, None]
+                        write_rows(f, fmt, [
+                            np.arange(serial + 1, serial + n + 1), np.tile(type_ids, count)
+                        ] + [atoms[:, c] for c in range(atoms.shape[1])])
+                    serial += n
+                    atom_offset += template.n_atoms * count
+
+    def _write_settings_file(self, settings_file: Path, tables: Dict[str, TypeTable]):
+        """写出力场参数（pair_coeff及各成键coeff）"""
+        with open(settings_file, 'w') as f:
+            f.write("# LAMMPS settings generated by gro2mol2lmp from GROMACS files\n\n")
+
+            atom_table = tables['atom_types']
+            for name, type_id in atom_table.ids.items():
+                for coeff in atom_table.coeffs.get(name, []):
+                    f.write(f"pair_coeff {type_id} {type_id} {coeff}  # {name}\n")
+
+            self._write_bonded_coeffs(f, tables)
+
+    def _write_bonded_coeffs(self, f, tables: Dict[str, TypeTable]):
+        """写出各成键类型的coeff命令"""
+        for ff_type, _, command in self.bonded_sections.values():
+            table = tables[ff_type]
+            if table.coeffs:
+                f.write("\n")
+            for name, type_id in table.ids.items():
+                for coeff in table.coeffs.get(name, []):
+                    f.write(f"{command} {type_id} {coeff}  # {name}\n")
+
+    def _write_extra_files(self, output_dir: Path, output_name: str,
+                           tables: Dict[str, TypeTable]) -> Dict[str, Path]:
+        """写出data/settings之外的文件，返回{名称: 路径}"""
+        return {}
+
+    def _atom_type_masses(self, system_data: Dict) -> Dict[str, float]:
+        """原子类型的质量：优先使用力场定义，否则取分子中第一个该类型原子的质量"""
+        global_ff = system_data.get('global_force_field', {})
+        masses = {}
+        for mol_data in system_data['molecules'].values():
+            for atom in mol_data.get('atoms', []):
+                masses.setdefault(atom['type'], atom.get('mass', 1.0) * UNIT_CONVERSIONS['mass'])
+        for name, data in global_ff.get('atom_types', {}).items():
+            masses[name] = data.get('mass', 1.0) * UNIT_CONVERSIONS['mass']
+        return masses
+
+    def _box_bounds(self, system_data: Dict) -> List[Tuple[float, float]]:
+        """盒子边界（Angstrom）"""
+        box = system_data.get('box_vectors')
+        if box:
+            return [(0.0, float(length)) for length in box[:3]]
+        self.logger.warning("没有盒子尺寸信息，使用默认盒子")
+        return [(0.0, 1.0)] * 3
+
+    def _velocities(self, system_data: Dict, n_atoms: int) -> Optional[np.ndarray]:
+        """坐标文件中的速度（Angstrom/fs，按原子ID顺序）；没有速度时返回None"""
+        table = system_data.get('coordinate_table')
+        velocities = getattr(table, 'velocities', None)
+        if velocities is None:
+            return None
+        if len(velocities) != n_atoms:
+            raise ValueError(f"坐标文件的速度数({len(velocities)})与拓扑中的原子数({n_atoms})不一致")
+        return velocities
+
+    def _coordinate_source(self, system_data: Dict,
+                           instances: List[Tuple[MoleculeTemplate, int]],
+                           n_atoms: int) -> Optional[Iterator[np.ndarray]]:
+        """按实例块依次产生坐标（Angstrom）；没有坐标文件时返回None"""
+        if 'coordinate_chunks' in system_data:
+            n_coordinates = system_data['n_coordinates']
+            blocks = (chunk.positions for chunk in system_data['coordinate_chunks'])
+        elif system_data.get('coordinate_table') is not None:
+            n_coordinates = len(system_data['coordinate_table'])
+            blocks = iter([system_data['coordinate_table'].positions])
+        elif system_data.get('coordinates'):
+            coordinates = system_data['coordinates']
+            n_coordinates = len(coordinates)
+            blocks = iter([np.array([[atom.x, atom.y, atom.z] for atom in coordinates],
+                                    dtype=np.float64)])
+        else:
+            return None
+
+        if n_coordinates != n_atoms:
+            raise ValueError(f"坐标文件原子数({n_coordinates})与拓扑中的原子数({n_atoms})不一致")
+        sizes = [t.n_atoms * count for t, count in instances if t.n_atoms * count]
+        return _regroup(blocks, sizes)
+
+
+def _split_instances(instances: List[Tuple[MoleculeTemplate, int]],
+                     chunk_size: int) -> List[Tuple[MoleculeTemplate, int]]:
+    """将(模板, 数量)切分为每块不超过chunk_size个原子（至少一个分子）的连续实例块"""
+    blocks = []
+    for template, count in instances:
+        per_block = max(1, chunk_size // template.n_atoms) if template.n_atoms else max(count, 1)
+        for start in range(0, count, per_block):
+            blocks.append((template, min(per_block, count - start)))
+    return blocks
+
+
+def _regroup(blocks: Iterator[np.ndarray], sizes: List[int]) -> Iterator[np.ndarray]:
+    """将任意大小的坐标块重新切分为指定大小"""
+    pending = []
+    n_pending = 0
+    for size in sizes:
+        while n_pending < size:
+            block = next(blocks)
+            pending.append(block)
+            n_pending += len(block)
+        merged = pending[0] if len(pending) == 1 else np.concatenate(pending)
+        yield merged[:size]
+        pending = [merged[size:]]
+        n_pending = len(pending[0])
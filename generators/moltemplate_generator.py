@@ -4,10 +4,13 @@ Moltemplate文件生成器
 根据解析的GROMACS数据生成.lt文件
 """
 
+import hashlib
+import logging
 import os
 import sys
 from pathlib import Path
-from typing import Dict, List, Any
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Any, Optional, Tuple
 from textwrap import dedent
 
 # 添加父目录到路径以便导入config
@@ -15,6 +18,14 @@ current_dir = Path(__file__).parent
 parent_dir = current_dir.parent
 sys.path.insert(0, str(parent_dir))
 
+import numpy as np
+
+from generators.atom_lookup import AtomLookup, custom_ff_atom_name, standard_ff_atom_name
+from generators.bulk_writer import coordinate_format, open_output, write_fixed_rows, write_rows
+from generators.output_manifest import OutputManifest, input_key
+from parsers.interaction_table import as_interaction_table, canonical_type_table
+from parsers.molecule_fingerprint import molecule_aliases, molecule_fingerprint
+
 try:
     from config import UNIT_CONVERSIONS
 except ImportError:
@@ -31,11 +42,41 @@ except ImportError:
         'angle_degree_to_radian': 3.14159265359 / 180.0,
     }
 
+
+def _array_digest(*arrays: np.ndarray) -> str:
+    h = hashlib.sha1()
+    for array in arrays:
+        h.update(f"{array.dtype.str}{array.shape}".encode())
+        h.update(np.ascontiguousarray(array).tobytes())
+    return h.hexdigest()
+
+
+def _write_molecule_worker(task: Tuple) -> Optional[OutputManifest]:
+    """进程池任务：写出单个分子的.lt文件，返回子进程中记录的清单结果"""
+    method, settings, manifest, lt_file, args = task
+    generator = MoltemplateGenerator(logging.getLogger('gro2mol2lmp'), **settings)
+    generator.manifest = manifest
+    getattr(generator, method)(lt_file, *args)
+    return manifest
+
+
 class MoltemplateGenerator:
     """Moltemplate文件生成器"""
     
-    def __init__(self, logger):
+    def __init__(self, logger, buffer_size: Optional[int] = None,
+                 coordinate_precision: Optional[int] = None, jobs: int = 1,
+                 incremental: bool = False):
         self.logger = logger
+        # 输出文件的写入缓冲区大小（None时使用配置中的write_buffer_size）
+        self.buffer_size = buffer_size
+        # 坐标的小数位数（None时使用配置中的coordinate_precision）
+        self.coordinate_precision = coordinate_precision
+        self.coordinate_format = coordinate_format(coordinate_precision)
+        # 并行写出分子.lt文件的进程数
+        self.jobs = max(1, jobs)
+        # 增量生成：按输出清单跳过或保留内容未变的文件（见OutputManifest）
+        self.incremental = incremental
+        self.manifest: Optional[OutputManifest] = None
         
     def generate_moltemplate_files(self, system_data: Dict, force_field_data: Dict,
                                  output_dir: Path, output_name: str, 
@@ -44,13 +85,16 @@ class MoltemplateGenerator:
         
         # 创建输出目录
         output_dir.mkdir(exist_ok=True)
+        self.manifest = OutputManifest(output_dir, output_name, self.logger, enabled=self.incremental)
         
         is_standard_ff = not custom_ff and force_field_data.get('type') == 'standard'
+        # 拓扑相同的分子共用一份定义（标准力场的简化.lt没有系统文件，不做合并）
+        molecule_aliases = None if is_standard_ff else self._molecule_aliases(system_data)
         
         if custom_ff:
             # 生成完整的.lt文件（包含力场定义）
             self._generate_complete_lt_file(system_data, force_field_data, 
-                                          output_dir, output_name)
+                                          output_dir, output_name, molecule_aliases)
         elif is_standard_ff:
             # 生成使用标准力场的简化.lt文件（只有Bond List）
             self._generate_standard_ff_molecule_files(system_data, force_field_data,
@@ -58,11 +102,11 @@ class MoltemplateGenerator:
         else:
             # 生成使用标准力场的.lt文件
             self._generate_standard_lt_file(system_data, force_field_data,
-                                          output_dir, output_name)
+                                          output_dir, output_name, molecule_aliases)
         
         # 仅在有系统组成信息时生成系统级别的.lt文件
         if 'system_composition' in system_data and not is_standard_ff:
-            self._generate_system_lt_file(system_data, output_dir, output_name)
+            self._generate_system_lt_file(system_data, output_dir, output_name, molecule_aliases)
         
         # 复制或转换坐标文件
         self._handle_coordinate_file(system_data, output_dir, output_name)
@@ -70,55 +114,131 @@ class MoltemplateGenerator:
         # 生成运行脚本
         self._generate_run_script(output_dir, output_name)
         
+        self.manifest.save()
         self.logger.info("Moltemplate文件生成完成")
     
+    def _molecule_aliases(self, system_data: Dict) -> Dict[str, str]:
+        """分子名称 -> 拓扑相同的分子中最先定义的名称，重复的定义只写出一次"""
+        aliases = molecule_aliases(system_data['molecules'])
+        for mol_name, canonical in aliases.items():
+            if mol_name != canonical:
+                self.logger.info(f"分子 {mol_name} 的拓扑与 {canonical} 相同，复用 {canonical} 的定义")
+        return aliases
+    
+    def _write_molecule_files(self, method: str, tasks: List[Tuple[Path, Tuple]], label: str):
+        """逐个分子写出.lt文件，jobs>1时在进程池中并行格式化与写出
+        
+        tasks为(输出文件, 写出方法的其余参数)列表，参数的第2项为分子数据。
+        每个文件只由一个进程写出，内容与进程数无关；大分子先提交以均衡负载，
+        日志仍按分子顺序输出。增量生成时，输入未变的分子文件直接跳过。
+        """
+        if self.manifest is not None and self.manifest.enabled:
+            pending = []
+            for lt_file, args in tasks:
+                inputs = self._molecule_inputs(method, lt_file, args)
+                if self.manifest.is_current(lt_file, inputs):
+                    self.logger.info(f"分子输入未变，跳过: {lt_file}")
+                    continue
+                self.manifest.expect(lt_file, inputs)
+                pending.append((lt_file, args))
+            tasks = pending
+        
+        n_workers = min(self.jobs, len(tasks))
+        if n_workers <= 1:
+            for lt_file, args in tasks:
+                getattr(self, method)(lt_file, *args)
+                self.logger.info(f"{label}: {lt_file}")
+            return
+        
+        self.logger.info(f"使用 {n_workers} 个进程并行生成 {len(tasks)} 个分子文件")
+        settings = {'buffer_size': self.buffer_size,
+                    'coordinate_precision': self.coordinate_precision}
+        manifest = self.manifest.fork() if self.manifest is not None else None
+        order = sorted(range(len(tasks)), key=lambda i: -len(tasks[i][1][1].get('atoms', [])))
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {i: executor.submit(_write_molecule_worker,
+                                          (method, settings, manifest, tasks[i][0], tasks[i][1]))
+                       for i in order}
+            for i, (lt_file, _) in enumerate(tasks):
+                result = futures[i].result()
+                if result is not None:
+                    self.manifest.merge(result)
+                self.logger.info(f"{label}: {lt_file}")
+    
+    def _molecule_inputs(self, method: str, lt_file: Path, args: Tuple) -> str:
+        """分子文件的输入键：分子拓扑指纹、其余写出参数与输出设置"""
+        mol_name, mol_data = args[:2]
+        return input_key(method, lt_file.name, mol_name, molecule_fingerprint(mol_data),
+                         args[2:], self.coordinate_precision)
+    
+    def _open_output(self, path: Path):
+        """打开输出文件；增量生成时内容未变的文件不会被改写"""
+        if self.manifest is None:
+            return open_output(path, self.buffer_size)
+        return self.manifest.open(path, buffer_size=self.buffer_size)
+    
     def _generate_complete_lt_file(self, system_data: Dict, force_field_data: Dict,
-                                 output_dir: Path, output_name: str):
-        """生成包含自定义力场的完整.lt文件"""
+                                 output_dir: Path, output_name: str,
+                                 molecule_aliases: Optional[Dict[str, str]] = None):
+        """生成包含自定义力场的完整.lt文件（拓扑相同的分子只生成一份）"""
         
         # 生成共享的力场文件
         force_field_file = self._generate_shared_force_field_file(
             system_data, output_dir, output_name
         )
         
+        # 被合并的类型名 -> 保留的类型名（见ForceFieldManager.collapse_identical_types）
+        aliases = system_data.get('type_aliases', {})
+        
         # 为每个分子生成单独的.lt文件
-        for mol_name, mol_data in system_data['molecules'].items():
-            lt_file = output_dir / f"{mol_name}.lt"
-            
-            with open(lt_file, 'w') as f:
-                # 写入文件头部
-                f.write(self._get_file_header(mol_name, custom_ff=True))
-                
-                # 导入共享力场文件
-                if force_field_file:
-                    f.write(f'import "{force_field_file.name}"\n\n')
-                
-                # 写入分子定义
-                f.write(f"{mol_name} inherits ForceField {{\n\n")
-                
-                # 写入原子
-                if 'atoms' in mol_data and mol_data['atoms']:
-                    f.write("  # 原子定义\n")
-                    self._write_atoms_for_custom_ff(f, mol_data['atoms'])
-                
-                # 写入键
-                if 'bonds' in mol_data and mol_data['bonds']:
-                    f.write("\n  # 键定义\n")
-                    self._write_bonds_for_custom_ff(f, mol_data['bonds'], mol_data.get('atoms', []))
-                
-                # 写入角度
-                if 'angles' in mol_data and mol_data['angles']:
-                    f.write("\n  # 角度定义\n")
-                    self._write_angles_for_custom_ff(f, mol_data['angles'], mol_data.get('atoms', []))
-                
-                # 写入二面角
-                if 'dihedrals' in mol_data and mol_data['dihedrals']:
-                    f.write("\n  # 二面角定义\n")
-                    self._write_dihedrals_for_custom_ff(f, mol_data['dihedrals'], mol_data.get('atoms', []))
-                
-                f.write("\n}\n")
+        force_field_name = force_field_file.name if force_field_file else None
+        tasks = [(output_dir / f"{mol_name}.lt", (mol_name, mol_data, force_field_name, aliases))
+                 for mol_name, mol_data in system_data['molecules'].items()
+                 if not molecule_aliases or molecule_aliases.get(mol_name, mol_name) == mol_name]
+        self._write_molecule_files('_write_complete_lt_file', tasks, "生成分子.lt文件")
+    
+    def _write_complete_lt_file(self, lt_file: Path, mol_name: str, mol_data: Dict,
+                                force_field_name: Optional[str], aliases: Dict):
+        """写出一个包含自定义力场的分子.lt文件"""
+        with self._open_output(lt_file) as f:
+            # 写入文件头部
+            f.write(self._get_file_header(mol_name, custom_ff=True))
+            
+            # 导入共享力场文件
+            if force_field_name:
+                f.write(f'import "{force_field_name}"\n\n')
+            
+            # 写入分子定义
+            f.write(f"{mol_name} inherits ForceField {{\n\n")
+            
+            # 原子索引查找表，各成键项共用
+            lookup = AtomLookup(mol_data.get('atoms', []))
+            
+            # 写入原子
+            if 'atoms' in mol_data and mol_data['atoms']:
+                f.write("  # 原子定义\n")
+                self._write_atoms_for_custom_ff(f, mol_data['atoms'],
+                                                aliases.get('atom_types'))
+            
+            # 写入键
+            if 'bonds' in mol_data and mol_data['bonds']:
+                f.write("\n  # 键定义\n")
+                self._write_bonds_for_custom_ff(f, mol_data['bonds'], lookup,
+                                                aliases.get('bond_types'))
+            
+            # 写入角度
+            if 'angles' in mol_data and mol_data['angles']:
+                f.write("\n  # 角度定义\n")
+                self._write_angles_for_custom_ff(f, mol_data['angles'], lookup,
+                                                 aliases.get('angle_types'))
+            
+            # 写入二面角
+            if 'dihedrals' in mol_data and mol_data['dihedrals']:
+                f.write("\n  # 二面角定义\n")
+                self._write_dihedrals_for_custom_ff(f, mol_data['dihedrals'], lookup,
+                                                    aliases.get('dihedral_types'))
             
-            self.logger.info(f"生成分子.lt文件: {lt_file}")
+            f.write("\n}\n")
     
     def _generate_shared_force_field_file(self, system_data: Dict, output_dir: Path, 
                                         output_name: str) -> Path:
@@ -137,7 +257,7 @@ class MoltemplateGenerator:
             self.logger.warning("没有找到力场参数，跳过力场文件生成")
             return None
         
-        with open(force_field_file, 'w') as f:
+        with self._open_output(force_field_file) as f:
             # 写入力场文件头部
             f.write(self._get_force_field_file_header(output_name))
             
@@ -170,55 +290,64 @@ class MoltemplateGenerator:
         return force_field_file
     
     def _generate_standard_lt_file(self, system_data: Dict, force_field_data: Dict,
-                                 output_dir: Path, output_name: str):
-        """生成使用标准力场的.lt文件"""
+                                 output_dir: Path, output_name: str,
+                                 molecule_aliases: Optional[Dict[str, str]] = None):
+        """生成使用标准力场的.lt文件（拓扑相同的分子只生成一份）"""
         
         force_field_name = force_field_data.get('name', 'gaff2')
         
-        for mol_name, mol_data in system_data['molecules'].items():
-            lt_file = output_dir / f"{mol_name}.lt"
+        tasks = [(output_dir / f"{mol_name}.lt", (mol_name, mol_data, force_field_name))
+                 for mol_name, mol_data in system_data['molecules'].items()
+                 if not molecule_aliases or molecule_aliases.get(mol_name, mol_name) == mol_name]
+        self._write_molecule_files('_write_standard_lt_file', tasks, "生成标准力场.lt文件")
+    
+    def _write_standard_lt_file(self, lt_file: Path, mol_name: str, mol_data: Dict,
+                                force_field_name: str):
+        """写出一个引用标准力场类型的分子.lt文件"""
+        with self._open_output(lt_file) as f:
+            # 写入文件头部
+            f.write(self._get_file_header(mol_name, custom_ff=False))
             
-            with open(lt_file, 'w') as f:
-                # 写入文件头部
-                f.write(self._get_file_header(mol_name, custom_ff=False))
-                
-                # 导入标准力场
-                f.write(f'import "{force_field_name}.lt"\n\n')
-                
-                # 写入分子定义
-                f.write(f"{mol_name} inherits {force_field_name.upper()} {{\n\n")
-                
-                # 写入原子（仅包含坐标和类型）
-                if 'atoms' in mol_data:
-                    f.write("  # 原子定义\n")
-                    self._write_atoms_for_standard_ff(f, mol_data['atoms'])
-                
-                # 写入键（引用力场中的类型）
-                if 'bonds' in mol_data:
-                    f.write("\n  # 键定义\n")
-                    self._write_bonds_for_standard_ff(f, mol_data['bonds'])
-                
-                # 写入角度
-                if 'angles' in mol_data:
-                    f.write("\n  # 角度定义\n")
-                    self._write_angles_for_standard_ff(f, mol_data['angles'])
-                
-                # 写入二面角
-                if 'dihedrals' in mol_data:
-                    f.write("\n  # 二面角定义\n")
-                    self._write_dihedrals_for_standard_ff(f, mol_data['dihedrals'])
-                
-                f.write("\n}\n")
+            # 导入标准力场
+            f.write(f'import "{force_field_name}.lt"\n\n')
+            
+            # 写入分子定义
+            f.write(f"{mol_name} inherits {force_field_name.upper()} {{\n\n")
             
-            self.logger.info(f"生成标准力场.lt文件: {lt_file}")
+            # 写入原子（仅包含坐标和类型）
+            if 'atoms' in mol_data:
+                f.write("  # 原子定义\n")
+                self._write_atoms_for_standard_ff(f, mol_data['atoms'])
+            
+            # 写入键（引用力场中的类型）
+            if 'bonds' in mol_data:
+                f.write("\n  # 键定义\n")
+                self._write_bonds_for_standard_ff(f, mol_data['bonds'])
+            
+            # 写入角度
+            if 'angles' in mol_data:
+                f.write("\n  # 角度定义\n")
+                self._write_angles_for_standard_ff(f, mol_data['angles'])
+            
+            # 写入二面角
+            if 'dihedrals' in mol_data:
+                f.write("\n  # 二面角定义\n")
+                self._write_dihedrals_for_standard_ff(f, mol_data['dihedrals'])
+            
+            f.write("\n}\n")
     
     def _generate_system_lt_file(self, system_data: Dict, output_dir: Path, 
-                               output_name: str):
-        """生成系统级别的.lt文件（标准moltemplate格式）"""
+                               output_name: str,
+                               molecule_aliases: Optional[Dict[str, str]] = None):
+        """生成系统级别的.lt文件（标准moltemplate格式）
+        
+        molecule_aliases中指向其他分子的名称不单独导入，实例化时使用其指向的分子定义。
+        """
+        molecule_aliases = molecule_aliases or {}
         
         system_file = output_dir / f"{output_name}.lt"
         
-        with open(system_file, 'w') as f:
+        with self._open_output(system_file) as f:
             # 写入文件头部
             f.write(self._get_system_file_header(output_name))
             
@@ -229,6 +358,8 @@ class MoltemplateGenerator:
             
             # 导入分子定义
             for mol_name in system_data['molecules'].keys():
+                if molecule_aliases.get(mol_name, mol_name) != mol_name:
+                    continue
                 f.write(f'import "{mol_name}.lt"  # <- defines the "{mol_name}" molecule type\n')
             
             # 写入盒子尺寸（在分子实例化之前）
@@ -255,8 +386,11 @@ class MoltemplateGenerator:
                     if mol_name in system_data['molecules']:
                         # 使用标准moltemplate格式：molecules = new MoleculeType [count]
                         var_name = mol_name.lower() + 's' if not mol_name.lower().endswith('s') else mol_name.lower()
+                        definition = molecule_aliases.get(mol_name, mol_name)
                         f.write(f"# Create {mol_count} \"{mol_name}\" molecules\n")
-                        f.write(f"{var_name} = new {mol_name} [{mol_count}]\n\n")
+                        if definition != mol_name:
+                            f.write(f"# \"{mol_name}\" has the same topology as \"{definition}\"\n")
+                        f.write(f"{var_name} = new {definition} [{mol_count}]\n\n")
                     else:
                         # 对于未解析的分子类型，添加注释
                         self.logger.warning(f"分子 {mol_name} 未在ITP文件中定义，但仍包含在系统中")
@@ -274,25 +408,61 @@ class MoltemplateGenerator:
         xyz_file = output_dir / f"{output_name}.xyz"
         
         coordinates = system_data.get('coordinates', [])
-        
-        with open(xyz_file, 'w') as f:
-            f.write(f"{len(coordinates)}\n")
-            f.write(f"Generated from GROMACS files\n")
-            
-            for atom in coordinates:
-                # 简化原子类型名称
-                atom_type = atom.name
-                f.write(f"{atom_type} {atom.x:.6f} {atom.y:.6f} {atom.z:.6f}\n")
+        table = system_data.get('coordinate_table')
+        chunks = system_data.get('coordinate_chunks')
+
+        if chunks is None and table is not None and self.manifest is not None:
+            # 列式坐标可直接哈希，坐标未变时跳过格式化
+            inputs = input_key('xyz', len(coordinates), table.atom_names, self.coordinate_precision,
+                               _array_digest(table.atom_name_codes, table.positions))
+            if self.manifest.is_current(xyz_file, inputs):
+                self.logger.info(f"坐标未变，跳过: {xyz_file}")
+                return
+            self.manifest.expect(xyz_file, inputs)
+
+        with self._open_output(xyz_file) as f:
+            if chunks is not None:
+                # 流式模式：逐块写出，不保留完整坐标
+                f.write(f"{system_data['n_coordinates']}\n")
+                f.write(f"Generated from GROMACS files\n")
+                for chunk in chunks:
+                    self._write_xyz_table(f, chunk)
+            else:
+                f.write(f"{len(coordinates)}\n")
+                f.write(f"Generated from GROMACS files\n")
+
+                if table is not None:
+                    # 直接使用列式数组，避免创建Atom对象
+                    self._write_xyz_table(f, table)
+                else:
+                    write_fixed_rows(f, f"%s {self.coordinate_format}\n", [
+                        [atom.name for atom in coordinates],
+                        [atom.x for atom in coordinates],
+                        [atom.y for atom in coordinates],
+                        [atom.z for atom in coordinates],
+                    ])
         
         self.logger.info(f"生成坐标文件: {xyz_file}")
     
+    def _write_xyz_table(self, f, table):
+        """将列式坐标表写为xyz行"""
+        positions = table.positions
+        try:
+            # 原子名按名称表编码一次后取出，避免逐原子转换字符串
+            names = np.array(table.atom_names, dtype='S')[table.atom_name_codes]
+        except UnicodeEncodeError:
+            names = table.atom_name_array()
+        write_fixed_rows(f, f"%s {self.coordinate_format}\n", [
+            names, positions[:, 0], positions[:, 1], positions[:, 2]
+        ])
+    
     def _generate_run_script(self, output_dir: Path, output_name: str):
         """生成运行脚本"""
         
         # 生成moltemplate运行脚本
         script_file = output_dir / "run_moltemplate.sh"
         
-        with open(script_file, 'w') as f:
+        with self._open_output(script_file) as f:
             f.write("#!/bin/bash\n")
             f.write("# Moltemplate 运行脚本\n\n")
             f.write("# 清理之前的输出文件\n")
@@ -315,7 +485,7 @@ class MoltemplateGenerator:
         # 生成Python运行脚本
         py_script_file = output_dir / "run_moltemplate.py"
         
-        with open(py_script_file, 'w') as f:
+        with self._open_output(py_script_file) as f:
             f.write(dedent(f"""
             #!/usr/bin/env python3
             # -*- coding: utf-8 -*-
@@ -440,14 +610,12 @@ class MoltemplateGenerator:
         """写入键类型定义，应用单位转换"""
         f.write(f"{indent}write_once(\"In Settings\") {{\n")
         
-        for bond_key, data in bond_types.items():
-            atom1, atom2 = data['atom1'], data['atom2']
+        for bond_type, data in canonical_type_table(bond_types, 2).items():
             params = data.get('parameters', [])
             if len(params) >= 2:
                 # 应用单位转换：kJ/mol/nm² -> kcal/mol/Å², nm -> Angstrom
                 r0 = params[0] * UNIT_CONVERSIONS['length']          # 平衡键长 (nm -> Å)
                 k_bond = params[1] * UNIT_CONVERSIONS['bond_force']  # 力常数 (kJ/mol/nm² -> kcal/mol/Å²)
-                bond_type = f"{atom1}-{atom2}"
                 f.write(f"{indent}  bond_coeff @bond:{bond_type} {k_bond:.6f} {r0:.6f}\n")
         
         f.write(f"{indent}}}\n")
@@ -456,14 +624,12 @@ class MoltemplateGenerator:
         """写入角度类型定义，应用单位转换"""
         f.write(f"{indent}write_once(\"In Settings\") {{\n")
         
-        for angle_key, data in angle_types.items():
-            atom1, atom2, atom3 = data['atom1'], data['atom2'], data['atom3']
+        for angle_type, data in canonical_type_table(angle_types, 3).items():
             params = data.get('parameters', [])
             if len(params) >= 2:
                 # 应用单位转换：kJ/mol/rad² -> kcal/mol/rad²
                 k_angle = params[0] * UNIT_CONVERSIONS['angle_force']  # 力常数
                 theta0 = params[1]   # 平衡角度 (度，moltemplate中仍然使用度)
-                angle_type = f"{atom1}-{atom2}-{atom3}"
                 f.write(f"{indent}  angle_coeff @angle:{angle_type} {k_angle:.6f} {theta0:.6f}\n")
         
         f.write(f"{indent}}}\n")
@@ -472,15 +638,13 @@ class MoltemplateGenerator:
         """写入二面角类型定义，应用单位转换"""
         f.write(f"{indent}write_once(\"In Settings\") {{\n")
         
-        for dihedral_key, data in dihedral_types.items():
-            atoms = [data['atom1'], data['atom2'], data['atom3'], data['atom4']]
+        for dihedral_type, data in canonical_type_table(dihedral_types, 4).items():
             params = data.get('parameters', [])
             if len(params) >= 3:
                 # 应用单位转换：kJ/mol -> kcal/mol
                 k_dihedral = params[0] * UNIT_CONVERSIONS['energy']  # 力常数
                 multiplicity = int(params[1])  # 重数
                 phase = params[2]       # 相位角 (度)
-                dihedral_type = f"{atoms[0]}-{atoms[1]}-{atoms[2]}-{atoms[3]}"
                 f.write(f"{indent}  dihedral_coeff @dihedral:{dihedral_type} {k_dihedral:.6f} {multiplicity} {phase:.6f}\n")
         
         f.write(f"{indent}}}\n")
@@ -489,12 +653,12 @@ class MoltemplateGenerator:
         """写入原子定义（自定义力场）"""
         f.write("  write(\"Data Atoms\") {\n")
         
-        for atom in atoms:
-            atom_id = atom['index']
-            atom_type = atom['type']
-            charge = atom.get('charge', 0.0)
-            # 坐标会从坐标文件中读取
-            f.write(f"    ${atom_id} 1 {atom_type} {charge:.6f} 0.0 0.0 0.0\n")
+        # 坐标会从坐标文件中读取
+        write_rows(f, "    $%s 1 %s %.6f 0.0 0.0 0.0\n", [
+            [atom['index'] for atom in atoms],
+            [atom['type'] for atom in atoms],
+            [atom.get('charge', 0.0) for atom in atoms],
+        ])
         
         f.write("  }\n")
     
@@ -502,11 +666,12 @@ class MoltemplateGenerator:
         """写入原子定义（标准力场）"""
         f.write("  write(\"Data Atoms\") {\n")
         
-        for atom in atoms:
-            atom_id = atom['index']
-            atom_type = f"@atom:{atom['type']}"  # 使用力场中定义的原子类型
-            charge = atom.get('charge', 0.0)
-            f.write(f"    ${atom_id} $mol:{atom_type} {charge:.6f} 0.0 0.0 0.0\n")
+        # 使用力场中定义的原子类型
+        write_rows(f, "    $%s $mol:@atom:%s %.6f 0.0 0.0 0.0\n", [
+            [atom['index'] for atom in atoms],
+            [atom['type'] for atom in atoms],
+            [atom.get('charge', 0.0) for atom in atoms],
+        ])
         
         f.write("  }\n")
     
@@ -514,11 +679,11 @@ class MoltemplateGenerator:
         """写入键定义（自定义力场）"""
         f.write("  write(\"Data Bonds\") {\n")
         
-        for i, bond in enumerate(bonds, 1):
-            atom1 = bond['atom1']
-            atom2 = bond['atom2']
-            bond_type = f"bond_{atom1}_{atom2}"  # 简化的键类型名
-            f.write(f"    ${i} {bond_type} ${atom1} ${atom2}\n")
+        # 简化的键类型名bond_{atom1}_{atom2}
+        atoms = as_interaction_table(bonds, 2).atoms
+        write_rows(f, "    $%d bond_%d_%d $%d $%d\n", [
+            np.arange(1, len(atoms) + 1), atoms[:, 0], atoms[:, 1], atoms[:, 0], atoms[:, 1]
+        ])
         
         f.write("  }\n")
     
@@ -526,10 +691,8 @@ class MoltemplateGenerator:
         """写入键定义（标准力场）"""
         f.write("  write(\"Data Bonds\") {\n")
         
-        for i, bond in enumerate(bonds, 1):
-            atom1 = bond['atom1']
-            atom2 = bond['atom2']
-            f.write(f"    ${i} @bond:type1 ${atom1} ${atom2}\n")  # 使用通用键类型
+        # 使用通用键类型
+        self._write_numbered_rows(f, "    $%d @bond:type1 $%d $%d\n", as_interaction_table(bonds, 2).atoms)
         
         f.write("  }\n")
     
@@ -537,11 +700,8 @@ class MoltemplateGenerator:
         """写入角度定义"""
         f.write("  write(\"Data Angles\") {\n")
         
-        for i, angle in enumerate(angles, 1):
-            atom1 = angle['atom1']
-            atom2 = angle['atom2']
-            atom3 = angle['atom3']
-            f.write(f"    ${i} @angle:type1 ${atom1} ${atom2} ${atom3}\n")
+        self._write_numbered_rows(f, "    $%d @angle:type1 $%d $%d $%d\n",
+                                  as_interaction_table(angles, 3).atoms)
         
         f.write("  }\n")
     
@@ -553,12 +713,8 @@ class MoltemplateGenerator:
         """写入二面角定义"""
         f.write("  write(\"Data Dihedrals\") {\n")
         
-        for i, dihedral in enumerate(dihedrals, 1):
-            atom1 = dihedral['atom1']
-            atom2 = dihedral['atom2']
-            atom3 = dihedral['atom3']
-            atom4 = dihedral['atom4']
-            f.write(f"    ${i} @dihedral:type1 ${atom1} ${atom2} ${atom3} ${atom4}\n")
+        self._write_numbered_rows(f, "    $%d @dihedral:type1 $%d $%d $%d $%d\n",
+                                  as_interaction_table(dihedrals, 4).atoms)
         
         f.write("  }\n")
     
@@ -566,112 +722,92 @@ class MoltemplateGenerator:
         """写入二面角定义（标准力场）"""
         self._write_dihedrals(f, dihedrals)  # 使用相同的格式
     
-    def _write_atoms_for_custom_ff(self, f, atoms: List[Dict]):
-        """写入原子定义（自定义力场，继承ForceField）"""
+    def _write_numbered_rows(self, f, fmt: str, atoms: np.ndarray):
+        """写出带序号的原子编号行（序号从1开始）"""
+        write_rows(f, fmt, [np.arange(1, len(atoms) + 1)] + [atoms[:, c] for c in range(atoms.shape[1])])
+    
+    def _write_atoms_for_custom_ff(self, f, atoms: List[Dict],
+                                   aliases: Optional[Dict[str, str]] = None):
+        """写入原子定义（自定义力场，继承ForceField；aliases为被合并的类型名 -> 保留的类型名）"""
         f.write("  write(\"Data Atoms\") {\n")
+        aliases = aliases or {}
         
-        for atom in atoms:
-            atom_name = atom.get('name', f"{atom['type']}{atom['index']}")
-            atom_type = f"@atom:{atom['type']}"  # 引用ForceField中的原子类型
-            charge = atom.get('charge', 0.0) * UNIT_CONVERSIONS['charge']
-            # 坐标会从坐标文件中读取，使用正确的格式
-            f.write(f"    $atom:{atom_name} $mol:. {atom_type} {charge:.3f} 0.0 0.0 0.0\n")
+        # 原子类型引用ForceField中的类型；坐标会从坐标文件中读取
+        write_rows(f, "    $atom:%s $mol:. @atom:%s %.3f 0.0 0.0 0.0\n", [
+            [custom_ff_atom_name(atom) for atom in atoms],
+            [aliases.get(atom['type'], atom['type']) for atom in atoms],
+            np.array([atom.get('charge', 0.0) for atom in atoms], dtype=np.float64)
+            * UNIT_CONVERSIONS['charge'],
+        ])
         
         f.write("  }\n")
     
-    def _write_bonds_for_custom_ff(self, f, bonds: List[Dict], atoms: List[Dict]):
+    def _write_bonds_for_custom_ff(self, f, bonds: List[Dict], lookup: AtomLookup,
+                                   aliases: Optional[Dict[str, str]] = None):
         """写入键定义（自定义力场，继承ForceField）"""
         f.write("  write(\"Data Bonds\") {\n")
-        
-        # 创建原子索引到名称的映射
-        atom_name_map = {}
-        for atom in atoms:
-            atom_name_map[atom['index']] = atom.get('name', f"{atom['type']}{atom['index']}")
-        
-        for i, bond in enumerate(bonds, 1):
-            atom1_idx = bond['atom1']
-            atom2_idx = bond['atom2']
-            atom1_name = atom_name_map.get(atom1_idx, f"atom{atom1_idx}")
-            atom2_name = atom_name_map.get(atom2_idx, f"atom{atom2_idx}")
-            
-            # 根据原子类型创建键类型名称
-            atom1_type = None
-            atom2_type = None
-            for atom in atoms:
-                if atom['index'] == atom1_idx:
-                    atom1_type = atom['type']
-                elif atom['index'] == atom2_idx:
-                    atom2_type = atom['type']
-            
-            if atom1_type and atom2_type:
-                bond_type = f"{atom1_type}-{atom2_type}"
-                bond_name = f"bond{i}"
-                f.write(f"    $bond:{bond_name} @bond:{bond_type} $atom:{atom1_name} $atom:{atom2_name}\n")
+        aliases = aliases or {}
+        
+        atoms = as_interaction_table(bonds, 2).atoms
+        positions = lookup.locate(atoms)
+        # 只写出两端原子都已定义且类型非空的键
+        keep = np.flatnonzero((positions >= 0).all(axis=1) & (atoms[:, 0] != atoms[:, 1]))
+        positions = positions[keep]
+        # 类型名取规范顺序，与_write_bond_types写出的类型同名
+        combos, inverse = np.unique(lookup.canonical_type_codes(positions).reshape(-1, 2),
+                                    axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        types = lookup.sorted_types
+        bond_types = []
+        valid = np.zeros(len(combos), dtype=bool)
+        for i, (type1, type2) in enumerate(combos.tolist()):
+            bond_type = f"{types[type1]}-{types[type2]}"
+            bond_types.append(aliases.get(bond_type, bond_type))
+            valid[i] = bool(types[type1] and types[type2])
+        rows = valid[inverse]
+        
+        names = np.asarray(lookup.names, dtype=object)
+        name_codes = lookup.name_codes[positions[rows]]
+        write_rows(f, "    $bond:bond%d @bond:%s $atom:%s $atom:%s\n", [
+            keep[rows] + 1, np.asarray(bond_types, dtype=object)[inverse[rows]],
+            names[name_codes[:, 0]], names[name_codes[:, 1]]
+        ])
         
         f.write("  }\n")
     
-    def _write_angles_for_custom_ff(self, f, angles: List[Dict], atoms: List[Dict]):
+    def _write_angles_for_custom_ff(self, f, angles: List[Dict], lookup: AtomLookup,
+                                    aliases: Optional[Dict[str, str]] = None):
         """写入角度定义（自定义力场，继承ForceField）"""
         if not angles:
             return
-            
-        f.write("  write(\"Data Angles\") {\n")
-        
-        # 创建原子索引到名称和类型的映射
-        atom_info_map = {}
-        for atom in atoms:
-            atom_info_map[atom['index']] = {
-                'name': atom.get('name', f"{atom['type']}{atom['index']}"),
-                'type': atom['type']
-            }
-        
-        for i, angle in enumerate(angles, 1):
-            atom1_idx = angle['atom1']
-            atom2_idx = angle['atom2']
-            atom3_idx = angle['atom3']
-            
-            atom1_info = atom_info_map.get(atom1_idx, {'name': f'atom{atom1_idx}', 'type': 'UNK'})
-            atom2_info = atom_info_map.get(atom2_idx, {'name': f'atom{atom2_idx}', 'type': 'UNK'})
-            atom3_info = atom_info_map.get(atom3_idx, {'name': f'atom{atom3_idx}', 'type': 'UNK'})
-            
-            angle_type = f"{atom1_info['type']}-{atom2_info['type']}-{atom3_info['type']}"
-            angle_name = f"angle{i}"
-            f.write(f"    $angle:{angle_name} @angle:{angle_type} $atom:{atom1_info['name']} $atom:{atom2_info['name']} $atom:{atom3_info['name']}\n")
         
+        f.write("  write(\"Data Angles\") {\n")
+        self._write_interactions_for_custom_ff(f, as_interaction_table(angles, 3), lookup, 'angle',
+                                               aliases)
         f.write("  }\n")
     
-    def _write_dihedrals_for_custom_ff(self, f, dihedrals: List[Dict], atoms: List[Dict]):
+    def _write_dihedrals_for_custom_ff(self, f, dihedrals: List[Dict], lookup: AtomLookup,
+                                       aliases: Optional[Dict[str, str]] = None):
         """写入二面角定义（自定义力场，继承ForceField）"""
         if not dihedrals:
             return
-            
-        f.write("  write(\"Data Dihedrals\") {\n")
-        
-        # 创建原子索引到名称和类型的映射
-        atom_info_map = {}
-        for atom in atoms:
-            atom_info_map[atom['index']] = {
-                'name': atom.get('name', f"{atom['type']}{atom['index']}"),
-                'type': atom['type']
-            }
-        
-        for i, dihedral in enumerate(dihedrals, 1):
-            atom1_idx = dihedral['atom1']
-            atom2_idx = dihedral['atom2']
-            atom3_idx = dihedral['atom3']
-            atom4_idx = dihedral['atom4']
-            
-            atom1_info = atom_info_map.get(atom1_idx, {'name': f'atom{atom1_idx}', 'type': 'UNK'})
-            atom2_info = atom_info_map.get(atom2_idx, {'name': f'atom{atom2_idx}', 'type': 'UNK'})
-            atom3_info = atom_info_map.get(atom3_idx, {'name': f'atom{atom3_idx}', 'type': 'UNK'})
-            atom4_info = atom_info_map.get(atom4_idx, {'name': f'atom{atom4_idx}', 'type': 'UNK'})
-            
-            dihedral_type = f"{atom1_info['type']}-{atom2_info['type']}-{atom3_info['type']}-{atom4_info['type']}"
-            dihedral_name = f"dihedral{i}"
-            f.write(f"    $dihedral:{dihedral_name} @dihedral:{dihedral_type} $atom:{atom1_info['name']} $atom:{atom2_info['name']} $atom:{atom3_info['name']} $atom:{atom4_info['name']}\n")
         
+        f.write("  write(\"Data Dihedrals\") {\n")
+        self._write_interactions_for_custom_ff(f, as_interaction_table(dihedrals, 4), lookup, 'dihedral',
+                                               aliases)
         f.write("  }\n")
     
+    def _write_interactions_for_custom_ff(self, f, table, lookup: AtomLookup, kind: str,
+                                          aliases: Optional[Dict[str, str]] = None):
+        """逐列查找名称与类型后写出角度/二面角（未定义的原子类型记为UNK，类型名取规范顺序）"""
+        aliases = aliases or {}
+        type_names, inverse = lookup.canonical_type_names(table.atoms)
+        type_names = np.asarray([aliases.get(name, name) for name in type_names], dtype=object)
+        name_columns = [lookup.name_labels(table.atoms[:, c]) for c in range(table.n_atoms)]
+        
+        fmt = f"    ${kind}:{kind}%d @{kind}:%s " + ' '.join(['$atom:%s'] * table.n_atoms) + "\n"
+        write_rows(f, fmt, [np.arange(1, len(table) + 1), type_names[inverse]] + name_columns)
+    
     def _generate_standard_ff_molecule_files(self, system_data: Dict, force_field_data: Dict,
                                            output_dir: Path, output_name: str):
         """生成使用标准力场的简化分子文件（只包含Bond List）"""
@@ -680,68 +816,60 @@ class MoltemplateGenerator:
         force_field_file = force_field_data.get('file', f'{force_field_name}.lt')
         force_field_class = force_field_name.upper()
         
-        for mol_name, mol_data in system_data['molecules'].items():
-            lt_file = output_dir / f"{mol_name}.lt"
+        tasks = [(output_dir / f"{mol_name}.lt", (mol_name, mol_data, force_field_file, force_field_class))
+                 for mol_name, mol_data in system_data['molecules'].items()]
+        self._write_molecule_files('_write_standard_ff_molecule_file', tasks, "生成标准力场分子文件")
+    
+    def _write_standard_ff_molecule_file(self, lt_file: Path, mol_name: str, mol_data: Dict,
+                                         force_field_file: str, force_field_class: str):
+        """写出一个使用标准力场的简化分子文件"""
+        with self._open_output(lt_file) as f:
+            # 写入文件头部
+            f.write(f"# Moltemplate file for '{mol_name}' generated from .itp and .xyz files.\n\n")
             
-            with open(lt_file, 'w') as f:
-                # 写入文件头部
-                f.write(f"# Moltemplate file for '{mol_name}' generated from .itp and .xyz files.\n\n")
-                
-                # 导入标准力场
-                f.write(f'import "{force_field_file}"\n\n')
-                
-                # 写入分子定义
-                f.write(f"{mol_name} inherits {force_field_class} {{\n\n")
-                
-                # 添加special_bonds设置（对GAFF等力场很重要）
-                f.write("  special_bonds lj/coul 0.0 0.0 0.5\n\n")
-                
-                # 写入原子定义
-                if 'atoms' in mol_data and mol_data['atoms']:
-                    f.write('  write("Data Atoms") {\n')
-                    self._write_atoms_for_standard_ff_simple(f, mol_data['atoms'])
-                    f.write("  }\n\n")
-                
-                # 写入键列表（Bond List）
-                if 'bonds' in mol_data and mol_data['bonds']:
-                    f.write('  write("Data Bond List") {\n')
-                    self._write_bond_list_for_standard_ff(f, mol_data['bonds'], mol_data.get('atoms', []))
-                    f.write("  }\n\n")
-                
-                f.write("} # end of molecule definition\n")
+            # 导入标准力场
+            f.write(f'import "{force_field_file}"\n\n')
             
-            self.logger.info(f"生成标准力场分子文件: {lt_file}")
+            # 写入分子定义
+            f.write(f"{mol_name} inherits {force_field_class} {{\n\n")
+            
+            # 添加special_bonds设置（对GAFF等力场很重要）
+            f.write("  special_bonds lj/coul 0.0 0.0 0.5\n\n")
+            
+            # 写入原子定义
+            if 'atoms' in mol_data and mol_data['atoms']:
+                f.write('  write("Data Atoms") {\n')
+                self._write_atoms_for_standard_ff_simple(f, mol_data['atoms'])
+                f.write("  }\n\n")
+            
+            # 写入键列表（Bond List）
+            if 'bonds' in mol_data and mol_data['bonds']:
+                f.write('  write("Data Bond List") {\n')
+                lookup = AtomLookup(mol_data.get('atoms', []), standard_ff_atom_name)
+                self._write_bond_list_for_standard_ff(f, mol_data['bonds'], lookup)
+                f.write("  }\n\n")
+            
+            f.write("} # end of molecule definition\n")
     
     def _write_atoms_for_standard_ff_simple(self, f, atoms):
         """为标准力场写入原子定义（简化格式）"""
         
-        for atom in atoms:
-            # 生成有意义的原子名称
-            atom_name = atom.get('atom_name', atom.get('name', f"{atom['type']}{atom['index']}"))
-            atom_type = atom['type']
-            charge = atom.get('charge', 0.0)
-            
-            # 从坐标信息获取位置（如果有的话）
-            x = atom.get('x', 0.0) * UNIT_CONVERSIONS['length']  # nm to Angstrom
-            y = atom.get('y', 0.0) * UNIT_CONVERSIONS['length']
-            z = atom.get('z', 0.0) * UNIT_CONVERSIONS['length']
-            
-            f.write(f"    $atom:{atom_name} $mol:. @atom:{atom_type} {charge:.8f} {x:.4f} {y:.4f} {z:.4f}\n")
+        # 从坐标信息获取位置（如果有的话），nm -> Angstrom
+        positions = np.array([[atom.get('x', 0.0), atom.get('y', 0.0), atom.get('z', 0.0)]
+                              for atom in atoms], dtype=np.float64).reshape(-1, 3)
+        positions *= UNIT_CONVERSIONS['length']
+        write_fixed_rows(f, f"    $atom:%s $mol:. @atom:%s %.8f {self.coordinate_format}\n", [
+            [standard_ff_atom_name(atom) for atom in atoms],
+            [atom['type'] for atom in atoms],
+            [atom.get('charge', 0.0) for atom in atoms],
+            positions[:, 0], positions[:, 1], positions[:, 2],
+        ])
     
-    def _write_bond_list_for_standard_ff(self, f, bonds, atoms):
+    def _write_bond_list_for_standard_ff(self, f, bonds, lookup: AtomLookup):
         """为标准力场写入键列表"""
         
-        # 创建原子索引到名称的映射
-        atom_name_map = {}
-        for atom in atoms:
-            atom_name = atom.get('atom_name', atom.get('name', f"{atom['type']}{atom['index']}"))
-            atom_name_map[atom['index']] = atom_name
-        
-        for i, bond in enumerate(bonds, 1):
-            atom1_idx = bond['atom1']
-            atom2_idx = bond['atom2']
-            
-            atom1_name = atom_name_map.get(atom1_idx, f'atom{atom1_idx}')
-            atom2_name = atom_name_map.get(atom2_idx, f'atom{atom2_idx}')
-            
-            f.write(f"    $bond:b{i} $atom:{atom1_name} $atom:{atom2_name}\n") 
\ No newline at end of file
+        table = as_interaction_table(bonds, 2)
+        write_rows(f, "    $bond:b%d $atom:%s $atom:%s\n", [
+            np.arange(1, len(table) + 1),
+            lookup.name_labels(table.atoms[:, 0]), lookup.name_labels(table.atoms[:, 1])
+        ])
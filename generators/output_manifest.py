@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+增量生成的输出清单
+输出目录中的{output_name}.manifest.json记录每个生成文件的内容哈希及其输入键。
+重新生成时：输入键与清单一致且文件内容未被改动的文件直接跳过；
+其余文件先写到临时文件，内容与现有文件相同时丢弃临时文件，
+现有文件（及其时间戳）保持不变
+"""
+
+import copy
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from generators.bulk_writer import WRITE_BUFFER_SIZE
+
+try:
+    from config import VERSION
+except ImportError:
+    VERSION = 'unknown'
+
+# 清单格式或生成器输出格式变化时递增，使旧清单中的输入键全部失效
+MANIFEST_FORMAT = 1
+
+MANIFEST_SUFFIX = '.manifest.json'
+
+
+def input_key(*parts) -> str:
+    """由生成器版本和各输入部分（需有确定的repr）计算输入键"""
+    h = hashlib.sha1(f"{VERSION}:{MANIFEST_FORMAT}\n".encode())
+    for part in parts:
+        h.update(repr(part).encode())
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+def content_digest(path: Path, block_size: int = WRITE_BUFFER_SIZE) -> Optional[str]:
+    """文件内容的SHA1（文件不存在时为None），分块读取"""
+    h = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                h.update(block)
+    except FileNotFoundError:
+        return None
+    return h.hexdigest()
+
+
+class OutputManifest:
+    """一个输出目录（一个output_name）的生成文件清单
+
+    entries: 文件名 -> {'sha1': 内容哈希, 'inputs': 输入键或None}
+    """
+
+    def __init__(self, output_dir: Path, output_name: str, logger=None, enabled: bool = True):
+        self.output_dir = Path(output_dir)
+        self.path = self.output_dir / f"{output_name}{MANIFEST_SUFFIX}"
+        self.logger = logger
+        self.enabled = enabled
+        self.entries: Dict[str, Dict] = self._load() if enabled else {}
+        # 文件名 -> 预先登记的输入键（见expect）
+        self.inputs: Dict[str, str] = {}
+        self.written: List[str] = []
+        self.unchanged: List[str] = []
+        self.skipped: List[str] = []
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            if self.logger:
+                self.logger.warning(f"输出清单损坏，已忽略: {self.path} ({e})")
+            return {}
+        if data.get('format') != MANIFEST_FORMAT:
+            return {}
+        return data.get('files', {})
+
+    def expect(self, path: Path, inputs: str):
+        """登记即将生成的文件的输入键，open时未指定输入键则使用它"""
+        self.inputs[path.name] = inputs
+
+    def is_current(self, path: Path, inputs: str) -> bool:
+        """文件是否由相同输入生成且未被改动（是则记为跳过）"""
+        if not self.enabled:
+            return False
+        entry = self.entries.get(path.name)
+        if entry is None or entry.get('inputs') != inputs:
+            return False
+        if content_digest(path) != entry.get('sha1'):
+            return False
+        self.skipped.append(path.name)
+        return True
+
+    @contextmanager
+    def open(self, path: Path, inputs: Optional[str] = None, buffer_size: Optional[int] = None):
+        """以写入方式打开输出文件
+
+        启用清单时写入同目录下的临时文件，内容与现有文件相同则丢弃。
+        """
+        if not self.enabled:
+            with open(path, 'w', buffering=buffer_size or WRITE_BUFFER_SIZE) as f:
+                yield f
+            return
+
+        if inputs is None:
+            inputs = self.inputs.get(path.name)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', buffering=buffer_size or WRITE_BUFFER_SIZE) as f:
+                yield f
+            digest = content_digest(tmp_path)
+            if self._same_content(path, tmp_path, digest):
+                os.unlink(tmp_path)
+                self.unchanged.append(path.name)
+            else:
+                if path.exists():
+                    # mkstemp创建的文件权限为0600，沿用原文件的权限
+                    os.chmod(tmp_path, path.stat().st_mode & 0o7777)
+                else:
+                    os.chmod(tmp_path, 0o666 & ~_umask())
+                os.replace(tmp_path, path)
+                self.written.append(path.name)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self.entries[path.name] = {'sha1': digest, 'inputs': inputs}
+
+    def _same_content(self, path: Path, tmp_path: str, digest: str) -> bool:
+        try:
+            if os.path.getsize(path) != os.path.getsize(tmp_path):
+                return False
+        except FileNotFoundError:
+            return False
+        return content_digest(path) == digest
+
+    def merge(self, other: 'OutputManifest'):
+        """合并子进程中记录的结果"""
+        self.entries.update(other.entries)
+        self.written.extend(other.written)
+        self.unchanged.extend(other.unchanged)
+        self.skipped.extend(other.skipped)
+
+    def fork(self) -> 'OutputManifest':
+        """供子进程使用的空白副本（结果通过merge合并回来）"""
+        child = copy.copy(self)
+        child.logger = None
+        child.entries, child.written, child.unchanged, child.skipped = {}, [], [], []
+        return child
+
+    def save(self):
+        """写出清单并报告重写/未变/跳过的文件"""
+        if not self.enabled:
+            return
+        # 只保留本次生成（或跳过）的文件
+        names = sorted(set(self.written + self.unchanged + self.skipped))
+        data = {'format': MANIFEST_FORMAT, 'version': VERSION,
+                'files': {name: self.entries[name] for name in names}}
+        text = json.dumps(data, indent=1, sort_keys=True) + "\n"
+        try:
+            current = self.path.read_text(encoding='utf-8')
+        except FileNotFoundError:
+            current = None
+        if text != current:
+            self.path.write_text(text, encoding='utf-8')
+
+        if self.logger:
+            self.logger.info(f"增量生成: 重写 {len(self.written)} 个文件，"
+                             f"{len(self.unchanged)} 个文件内容未变，"
+                             f"{len(self.skipped)} 个文件输入未变已跳过")
+            for name in self.skipped + self.unchanged:
+                self.logger.info(f"  未改写: {name}")
+
+
+def _umask() -> int:
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+标准力场的LAMMPS数据文件生成器
+以索引后的力场文件代替moltemplate：键类型按Bonds By Type规则确定，
+角度、二面角和improper由键连接关系生成后按By Type规则匹配
+"""
+
+from itertools import combinations, permutations
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from generators.atom_lookup import AtomLookup
+from generators.bulk_writer import open_output, write_lines
+from generators.lammps_data_writer import (
+    LammpsDataWriter, MoleculeTemplate, TypeTable, UNIT_CONVERSIONS
+)
+from parsers.interaction_table import as_interaction_table
+from parsers.lt_force_field import LtForceField, load_force_field, resolve_force_field_file
+
+# section名 -> (类型表名, data文件section标题, coeff命令)
+STANDARD_SECTIONS = {
+    'bonds': ('bond_types', 'Bonds', 'bond_coeff'),
+    'angles': ('angle_types', 'Angles', 'angle_coeff'),
+    'dihedrals': ('dihedral_types', 'Dihedrals', 'dihedral_coeff'),
+    'impropers': ('improper_types', 'Impropers', 'improper_coeff'),
+}
+
+# section名 -> 力场中的成键项种类
+SECTION_KINDS = {'bonds': 'bond', 'angles': 'angle', 'dihedrals': 'dihedral', 'impropers': 'improper'}
+
+
+def bond_graph(bond_rows: np.ndarray, n_atoms: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """键去重并建立邻接表
+
+    返回(去重后的键, indptr, 邻居)：去掉自成键和重复键（保留首次出现的方向与顺序），
+    原子a的邻居为neighbors[indptr[a]:indptr[a + 1]]，按行号升序。
+    """
+    bond_rows = bond_rows[bond_rows[:, 0] != bond_rows[:, 1]]
+    pairs = np.sort(bond_rows, axis=1)
+    _, first = np.unique(pairs[:, 0] * n_atoms + pairs[:, 1], return_index=True)
+    bonds = bond_rows[np.sort(first)]
+    source = np.concatenate([bonds[:, 0], bonds[:, 1]])
+    target = np.concatenate([bonds[:, 1], bonds[:, 0]])
+    order = np.lexsort((target, source))
+    indptr = np.zeros(n_atoms + 1, dtype=np.int64)
+    np.cumsum(np.bincount(source, minlength=n_atoms), out=indptr[1:])
+    return bonds, indptr, target[order]
+
+
+def neighbor_combinations(indptr: np.ndarray, neighbors: np.ndarray,
+                          size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """每个原子的邻居中所有size个一组的组合
+
+    返回(中心原子, 组合)：按中心原子升序，同一中心内与itertools.combinations的顺序相同。
+    邻居数相同的原子一起处理，每种邻居数只做一次花式索引。
+    """
+    degrees = np.diff(indptr)
+    centers, groups = [], []
+    for degree in np.unique(degrees[degrees >= size]).tolist():
+        atoms = np.flatnonzero(degrees == degree)
+        picks = np.array(list(combinations(range(degree), size)), dtype=np.int64)
+        slots = indptr[atoms][:, None, None] + picks[None, :, :]
+        centers.append(np.repeat(atoms, len(picks)))
+        groups.append(neighbors[slots].reshape(-1, size))
+    if not centers:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, size), dtype=np.int64)
+    order = np.argsort(np.concatenate(centers), kind='stable')
+    return np.concatenate(centers)[order], np.concatenate(groups)[order]
+
+
+def angle_rows(indptr: np.ndarray, neighbors: np.ndarray) -> np.ndarray:
+    """由邻接表生成所有角度i-j-k（i<k）"""
+    centers, pairs = neighbor_combinations(indptr, neighbors, 2)
+    return np.stack([pairs[:, 0], centers, pairs[:, 1]], axis=1)
+
+
+def dihedral_rows(indptr: np.ndarray, neighbors: np.ndarray) -> np.ndarray:
+    """由邻接表生成所有二面角i-j-k-l（中心键j<k，排除三元环）
+
+    对每个中心键取j的邻居i与k的邻居l的全部组合，再去掉i == k、l == j和l == i的行。
+    """
+    degrees = np.diff(indptr)
+    sources = np.repeat(np.arange(len(degrees)), degrees)
+    central = np.flatnonzero(neighbors > sources)
+    j, k = sources[central], neighbors[central]
+    counts = degrees[j] * degrees[k]
+    edge = np.repeat(np.arange(len(central)), counts)
+    offset = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+    i = neighbors[indptr[j][edge] + offset // degrees[k][edge]]
+    l = neighbors[indptr[k][edge] + offset % degrees[k][edge]]
+    rows = np.stack([i, j[edge], k[edge], l], axis=1)
+    return rows[(i != rows[:, 2]) & (l != rows[:, 1]) & (l != i)]
+
+
+def improper_candidates(indptr: np.ndarray, neighbors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """所有(中心原子, 三个成键原子)组合"""
+    return neighbor_combinations(indptr, neighbors, 3)
+
+
+def unique_combos(codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """类型编码组合按首次出现的顺序去重，返回(组合, 每行对应的组合编号)"""
+    if len(codes) == 0:
+        return codes, np.zeros(0, dtype=np.int64)
+    # 组合压缩为单个整数后去重；编码空间过大时按行比较
+    base = int(codes.max()) + 1
+    if base ** codes.shape[1] < 2 ** 63:
+        keys = np.zeros(len(codes), dtype=np.int64)
+        for column in range(codes.shape[1]):
+            keys = keys * base + codes[:, column]
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        combos = codes[first]
+    else:
+        combos, first, inverse = np.unique(codes, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return combos[order], rank[inverse.reshape(-1)]
+
+
+class StandardForceFieldDataWriter(LammpsDataWriter):
+    """直接生成LAMMPS数据文件（标准力场）"""
+
+    bonded_sections = STANDARD_SECTIONS
+
+    def __init__(self, logger, force_field_file: str, buffer_size: Optional[int] = None,
+                 coordinate_precision: Optional[int] = None, chunk_size: Optional[int] = None):
+        super().__init__(logger, buffer_size, coordinate_precision, chunk_size)
+        self.force_field: LtForceField = load_force_field(str(resolve_force_field_file(force_field_file)))
+        if self.force_field.missing_imports:
+            self.logger.warning(
+                f"力场文件导入的以下文件不存在，相关参数将缺失: {', '.join(self.force_field.missing_imports)}")
+
+    def _build_type_tables(self, system_data: Dict) -> Dict[str, TypeTable]:
+        """类型按首次使用的顺序编号，只包含体系用到的类型"""
+        tables = {'atom_types': TypeTable()}
+        for ff_type, _, _ in STANDARD_SECTIONS.values():
+            tables[ff_type] = TypeTable()
+        return tables
+
+    def _warn_missing_parameters(self, tables: Dict[str, TypeTable]):
+        """原子类型的pair_coeff按力场规则匹配，在_write_settings_file中检查"""
+        super()._warn_missing_parameters({ff_type: table for ff_type, table in tables.items()
+                                          if ff_type != 'atom_types'})
+
+    def _use_type(self, tables: Dict[str, TypeTable], section: str, name: str) -> int:
+        """取得成键类型编号，首次使用时从力场中取出coeff"""
+        table = tables[STANDARD_SECTIONS[section][0]]
+        if name not in table.ids:
+            coeffs = self.force_field.coeffs[SECTION_KINDS[section]].get(name)
+            if coeffs:
+                table.define(name, *coeffs)
+        return table.use(name)
+
+    def _build_template(self, mol_name: str, mol_data: Dict,
+                        tables: Dict[str, TypeTable]) -> MoleculeTemplate:
+        """由原子与键生成模板，角度、二面角和improper按力场规则推断"""
+        ff = self.force_field
+        atoms = mol_data.get('atoms', [])
+        lookup = AtomLookup(atoms)
+
+        full_types = [ff.full_type(atom['type']) for atom in atoms]
+        missing = sorted({atom['type'] for atom, full in zip(atoms, full_types)
+                          if full not in ff.masses})
+        if missing:
+            raise ValueError(f"分子 {mol_name} 的原子类型不在力场 {ff.name} 中: {', '.join(missing)}")
+
+        atom_table = tables['atom_types']
+        atom_types = np.array([atom_table.use(atom['type']) for atom in atoms], dtype=np.int32)
+        charges = np.array([atom.get('charge', 0.0) * UNIT_CONVERSIONS['charge'] for atom in atoms],
+                           dtype=np.float64)
+        positions = np.array([[atom.get('x', 0.0), atom.get('y', 0.0), atom.get('z', 0.0)]
+                              for atom in atoms], dtype=np.float64).reshape(-1, 3)
+        positions *= UNIT_CONVERSIONS['length']
+
+        # 键：原子索引 -> 模板行号
+        bond_atoms = as_interaction_table(mol_data.get('bonds'), 2).atoms
+        located = lookup.locate(bond_atoms)
+        if not (located >= 0).all():
+            bad = bond_atoms[np.flatnonzero(~(located >= 0).all(axis=1))[0]].tolist()
+            raise ValueError(f"分子 {mol_name} 的bonds引用了未定义的原子: {bad}")
+        bonds, indptr, neighbors = bond_graph(lookup.rows[located].astype(np.int64), len(atoms))
+
+        # 原子类型编码：规则匹配按类型组合进行，每种组合只匹配一次
+        short_types, type_codes = np.unique(np.array([atom['type'] for atom in atoms], dtype=object),
+                                            return_inverse=True)
+        type_codes = type_codes.reshape(-1)
+        full_names = [ff.full_type(t) for t in short_types.tolist()]
+
+        bonded = {}
+        combos, inverse = unique_combos(type_codes[bonds])
+        unmatched = []
+        combo_ids = np.zeros(len(combos), dtype=np.int32)
+        for c, combo in enumerate(combos.tolist()):
+            name = ff.rules['bond'].match(tuple(full_names[t] for t in combo))
+            if name is None:
+                unmatched.append('-'.join(short_types[t] for t in combo))
+            else:
+                combo_ids[c] = self._use_type(tables, 'bonds', name)
+        if unmatched:
+            raise ValueError(f"分子 {mol_name} 中以下键在力场 {ff.name} 中没有参数: "
+                             f"{', '.join(sorted(set(unmatched)))}")
+        bonded['bonds'] = (bonds, combo_ids[inverse])
+
+        # 角度与二面角：没有匹配规则的组合不生成（与moltemplate相同）
+        for section, generated in (('angles', angle_rows(indptr, neighbors)),
+                                   ('dihedrals', dihedral_rows(indptr, neighbors))):
+            rules = ff.rules[SECTION_KINDS[section]]
+            combos, inverse = unique_combos(type_codes[generated])
+            combo_ids = np.zeros(len(combos), dtype=np.int32)
+            for c, combo in enumerate(combos.tolist()):
+                name = rules.match(tuple(full_names[t] for t in combo))
+                if name is not None:
+                    combo_ids[c] = self._use_type(tables, section, name)
+            ids = combo_ids[inverse]
+            bonded[section] = (generated[ids > 0], ids[ids > 0])
+
+        bonded['impropers'] = self._match_impropers(indptr, neighbors, type_codes, full_names, tables)
+        return MoleculeTemplate(mol_name, atom_types, charges, positions, bonded)
+
+    def _match_impropers(self, indptr: np.ndarray, neighbors: np.ndarray, type_codes: np.ndarray,
+                         full_names: List[str], tables: Dict[str, TypeTable]) -> Tuple[np.ndarray, np.ndarray]:
+        """对每个中心原子的三个成键原子尝试所有排列，取最后定义的匹配规则
+
+        排列的选择只取决于(中心, 三个成键原子)的类型组合，每种组合只匹配一次。
+        """
+        rules = self.force_field.rules['improper']
+        center_at = self.force_field.improper_center
+        empty = (np.zeros((0, 4), dtype=np.int64), np.zeros(0, dtype=np.int32))
+        if not len(rules):
+            return empty
+        centers, leaves = improper_candidates(indptr, neighbors)
+        candidates = np.insert(leaves, center_at, centers, axis=1)
+        combos, inverse = unique_combos(type_codes[candidates])
+
+        orders = list(permutations(range(3)))
+        combo_ids = np.zeros(len(combos), dtype=np.int32)
+        combo_orders = np.zeros(len(combos), dtype=np.int64)
+        for c, combo in enumerate(combos.tolist()):
+            center = combo.pop(center_at)
+            best = None
+            for o, order in enumerate(orders):
+                row = [combo[p] for p in order]
+                row.insert(center_at, center)
+                position = rules.match_position(tuple(full_names[t] for t in row))
+                if position is not None and (best is None or position > best):
+                    best, combo_orders[c] = position, o
+            if best is not None:
+                combo_ids[c] = self._use_type(tables, 'impropers', rules.names[best])
+
+        ids = combo_ids[inverse]
+        keep = ids > 0
+        if not keep.any():
+            return empty
+        permuted = np.take_along_axis(leaves[keep], np.array(orders)[combo_orders[inverse[keep]]], axis=1)
+        return np.insert(permuted, center_at, centers[keep], axis=1), ids[keep]
+
+    def _atom_type_masses(self, system_data: Dict) -> Dict[str, float]:
+        """原子类型的质量取自力场文件"""
+        masses = {}
+        for mol_data in system_data['molecules'].values():
+            for atom in mol_data.get('atoms', []):
+                full = self.force_field.full_type(atom['type'])
+                masses[atom['type']] = self.force_field.masses[full]
+        return masses
+
+    def _write_settings_file(self, settings_file: Path, tables: Dict[str, TypeTable]):
+        """写出pair_coeff（按力场规则匹配体系用到的原子类型对）及各成键coeff"""
+        ff = self.force_field
+        atom_ids = tables['atom_types'].ids
+        full_names = {name: ff.full_type(name) for name in atom_ids}
+
+        # (编号i, 编号j) -> 参数，后出现的规则优先
+        pairs: Dict[Tuple[int, int], Tuple[str, str, str]] = {}
+        for pattern1, pattern2, args in ff.pair_coeffs:
+            matches1 = ff.matching_types(pattern1, full_names)
+            if not matches1:
+                continue
+            matches2 = ff.matching_types(pattern2, full_names)
+            for name1 in matches1:
+                for name2 in matches2:
+                    i, j = atom_ids[name1], atom_ids[name2]
+                    key = (min(i, j), max(i, j))
+                    pairs[key] = (args,) + tuple(sorted((name1, name2), key=atom_ids.get))
+
+        with open(settings_file, 'w') as f:
+            f.write(f"# LAMMPS settings generated by gro2mol2lmp from {ff.path.name}\n\n")
+            for (i, j), (args, name1, name2) in sorted(pairs.items()):
+                comment = name1 if i == j else f"{name1} {name2}"
+                f.write(f"pair_coeff {i} {j} {args}  # {comment}\n")
+            self._write_bonded_coeffs(f, tables)
+
+        missing = [name for name, type_id in atom_ids.items() if (type_id, type_id) not in pairs]
+        if missing:
+            self.logger.warning(f"以下原子类型没有pair_coeff: {', '.join(missing)}")
+
+    def _write_extra_files(self, output_dir: Path, output_name: str,
+                           tables: Dict[str, TypeTable]) -> Dict[str, Path]:
+        """写出力场的In Init设置，以及力场定义的原子类型电荷"""
+        ff = self.force_field
+        files = {}
+
+        init_file = output_dir / f"{output_name}.in.init"
+        with open_output(init_file, self.buffer_size) as f:
+            f.write(f"# LAMMPS init settings from {ff.path.name}\n\n")
+            write_lines(f, (f"{line}\n" for line in ff.init_lines))
+        files['init'] = init_file
+
+        charges = [(type_id, name, ff.charges[ff.full_type(name)])
+                   for name, type_id in tables['atom_types'].ids.items()
+                   if ff.full_type(name) in ff.charges]
+        if charges:
+            charges_file = output_dir / f"{output_name}.in.charges"
+            with open_output(charges_file, self.buffer_size) as f:
+                write_lines(f, (f"set type {type_id} charge {charge}  # {name}\n"
+                                for type_id, name, charge in charges))
+            files['charges'] = charges_file
+
+        for name, path in files.items():
+            self.logger.info(f"生成LAMMPS {name}文件: {path}")
+        return files
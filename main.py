@@ -14,9 +14,16 @@ import sys
 from pathlib import Path
 
 from parsers.gromacs_parser import GromacsParser
+from parsers.topology_preprocessor import parse_define_args
+from generators.data_refresh import DataCoordinateRefresher
+from generators.frame_writer import FrameWriter
+from generators.lammps_data_writer import LammpsDataWriter
 from generators.moltemplate_generator import MoltemplateGenerator
+from generators.standard_ff_data_writer import StandardForceFieldDataWriter
 from utils.force_field_manager import ForceFieldManager
-from utils.logger import setup_logger
+from utils.logger import setup_logger, get_peak_memory
+from utils.topology_cache import TopologyCache
+from config import DEFAULT_CONFIG, get_config
 
 
 def main():
@@ -29,11 +36,15 @@ def main():
     parser.add_argument("-t", "--topology", 
                        help="GROMACS拓扑文件(.top)")
     parser.add_argument("-c", "--coordinate",
-                       help="坐标文件(.gro或.pdb)")
+                       help="坐标文件(.gro、.pdb或未压缩的.trr轨迹)")
     parser.add_argument("-f", "--force-field", 
                        help="力场类型 (gaff2, opls, amber等)")
     parser.add_argument("--itp-files", nargs="+",
                        help="ITP文件列表（可作为主要输入）")
+    parser.add_argument("-I", "--include-dir", action="append", default=[],
+                       help="#include搜索路径，可多次指定（另外会搜索GMXLIB）")
+    parser.add_argument("-D", "--define", action="append", default=[],
+                       help="预定义宏，格式为NAME或NAME=VALUE，可多次指定")
     
     # 输出参数
     parser.add_argument("-o", "--output", default="output",
@@ -44,6 +55,36 @@ def main():
     # 选项参数
     parser.add_argument("--custom-ff", action="store_true",
                        help="使用自定义力场 (将生成完整的.lt文件)")
+    parser.add_argument("--native", action="store_true",
+                       help="直接生成LAMMPS的data/in.settings文件，不经过moltemplate")
+    parser.add_argument("--refresh-data", metavar="DATA_FILE",
+                       help="只用-c给出的坐标刷新已有LAMMPS数据文件中的原子坐标与盒子（原地改写，拓扑不变）")
+    parser.add_argument("--frame", type=int, default=0,
+                       help="使用多帧坐标文件（.trr、多帧.gro、多MODEL的.pdb）中的第几帧 (默认: 0，负数从末尾计)")
+    parser.add_argument("--all-frames", action="store_true",
+                       help="坐标文件含多帧（首尾相接的.gro、多MODEL的.pdb或.trr）时逐帧输出，拓扑只解析一次")
+    parser.add_argument("--strict", action="store_true",
+                       help="标准力场缺少体系所需的参数时中止转换（默认只报告并继续）")
+    parser.add_argument("--collapse-types", action="store_true",
+                       help="合并参数相同的原子/键/角度/二面角类型（自定义力场），并输出类型映射报告")
+    parser.add_argument("--collapse-tolerance", type=float,
+                       default=DEFAULT_CONFIG['type_collapse_tolerance'],
+                       help=f"合并类型时参数的容差 (默认: {DEFAULT_CONFIG['type_collapse_tolerance']:g})")
+    parser.add_argument("--stream", action="store_true",
+                       help="流式模式：坐标分块读写，内存占用与原子总数无关")
+    parser.add_argument("--chunk-size", type=int,
+                       default=DEFAULT_CONFIG['stream_chunk_size'],
+                       help=f"流式模式每块原子数 (默认: {DEFAULT_CONFIG['stream_chunk_size']})")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                       help="并行进程数 (默认: 1，0表示使用全部CPU核心)")
+    parser.add_argument("--cache-dir",
+                       help="拓扑缓存目录 (默认: ~/.cache/gro2mol2lmp/topology)")
+    parser.add_argument("--no-incremental", action="store_true",
+                       help="重写全部输出文件（默认按输出清单跳过内容未变的文件）")
+    parser.add_argument("--no-cache", action="store_true",
+                       help="禁用拓扑缓存")
+    parser.add_argument("--cache-stats", action="store_true",
+                       help="输出拓扑缓存统计信息")
     parser.add_argument("--verbose", "-v", action="store_true",
                        help="详细输出")
     
@@ -53,6 +94,10 @@ def main():
     logger = setup_logger(args.verbose)
     
     try:
+        if args.refresh_data:
+            refresh_data_file(args, logger)
+            return
+        
         # 检查输入文件
         check_input_files(args, logger)
         
@@ -62,7 +107,22 @@ def main():
         
         # 解析GROMACS文件
         logger.info("开始解析GROMACS文件...")
-        gromacs_parser = GromacsParser(logger)
+        config = get_config()
+        topology_cache = None
+        if not args.no_cache:
+            topology_cache = TopologyCache(
+                args.cache_dir or config['topology_cache_dir'],
+                max_size_mb=config['topology_cache_max_mb'],
+                logger=logger
+            )
+        
+        gromacs_parser = GromacsParser(
+            logger,
+            include_dirs=args.include_dir,
+            defines=parse_define_args(args.define),
+            cache=topology_cache,
+            jobs=args.jobs or os.cpu_count() or 1
+        )
         
         # 支持只有itp文件的情况（标准力场模式）
         if args.topology is None and args.coordinate is None and args.itp_files:
@@ -72,7 +132,10 @@ def main():
             system_data = gromacs_parser.parse_system(
                 top_file=args.topology,
                 coord_file=args.coordinate,
-                itp_files=args.itp_files
+                itp_files=args.itp_files,
+                stream_coordinates=args.stream,
+                chunk_size=args.chunk_size,
+                frame=args.frame
             )
         
         # 管理力场
@@ -84,27 +147,108 @@ def main():
             custom_ff=args.custom_ff
         )
         
-        # 生成moltemplate文件
-        logger.info("生成moltemplate文件...")
-        mt_generator = MoltemplateGenerator(logger)
-        mt_generator.generate_moltemplate_files(
-            system_data,
-            force_field_data,
-            output_dir,
-            args.output_name,
-            custom_ff=args.custom_ff
-        )
+        # 标准力场：在生成文件前按力场索引检查参数是否齐全
+        # （名称映射或用户提供的.lt可能补上索引中找不到的类型，默认只报告）
+        if force_field_data.get('type') == 'standard':
+            if not ff_manager.validate_force_field_compatibility(system_data, force_field_data):
+                message = f"力场 {force_field_data['name']} 缺少体系所需的参数，详见上方警告"
+                if args.strict:
+                    raise ValueError(message)
+                logger.warning(f"{message}；继续生成（使用--strict时中止）")
+        
+        # 自定义力场：合并参数相同的类型，写出器按映射改写引用
+        if args.collapse_types and force_field_data.get('type') == 'custom':
+            ff_manager.collapse_identical_types(
+                system_data, force_field_data, output_dir, args.output_name,
+                tolerance=args.collapse_tolerance)
+        
+        if args.native:
+            # 直接生成LAMMPS数据文件
+            logger.info("生成LAMMPS数据文件...")
+            if force_field_data.get('type') == 'standard':
+                writer = StandardForceFieldDataWriter(
+                    logger, force_field_data['file'], buffer_size=config['write_buffer_size'],
+                    coordinate_precision=config['coordinate_precision'], chunk_size=args.chunk_size)
+            else:
+                writer = LammpsDataWriter(logger, buffer_size=config['write_buffer_size'],
+                                          coordinate_precision=config['coordinate_precision'],
+                                          chunk_size=args.chunk_size)
+            files = writer.write_data_files(system_data, output_dir, args.output_name)
+            if args.all_frames:
+                write_all_frames(args, system_data, output_dir, logger, files['data'])
+        else:
+            # 标准力场只导入体系用到的部分
+            if force_field_data.get('type') == 'standard':
+                force_field_data = ff_manager.subset_force_field(
+                    system_data, force_field_data, output_dir, args.output_name)
+            
+            # 生成moltemplate文件
+            logger.info("生成moltemplate文件...")
+            mt_generator = MoltemplateGenerator(logger, buffer_size=config['write_buffer_size'],
+                                                coordinate_precision=config['coordinate_precision'],
+                                                jobs=args.jobs or os.cpu_count() or 1,
+                                                incremental=not args.no_incremental)
+            mt_generator.generate_moltemplate_files(
+                system_data,
+                force_field_data,
+                output_dir,
+                args.output_name,
+                custom_ff=args.custom_ff
+            )
+            if args.all_frames:
+                write_all_frames(args, system_data, output_dir, logger)
         
         logger.info(f"转换完成！输出文件位于: {output_dir}")
         
+        if args.cache_stats and topology_cache is not None:
+            topology_cache.log_summary(logger)
+        
+        if args.stream:
+            logger.info(f"流式模式峰值内存: {get_peak_memory():.1f} MB")
+        
     except Exception as e:
         logger.error(f"转换失败: {e}")
         sys.exit(1)
 
 
+def refresh_data_file(args, logger):
+    """坐标刷新模式：不解析拓扑，直接改写已有数据文件的坐标列"""
+    if not args.coordinate:
+        raise ValueError("--refresh-data 需要用 -c/--coordinate 指定新的坐标文件")
+    for file_path in (args.refresh_data, args.coordinate):
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"找不到文件: {file_path}")
+    
+    config = get_config()
+    refresher = DataCoordinateRefresher(logger, coordinate_precision=config['coordinate_precision'],
+                                        buffer_size=config['write_buffer_size'])
+    refresher.refresh(args.refresh_data, args.coordinate, frame=args.frame)
+
+
+def write_all_frames(args, system_data, output_dir, logger, data_file=None):
+    """逐帧输出：复用已解析的拓扑（及已生成的data文件），每帧只读写坐标"""
+    config = get_config()
+    n_atoms = system_data.get('n_coordinates', len(system_data.get('coordinates', [])))
+    frame_writer = FrameWriter(logger, coordinate_precision=config['coordinate_precision'],
+                               buffer_size=config['write_buffer_size'],
+                               jobs=args.jobs or os.cpu_count() or 1)
+    frame_writer.write_frames(args.coordinate, output_dir, args.output_name,
+                              n_atoms=n_atoms, data_file=data_file,
+                              reference=system_data.get('coordinate_table'))
+
+
 def check_input_files(args, logger):
     """检查输入文件是否存在"""
     
+    if args.jobs < 0:
+        raise ValueError("--jobs 不能为负数")
+    
+    if args.chunk_size <= 0:
+        raise ValueError("--chunk-size 必须为正整数")
+    
+    if args.collapse_tolerance < 0:
+        raise ValueError("--collapse-tolerance 不能为负数")
+    
     # 检查是否提供了有效的输入组合
     if not args.topology and not args.coordinate and not args.itp_files:
         raise ValueError("必须提供以下其中一种输入：\n"
@@ -115,6 +259,12 @@ def check_input_files(args, logger):
     if (args.topology and not args.coordinate) or (not args.topology and args.coordinate):
         raise ValueError("如果提供TOP或坐标文件，两者都必须提供")
     
+    if args.stream and (args.frame or Path(args.coordinate or '').suffix.lower() == '.trr'):
+        raise ValueError("流式模式只读取.gro/.pdb的第一帧，不能与--frame或.trr一起使用")
+    
+    if args.all_frames and not args.coordinate:
+        raise ValueError("--all-frames 需要用 -c/--coordinate 指定坐标文件")
+    
     # 如果只有itp文件，必须指定力场
     if not args.topology and not args.coordinate and args.itp_files and not args.force_field:
         raise ValueError("仅使用ITP文件时，必须指定力场类型 (-f/--force-field)")
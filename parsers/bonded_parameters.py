@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+成键参数的补全
+[ bonds ]/[ angles ]/[ dihedrals ]中没有写参数的相互作用，按GROMACS的规则
+从[ bondtypes ]/[ angletypes ]/[ dihedraltypes ]中查找参数：
+类型组合正反两个方向都可匹配，二面角允许通配符X，
+非通配位置最多的类型优先，相同时取文件中先出现的
+"""
+
+from itertools import combinations
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from parsers.interaction_table import (
+    ATOM_KEYS, INTERACTION_ATOMS, InteractionTable, InteractionView, as_interaction_table
+)
+
+# GROMACS二面角类型中的通配符
+WILDCARD = 'X'
+
+# section名 -> 全局力场中的类型表
+TYPE_TABLES = {'bonds': 'bond_types', 'angles': 'angle_types', 'dihedrals': 'dihedral_types'}
+
+# 允许通配符的section
+WILDCARD_SECTIONS = {'dihedrals'}
+
+# 函数类型的等价关系（二面角9与1都是周期型二面角，9可有多项）
+FUNCTION_TYPE_ALIASES = {'dihedrals': {9: 1}}
+
+
+class TypeParameterIndex:
+    """一类[ *types ]表的哈希索引
+
+    键为(函数类型, 原子类型组合)，正反两个方向都登记；类型表中同名条目的
+    其他定义（variants，见GromacsParser._add_bonded_type）也一并登记。
+    同一个键有多条类型定义时保留文件中先出现的一条。连续的多项9型二面角
+    是一个条目（terms），补全时只用第一项，其余项由BondedParameterResolver记录。
+    """
+
+    def __init__(self, section: str, types: Dict[str, Dict]):
+        self.section = section
+        self.n_atoms = INTERACTION_ATOMS[section]
+        self.aliases = FUNCTION_TYPE_ALIASES.get(section, {})
+        # 通配位置的组合，按通配数从少到多分组
+        if section in WILDCARD_SECTIONS:
+            self.wildcard_levels = [list(combinations(range(self.n_atoms), n))
+                                    for n in range(self.n_atoms + 1)]
+        else:
+            self.wildcard_levels = [[()]]
+        self.entries: List[Dict] = []
+        self._index: Dict[Tuple, int] = {}
+
+        keys = ATOM_KEYS[:self.n_atoms]
+        for definitions in types.values():
+            for entry in [definitions] + definitions.get('variants', []):
+                if not entry.get('parameters') or any(key not in entry for key in keys):
+                    continue
+                position = len(self.entries)
+                self.entries.append(entry)
+                function_type = self.function_type(entry.get('function_type', 1))
+                names = tuple(entry[key] for key in keys)
+                self._index.setdefault((function_type, names), position)
+                self._index.setdefault((function_type, names[::-1]), position)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def function_type(self, function_type: int) -> int:
+        return self.aliases.get(function_type, function_type)
+
+    def lookup(self, function_type: int, names: Sequence[str]) -> Optional[int]:
+        """类型组合对应的类型定义编号，找不到时返回None"""
+        function_type = self.function_type(function_type)
+        for level in self.wildcard_levels:
+            best = None
+            for positions in level:
+                variant = tuple(WILDCARD if i in positions else name for i, name in enumerate(names))
+                position = self._index.get((function_type, variant))
+                if position is not None and (best is None or position < best):
+                    best = position
+            if best is not None:
+                return best
+        return None
+
+
+class BondedParameterResolver:
+    """按全局力场的类型表补全分子中缺少参数的相互作用"""
+
+    def __init__(self, global_force_field: Dict):
+        self.indexes = {
+            section: TypeParameterIndex(section, global_force_field.get(ff_type, {}))
+            for section, ff_type in TYPE_TABLES.items()
+        }
+        # section -> {类型名: 使用该类型的相互作用数}：多项9型二面角只写出了第一项
+        # （每个类型只有一组参数），其余项被丢弃
+        self.truncated: Dict[str, Dict[str, int]] = {}
+
+    def resolve_molecule(self, molecule_data: Dict) -> Dict[str, Tuple[int, int]]:
+        """补全一个分子的成键参数，返回section -> (补全数, 未找到数)"""
+        counts = {}
+        for section, index in self.indexes.items():
+            if section not in molecule_data or not molecule_data.get('atoms'):
+                continue
+            table = as_interaction_table(molecule_data[section], index.n_atoms)
+            resolved, n_resolved, n_unresolved = self.resolve_table(
+                table, molecule_data['atoms'], index)
+            if n_resolved:
+                molecule_data[section] = InteractionView(resolved)
+            counts[section] = (n_resolved, n_unresolved)
+        return counts
+
+    def resolve_table(self, table: InteractionTable, atoms: List[Dict],
+                      index: TypeParameterIndex) -> Tuple[InteractionTable, int, int]:
+        """补全一张相互作用表
+
+        返回(新表, 补全数, 未找到参数数)；没有补全任何项时返回原表。
+        缺少参数的相互作用按(函数类型, 类型编码组合)去重后逐个组合查找，
+        再以花式索引一次写回所有相互作用。
+        """
+        missing = np.flatnonzero(table.param_counts[table.param_index] == 0)
+        if len(missing) == 0:
+            return table, 0, 0
+
+        type_names, codes = atom_type_codes(atoms, table.atoms[missing])
+        function_types = table.function_types[missing].astype(np.int64)
+        defined = (codes >= 0).all(axis=1)
+        combos = np.concatenate([function_types[:, None], codes], axis=1)[defined]
+        if len(index) == 0 or len(combos) == 0:
+            return table, 0, len(missing)
+
+        # 组合压缩为单个整数后去重；编码空间过大时按行比较
+        base = int(combos.max()) + 1
+        if base ** combos.shape[1] < 2 ** 63:
+            keys = np.zeros(len(combos), dtype=np.int64)
+            for column in range(combos.shape[1]):
+                keys = keys * base + combos[:, column]
+            _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+            unique_combos = combos[first]
+        else:
+            unique_combos, inverse = np.unique(combos, axis=0, return_inverse=True)
+        slots = np.full(len(unique_combos), -1, dtype=np.int64)
+        for i, row in enumerate(unique_combos.tolist()):
+            position = index.lookup(row[0], [type_names[c] for c in row[1:]])
+            if position is not None:
+                slots[i] = position
+        found = slots[inverse.reshape(-1)]
+        rows = missing[defined][found >= 0]
+        found = found[found >= 0]
+        n_unresolved = len(missing) - len(rows)
+        if len(rows) == 0:
+            return table, 0, n_unresolved
+
+        # 用到的类型参数追加到参数表末尾
+        used, local, used_counts = np.unique(found, return_inverse=True, return_counts=True)
+        for p, count in zip(used.tolist(), used_counts.tolist()):
+            entry = index.entries[p]
+            if len(entry.get('terms', ())) > 1:
+                name = '-'.join(entry[key] for key in ATOM_KEYS[:index.n_atoms])
+                truncated = self.truncated.setdefault(index.section, {})
+                truncated[name] = truncated.get(name, 0) + count
+        new_parameters = [[float(x) for x in index.entries[p]['parameters']] for p in used.tolist()]
+        width = max(table.parameters.shape[1], max(len(p) for p in new_parameters))
+        parameters = np.zeros((len(table.parameters) + len(new_parameters), width), dtype=np.float64)
+        parameters[:len(table.parameters), :table.parameters.shape[1]] = table.parameters
+        for i, values in enumerate(new_parameters, len(table.parameters)):
+            parameters[i, :len(values)] = values
+        param_counts = np.concatenate([
+            table.param_counts, np.array([len(p) for p in new_parameters], dtype=np.int8)
+        ])
+        param_index = table.param_index.copy()
+        param_index[rows] = len(table.parameters) + local.reshape(-1)
+
+        resolved = InteractionTable(table.atoms, table.function_types, param_index,
+                                    parameters, param_counts)
+        return resolved, len(rows), n_unresolved
+
+
+def atom_type_codes(atoms: List[Dict], indices: np.ndarray) -> Tuple[List[str], np.ndarray]:
+    """原子索引数组对应的类型编码（未定义的原子为-1）
+
+    返回(按字典序排列的类型名, 与indices同形状的编码数组)；
+    重复的原子索引以最后一个为准。
+    """
+    atom_type_map = {atom['index']: atom['type'] for atom in atoms}
+    if not atom_type_map:
+        return [], np.full(indices.shape, -1, dtype=np.int64)
+    type_names, type_codes = np.unique(np.array(list(atom_type_map.values())),
+                                       return_inverse=True)
+    defined = np.fromiter(atom_type_map.keys(), dtype=np.int64, count=len(atom_type_map))
+    order = np.argsort(defined)
+    defined = defined[order]
+    defined_codes = type_codes.reshape(-1)[order]
+
+    positions = np.minimum(np.searchsorted(defined, indices), len(defined) - 1)
+    codes = np.where(defined[positions] == indices, defined_codes[positions], -1)
+    return type_names.tolist(), codes
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+大型成键section的分块并行解析
+将[ bonds ]/[ angles ]/[ dihedrals ]按行对齐的字节范围切分，
+在子进程中解析并写入共享内存数组，再按顺序拼接
+"""
+
+import mmap
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from parsers.interaction_table import INTERACTION_ATOMS
+from parsers.topology_lexer import DATA, Lexeme, gc_paused, lex_lines
+
+# section名 -> 每行的原子列数
+BONDED_SECTIONS = INTERACTION_ATOMS
+
+# 每行最多的参数个数（超出时回退到串行解析）
+PARAM_WIDTH = 6
+
+# 数据行数达到该值的section才并行解析
+PARALLEL_MIN_LINES = 100_000
+# 每个分块的最少行数，避免进程调度开销超过解析本身
+CHUNK_MIN_LINES = 20_000
+
+# 与词法分析器一致：首个非空白字符为'['的行是section标题，为'#'的行是预处理指令
+# （以换行符锚定比MULTILINE的'^'快得多，文件首行单独匹配）
+_HEADER_RE = re.compile(rb'\n([ \t\r\f\v]*\[[^\n;]*)')
+_DIRECTIVE_RE = re.compile(rb'\n[ \t\r\f\v]*#')
+_FIRST_LINE_RE = re.compile(rb'[ \t\r\f\v]*([\[#][^\n;]*)')
+
+# 统计换行符时每次扫描的字节数
+_COUNT_BLOCK = 1 << 24
+
+
+@dataclass
+class ParsedSection:
+    """已在子进程中解析好的整段section数据（按行补齐的参数数组）"""
+    atoms: np.ndarray
+    function_types: np.ndarray
+    param_counts: np.ndarray
+    parameters: np.ndarray
+
+
+@dataclass
+class SectionSpan:
+    """一个成键section的数据区（不含标题行）"""
+    section: str
+    n_atoms: int
+    first_lineno: int
+    start: int
+    end: int
+    n_lines: int
+
+
+def _count_newlines(buf: np.ndarray, start: int, end: int) -> int:
+    """分块统计字节范围内的换行符数目"""
+    count = 0
+    for pos in range(start, end, _COUNT_BLOCK):
+        count += int(np.count_nonzero(buf[pos:min(pos + _COUNT_BLOCK, end)] == 10))
+    return count
+
+
+def find_bonded_spans(path: str, min_lines: int = PARALLEL_MIN_LINES) -> Optional[List[SectionSpan]]:
+    """查找行数不少于min_lines的成键section
+
+    文件包含预处理指令时返回None（条件编译和宏需要按顺序求值）。
+    """
+    if os.path.getsize(path) == 0:
+        return None
+
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        first_line = _FIRST_LINE_RE.match(mm)
+        if mm.find(b'#') != -1 and (_DIRECTIVE_RE.search(mm) or
+                                    (first_line and first_line.group(1)[:1] == b'#')):
+            return None
+
+        buf = np.frombuffer(mm, dtype=np.uint8)
+        headers = []
+        lineno = 1
+        last_pos = 0
+        matches = list(_HEADER_RE.finditer(mm))
+        if first_line and first_line.group(1)[:1] == b'[':
+            matches.insert(0, first_line)
+        for match in matches:
+            header_start = match.start(1)
+            lineno += _count_newlines(buf, last_pos, header_start)
+            last_pos = header_start
+            name = ''.join(match.group(1).decode().split()).strip('[]')
+            headers.append((name, header_start, lineno))
+
+        spans = []
+        for i, (name, header_start, header_lineno) in enumerate(headers):
+            if name not in BONDED_SECTIONS:
+                continue
+            newline = mm.find(b'\n', header_start)
+            if newline == -1:
+                continue
+            start = newline + 1
+            end = headers[i + 1][1] if i + 1 < len(headers) else len(mm)
+            n_lines = _count_newlines(buf, start, end)
+            if n_lines >= min_lines:
+                spans.append(SectionSpan(name, BONDED_SECTIONS[name], header_lineno + 1,
+                                         start, end, n_lines))
+        del buf
+        return spans
+    finally:
+        mm.close()
+
+
+def _split_span(mm, span: SectionSpan, n_chunks: int) -> List[Tuple[int, int]]:
+    """把数据区切成n_chunks个按行对齐的字节范围"""
+    bounds = [span.start]
+    step = (span.end - span.start) // n_chunks
+    for i in range(1, n_chunks):
+        pos = mm.find(b'\n', max(span.start + i * step, bounds[-1]), span.end)
+        if pos == -1:
+            break
+        if pos + 1 > bounds[-1]:
+            bounds.append(pos + 1)
+    bounds.append(span.end)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1) if bounds[i] < bounds[i + 1]]
+
+
+def _parse_chunk_lines(text: str, n_atoms: int):
+    """解析一个分块的文本行，返回原子/函数类型/参数个数/参数列表；无法解析时返回None"""
+    atoms = []
+    functions = []
+    counts = []
+    params = []
+    min_tokens = n_atoms + 1
+    padding = [0.0] * PARAM_WIDTH
+
+    try:
+        for line in text.split('\n'):
+            comment_pos = line.find(';')
+            if comment_pos != -1:
+                line = line[:comment_pos]
+            parts = line.split()
+            # 与串行解析一致：列数不足的行被跳过
+            if len(parts) < min_tokens:
+                continue
+            n_params = len(parts) - min_tokens
+            if n_params > PARAM_WIDTH:
+                return None
+            atoms.extend(map(int, parts[:n_atoms]))
+            functions.append(int(parts[n_atoms]))
+            counts.append(n_params)
+            params.extend(map(float, parts[min_tokens:]))
+            params.extend(padding[n_params:])
+    except ValueError:
+        return None
+
+    return atoms, functions, counts, params
+
+
+def _attach_arrays(names: Tuple[str, str, str, str], capacity: int, n_atoms: int):
+    """连接共享内存并构造(原子, 函数类型, 参数个数, 参数)数组"""
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    arrays = (
+        np.ndarray((capacity, n_atoms), dtype=np.int32, buffer=blocks[0].buf),
+        np.ndarray((capacity,), dtype=np.int32, buffer=blocks[1].buf),
+        np.ndarray((capacity,), dtype=np.int8, buffer=blocks[2].buf),
+        np.ndarray((capacity, PARAM_WIDTH), dtype=np.float64, buffer=blocks[3].buf),
+    )
+    return blocks, arrays
+
+
+def _parse_chunk_worker(task: Tuple) -> int:
+    """进程池任务：解析一个分块并写入共享内存，返回写入的行数（-1表示需回退）"""
+    path, start, end, n_atoms, names, capacity, offset = task
+    with open(path, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode()
+
+    with gc_paused():
+        result = _parse_chunk_lines(text, n_atoms)
+    if result is None:
+        return -1
+    atoms, functions, counts, params = result
+    n_rows = len(functions)
+
+    blocks, arrays = _attach_arrays(names, capacity, n_atoms)
+    try:
+        atom_array, function_array, count_array, param_array = arrays
+        try:
+            atom_array[offset:offset + n_rows] = np.array(atoms, dtype=np.int32).reshape(n_rows, n_atoms)
+            function_array[offset:offset + n_rows] = functions
+        except OverflowError:
+            return -1
+        count_array[offset:offset + n_rows] = counts
+        param_array[offset:offset + n_rows] = np.array(params, dtype=np.float64).reshape(n_rows, PARAM_WIDTH)
+    finally:
+        del arrays, atom_array, function_array, count_array, param_array
+        for block in blocks:
+            block.close()
+    return n_rows
+
+
+def parse_spans_parallel(path: str, spans: List[SectionSpan], jobs: int) -> Optional[List[ParsedSection]]:
+    """在进程池中并行解析各section的数据区，结果按文件顺序返回
+
+    任一分块无法按固定格式解析时返回None，由调用方回退到串行解析
+    （串行解析会给出带行号的错误信息）。
+    """
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        buf = np.frombuffer(mm, dtype=np.uint8)
+        span_chunks = []
+        for span in spans:
+            n_chunks = max(1, min(jobs * 4, span.n_lines // CHUNK_MIN_LINES))
+            chunks = []
+            offset = 0
+            for start, end in _split_span(mm, span, n_chunks):
+                capacity = _count_newlines(buf, start, end) + 1
+                chunks.append((start, end, offset, capacity))
+                offset += capacity
+            span_chunks.append((chunks, offset))
+        del buf
+    finally:
+        mm.close()
+
+    all_blocks = []
+    try:
+        tasks = []
+        span_arrays = []
+        for span, (chunks, capacity) in zip(spans, span_chunks):
+            sizes = (capacity * span.n_atoms * 4, capacity * 4, capacity, capacity * PARAM_WIDTH * 8)
+            blocks = [shared_memory.SharedMemory(create=True, size=max(1, size)) for size in sizes]
+            all_blocks.extend(blocks)
+            names = tuple(block.name for block in blocks)
+            span_arrays.append((names, capacity))
+            for start, end, offset, _ in chunks:
+                tasks.append((path, start, end, span.n_atoms, names, capacity, offset))
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            written = list(executor.map(_parse_chunk_worker, tasks))
+        if any(n_rows < 0 for n_rows in written):
+            return None
+
+        results = []
+        task_index = 0
+        for span, (chunks, _), (names, capacity) in zip(spans, span_chunks, span_arrays):
+            blocks, arrays = _attach_arrays(names, capacity, span.n_atoms)
+            try:
+                # 按分块顺序拼接各分块实际写入的行
+                pieces = []
+                for _, _, offset, _ in chunks:
+                    pieces.append(slice(offset, offset + written[task_index]))
+                    task_index += 1
+                stitched = [np.concatenate([array[piece] for piece in pieces]) for array in arrays]
+            finally:
+                del arrays
+                for block in blocks:
+                    block.close()
+            results.append(ParsedSection(*stitched))
+        return results
+    finally:
+        for block in all_blocks:
+            block.close()
+            block.unlink()
+
+
+def _iter_region_lines(f, start: int, end: int) -> Iterator[str]:
+    """逐行读取文件中[start, end)字节范围"""
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        line = f.readline()
+        if not line:
+            break
+        remaining -= len(line)
+        yield line.decode()
+
+
+def iter_lexemes_with_spans(path: str, spans: List[SectionSpan],
+                            parsed: List[ParsedSection]) -> Iterator[Lexeme]:
+    """词法分析span以外的内容，span的数据区替换为一个预解析的DATA单元"""
+    with open(path, 'rb') as f:
+        pos = 0
+        lineno = 1
+        for span, rows in zip(spans, parsed):
+            yield from lex_lines(_iter_region_lines(f, pos, span.start), lineno)
+            yield DATA, rows, span.first_lineno
+            pos = span.end
+            lineno = span.first_lineno + span.n_lines
+        yield from lex_lines(_iter_region_lines(f, pos, os.path.getsize(path)), lineno)
@@ -0,0 +1,690 @@
+# -*- coding: utf-8 -*-
+"""
+坐标文件列式读取器
+使用内存映射和NumPy批量解码.gro固定列格式；
+多帧文件（首尾相接的.gro、多MODEL的.pdb、.trr轨迹）按各帧的起始偏移逐帧读取
+"""
+
+import mmap
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# .gro格式固定列宽度
+GRO_RESNUM_COLS = (0, 5)
+GRO_RESNAME_COLS = (5, 10)
+GRO_ATOMNAME_COLS = (10, 15)
+GRO_ATOMNUM_COLS = (15, 20)
+GRO_COORD_START = 20
+GRO_DEFAULT_FIELD_WIDTH = 8
+
+# 每批解码的原子行数，限制临时字节矩阵的大小
+DEFAULT_DECODE_BLOCK = 1_000_000
+
+# nm -> Angstrom
+NM_TO_ANGSTROM = 10.0
+
+# nm/ps -> Angstrom/fs（LAMMPS real单位）
+NM_PER_PS_TO_ANGSTROM_PER_FS = 0.01
+
+# .trr帧头（XDR，大端）：magic、版本字符串（长度+1、XDR字符串长度、内容），
+# 之后是13个int与两个实数（时间、lambda）
+TRR_MAGIC = 1993
+TRR_VERSION = b'GMX_trn_file'
+_TRR_PREAMBLE = 24
+_TRR_HEADER_INTS = ('ir_size', 'e_size', 'box_size', 'vir_size', 'pres_size', 'top_size',
+                    'sym_size', 'x_size', 'v_size', 'f_size', 'natoms', 'step', 'nre')
+# 帧数据依次为盒子、维里、压力、坐标、速度、力
+_TRR_BLOCKS = ('box_size', 'vir_size', 'pres_size', 'x_size', 'v_size', 'f_size')
+
+# .trr帧偏移索引缓存：(路径, 大小, 修改时间) -> 各帧起始偏移
+_trr_index_cache: Dict[Tuple, List[int]] = {}
+
+_NON_SPACE = re.compile(rb'\S')
+
+
+class CoordinateTable:
+    """列式坐标数据结构
+
+    residue_numbers/atom_numbers为int32数组，残基名和原子名以分类编码存储，
+    positions为(N,3)浮点数组（单位：Angstrom）；坐标文件带速度时velocities为
+    (N,3)浮点数组（单位：Angstrom/fs），否则为None。
+    """
+
+    def __init__(self, residue_numbers: np.ndarray, residue_name_codes: np.ndarray,
+                 residue_names: List[str], atom_name_codes: np.ndarray,
+                 atom_names: List[str], atom_numbers: np.ndarray,
+                 positions: np.ndarray, velocities: Optional[np.ndarray] = None):
+        self.residue_numbers = residue_numbers
+        self.residue_name_codes = residue_name_codes
+        self.residue_names = residue_names
+        self.atom_name_codes = atom_name_codes
+        self.atom_names = atom_names
+        self.atom_numbers = atom_numbers
+        self.positions = positions
+        self.velocities = velocities
+
+    def __len__(self) -> int:
+        return len(self.atom_numbers)
+
+    @property
+    def n_atoms(self) -> int:
+        return len(self.atom_numbers)
+
+    def atom_name_array(self) -> np.ndarray:
+        """按原子顺序返回原子名数组"""
+        return np.asarray(self.atom_names, dtype=object)[self.atom_name_codes]
+
+    def residue_name_array(self) -> np.ndarray:
+        """按原子顺序返回残基名数组"""
+        return np.asarray(self.residue_names, dtype=object)[self.residue_name_codes]
+
+    def with_positions(self, positions: np.ndarray,
+                       velocities: Optional[np.ndarray] = None) -> 'CoordinateTable':
+        """原子名等信息不变、坐标（和速度）替换为另一帧的新表"""
+        return CoordinateTable(self.residue_numbers, self.residue_name_codes, self.residue_names,
+                               self.atom_name_codes, self.atom_names, self.atom_numbers,
+                               positions, velocities)
+
+    def atom(self, i: int):
+        """按需创建单个Atom对象"""
+        from parsers.gromacs_parser import Atom
+
+        x, y, z = self.positions[i].tolist()
+        return Atom(
+            index=int(self.atom_numbers[i]),
+            name=self.atom_names[self.atom_name_codes[i]],
+            residue_name=self.residue_names[self.residue_name_codes[i]],
+            residue_number=int(self.residue_numbers[i]),
+            x=x, y=y, z=z
+        )
+
+    def as_atoms(self) -> 'AtomView':
+        """返回Atom对象的惰性视图"""
+        return AtomView(self)
+
+
+class AtomView(Sequence):
+    """CoordinateTable上的只读Atom序列，仅在访问时创建Atom对象"""
+
+    def __init__(self, table: CoordinateTable):
+        self.table = table
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.table.atom(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("原子索引超出范围")
+        return self.table.atom(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.table.atom(i)
+
+
+class _CategoryEncoder:
+    """跨批次维护字符串到分类编码的映射"""
+
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.names: List[str] = []
+
+    def encode(self, raw: np.ndarray) -> np.ndarray:
+        uniques, inverse = np.unique(raw, return_inverse=True)
+        lut = np.empty(len(uniques), dtype=np.int32)
+        for k, value in enumerate(uniques.tolist()):
+            name = value.decode('ascii', errors='replace').strip()
+            code = self.codes.get(name)
+            if code is None:
+                code = len(self.names)
+                self.codes[name] = code
+                self.names.append(name)
+            lut[k] = code
+        return lut[inverse.ravel()]
+
+
+def _field(rows: np.ndarray, start: int, stop: int) -> np.ndarray:
+    """从字节矩阵中截取固定列并视为定长字节串数组"""
+    width = stop - start
+    return np.ascontiguousarray(rows[:, start:stop]).view(f'S{width}').ravel()
+
+
+def _detect_field_width(line: bytes) -> int:
+    """根据前两个小数点的间距确定坐标字段宽度"""
+    first = line.find(b'.', GRO_COORD_START)
+    if first == -1:
+        return GRO_DEFAULT_FIELD_WIDTH
+    second = line.find(b'.', first + 1)
+    if second == -1:
+        return GRO_DEFAULT_FIELD_WIDTH
+    return second - first
+
+
+def _line_starts(mm, buf: np.ndarray, offset: int, n_lines: int, block: int) -> np.ndarray:
+    """计算从offset开始的n_lines行的起始偏移"""
+    end_first = mm.find(b'\n', offset)
+    if end_first == -1:
+        raise ValueError("GRO文件缺少原子行")
+    stride = end_first - offset + 1
+    starts = offset + np.arange(n_lines, dtype=np.int64) * stride
+
+    # 绝大多数.gro文件行宽固定，可直接按步长计算
+    last_end = offset + n_lines * stride - 1
+    if last_end < len(buf) and np.all(buf[starts + stride - 1] == 10):
+        return starts
+
+    # 行宽不一致时分块扫描换行符
+    found = []
+    count = 0
+    pos = offset
+    size = len(buf)
+    while count < n_lines and pos < size:
+        stop = min(pos + block * 64, size)
+        ends = np.flatnonzero(buf[pos:stop] == 10) + pos
+        found.append(ends[:n_lines - count])
+        count += len(found[-1])
+        pos = stop
+    ends = np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+    if len(ends) < n_lines:
+        raise ValueError(f"GRO文件原子行不足: 期望 {n_lines} 行, 实际 {len(ends)} 行")
+    return np.concatenate(([offset], ends[:-1] + 1)).astype(np.int64)
+
+
+def decode_gro_rows(buf: np.ndarray, starts: np.ndarray, field_width: int,
+                    residue_encoder: _CategoryEncoder, atom_encoder: _CategoryEncoder,
+                    dtype=np.float64) -> Dict[str, np.ndarray]:
+    """批量解码一组.gro原子行
+
+    各行经滑动窗口视图取出为(n, 行宽)字节矩阵，不构造与之同形状的int64下标。
+    """
+    row_width = GRO_COORD_START + 3 * field_width
+    rows = np.lib.stride_tricks.sliding_window_view(buf, row_width)[starts]
+
+    positions = np.empty((len(starts), 3), dtype=dtype)
+    for k in range(3):
+        start = GRO_COORD_START + k * field_width
+        positions[:, k] = _field(rows, start, start + field_width).astype(np.float64)
+    positions *= NM_TO_ANGSTROM
+
+    return {
+        'residue_numbers': _field(rows, *GRO_RESNUM_COLS).astype(np.int32),
+        'residue_name_codes': residue_encoder.encode(_field(rows, *GRO_RESNAME_COLS)),
+        'atom_name_codes': atom_encoder.encode(_field(rows, *GRO_ATOMNAME_COLS)),
+        'atom_numbers': _field(rows, *GRO_ATOMNUM_COLS).astype(np.int32),
+        'positions': positions,
+    }
+
+
+def _table_from_columns(columns: Dict[str, np.ndarray], residue_encoder: _CategoryEncoder,
+                        atom_encoder: _CategoryEncoder) -> CoordinateTable:
+    """由解码后的列构建CoordinateTable"""
+    return CoordinateTable(
+        residue_numbers=columns['residue_numbers'],
+        residue_name_codes=columns['residue_name_codes'],
+        residue_names=residue_encoder.names,
+        atom_name_codes=columns['atom_name_codes'],
+        atom_names=atom_encoder.names,
+        atom_numbers=columns['atom_numbers'],
+        positions=columns['positions']
+    )
+
+
+def _gro_frame_layout(mm, buf: np.ndarray, offset: int, block: int):
+    """定位从offset开始的一帧：返回(标题, 原子行起始偏移, 盒子行起始偏移)"""
+    title_end = mm.find(b'\n', offset)
+    count_end = mm.find(b'\n', title_end + 1) if title_end != -1 else -1
+    if title_end == -1 or count_end == -1:
+        raise ValueError("缺少标题行或原子数行")
+    title = mm[offset:title_end].decode('utf-8', errors='replace').strip()
+    n_atoms = int(mm[title_end + 1:count_end])
+    first = count_end + 1
+    if n_atoms > 0:
+        starts = _line_starts(mm, buf, first, n_atoms, block)
+        box_start = mm.find(b'\n', int(starts[-1])) + 1
+        if box_start == 0:
+            raise ValueError("缺少盒子行")
+    else:
+        starts = np.empty(0, dtype=np.int64)
+        box_start = first
+    return title, starts, box_start
+
+
+def _next_line(mm, start: int) -> int:
+    """start所在行之后下一行的起始偏移（无换行符时为文件长度）"""
+    end = mm.find(b'\n', start)
+    return len(mm) if end == -1 else end + 1
+
+
+def _map_file(path: str):
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _close_map(mm):
+    try:
+        mm.close()
+    except BufferError:
+        # 异常回溯仍持有视图时，映射交由垃圾回收释放
+        pass
+
+
+def read_gro_table(gro_file: str, dtype=np.float64,
+                   block: int = DEFAULT_DECODE_BLOCK, offset: int = 0) -> Dict:
+    """使用内存映射读取.gro文件，返回列式坐标表、盒子向量和标题
+
+    offset为帧的起始字节偏移（见index_gro_frames），默认读取第一帧。
+    """
+    mm = _map_file(gro_file)
+
+    try:
+        buf = np.frombuffer(mm, dtype=np.uint8)
+
+        try:
+            title, starts, box_start = _gro_frame_layout(mm, buf, offset, block)
+        except ValueError as e:
+            raise ValueError(f"GRO文件格式错误: {gro_file}: {e}")
+        n_atoms = len(starts)
+
+        residue_encoder = _CategoryEncoder()
+        atom_encoder = _CategoryEncoder()
+
+        if n_atoms > 0:
+            field_width = _detect_field_width(mm[starts[0]:mm.find(b'\n', starts[0])])
+
+            columns = {name: [] for name in ('residue_numbers', 'residue_name_codes',
+                                             'atom_name_codes', 'atom_numbers', 'positions')}
+            try:
+                for begin in range(0, n_atoms, block):
+                    decoded = decode_gro_rows(buf, starts[begin:begin + block], field_width,
+                                              residue_encoder, atom_encoder, dtype)
+                    for name, values in decoded.items():
+                        columns[name].append(values)
+            except ValueError as e:
+                raise ValueError(f"GRO文件格式错误: {gro_file}: {e}")
+
+            columns = {name: np.concatenate(values) for name, values in columns.items()}
+        else:
+            columns = {
+                'residue_numbers': np.empty(0, dtype=np.int32),
+                'residue_name_codes': np.empty(0, dtype=np.int32),
+                'atom_name_codes': np.empty(0, dtype=np.int32),
+                'atom_numbers': np.empty(0, dtype=np.int32),
+                'positions': np.empty((0, 3), dtype=dtype),
+            }
+
+        # 最后一行是盒子向量
+        box_line = mm[box_start:_next_line(mm, box_start)].split()
+        box_vectors = [float(x) * NM_TO_ANGSTROM for x in box_line]
+    finally:
+        # 释放对内存映射的所有引用后才能关闭
+        buf = None
+        _close_map(mm)
+
+    table = _table_from_columns(columns, residue_encoder, atom_encoder)
+
+    return {
+        'table': table,
+        'box_vectors': box_vectors,
+        'title': title
+    }
+
+
+def index_gro_frames(gro_file: str, block: int = DEFAULT_DECODE_BLOCK) -> List[int]:
+    """扫描首尾相接的多帧.gro文件，返回各帧起始字节偏移（不解码原子行）"""
+    mm = _map_file(gro_file)
+    offsets = []
+    try:
+        buf = np.frombuffer(mm, dtype=np.uint8)
+        offset = 0
+        # 文件末尾可能有空行
+        while _NON_SPACE.search(mm, offset):
+            try:
+                _, _, box_start = _gro_frame_layout(mm, buf, offset, block)
+            except ValueError as e:
+                raise ValueError(f"GRO文件第{len(offsets) + 1}帧格式错误: {gro_file}: {e}")
+            offsets.append(offset)
+            offset = _next_line(mm, box_start)
+    finally:
+        buf = None
+        _close_map(mm)
+    return offsets
+
+
+def _last_line(path: str, tail_bytes: int = 4096) -> bytes:
+    """读取文件最后一个非空行"""
+    with open(path, 'rb') as f:
+        f.seek(0, 2)
+        size = f.tell()
+        f.seek(max(0, size - tail_bytes))
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    return lines[-1] if lines else b''
+
+
+def read_gro_header(gro_file: str) -> Dict:
+    """仅读取.gro文件的标题、原子数和盒子向量，不加载原子行"""
+    with open(gro_file, 'rb') as f:
+        title = f.readline().decode('utf-8', errors='replace').strip()
+        n_atoms = int(f.readline())
+    box_vectors = [float(x) * NM_TO_ANGSTROM for x in _last_line(gro_file).split()]
+    return {'title': title, 'n_atoms': n_atoms, 'box_vectors': box_vectors}
+
+
+def iter_gro_chunks(gro_file: str, chunk_size: int = DEFAULT_DECODE_BLOCK,
+                    dtype=np.float64) -> Iterator[CoordinateTable]:
+    """按固定原子数分块流式读取.gro文件
+
+    每次只读取一个块的字节，内存占用由chunk_size而非原子总数决定。
+    各块共享名称编码表，因此分类编码在块之间保持一致。
+    """
+    residue_encoder = _CategoryEncoder()
+    atom_encoder = _CategoryEncoder()
+
+    with open(gro_file, 'rb') as f:
+        f.readline()
+        remaining = int(f.readline())
+        field_width = None
+        stride = 64
+        carry = b''
+
+        while remaining > 0:
+            # 按行宽估算本块需要的字节数，不足的行留在carry中由下一块补齐
+            wanted = min(remaining, chunk_size) * stride - len(carry)
+            data = carry + f.read(max(wanted, 1 << 12))
+            buf = np.frombuffer(data, dtype=np.uint8)
+            ends = np.flatnonzero(buf == 10)
+            take = min(len(ends), remaining, chunk_size)
+            if take == 0:
+                raise ValueError(f"GRO文件原子行不足: 还缺少 {remaining} 行")
+
+            starts = np.concatenate(([0], ends[:take - 1] + 1)).astype(np.int64)
+            if field_width is None:
+                field_width = _detect_field_width(data[:ends[0]])
+                stride = int(ends[0]) + 1
+
+            try:
+                columns = decode_gro_rows(buf, starts, field_width,
+                                          residue_encoder, atom_encoder, dtype)
+            except ValueError as e:
+                raise ValueError(f"GRO文件格式错误: {gro_file}: {e}")
+
+            carry = data[ends[take - 1] + 1:]
+            remaining -= take
+            yield _table_from_columns(columns, residue_encoder, atom_encoder)
+
+
+def read_pdb_header(pdb_file: str) -> Dict:
+    """读取PDB文件的CRYST1盒子信息并统计原子数（多MODEL文件只统计第一个MODEL）"""
+    box_vectors = None
+    n_atoms = 0
+    with open(pdb_file, 'rb') as f:
+        for line in f:
+            if line.startswith((b'ATOM', b'HETATM')):
+                n_atoms += 1
+            elif line.startswith(b'CRYST1') and box_vectors is None:
+                box_vectors = _pdb_box(line)
+            elif line.startswith(b'ENDMDL'):
+                break
+    return {'title': '', 'n_atoms': n_atoms, 'box_vectors': box_vectors}
+
+
+def _pdb_box(line: bytes) -> List[float]:
+    return [float(line[6:15]), float(line[15:24]), float(line[24:33])]
+
+
+def _pdb_table(records: List[bytes], residue_encoder: _CategoryEncoder,
+               atom_encoder: _CategoryEncoder, dtype=np.float64) -> CoordinateTable:
+    """由一组ATOM/HETATM记录构建CoordinateTable"""
+    rows = np.array([line[:54].ljust(54) for line in records], dtype='S54')
+    rows = rows.view(np.uint8).reshape(len(records), 54)
+    positions = np.empty((len(records), 3), dtype=dtype)
+    for k, start in enumerate((30, 38, 46)):
+        positions[:, k] = _field(rows, start, start + 8).astype(np.float64)
+    columns = {
+        'residue_numbers': _field(rows, 22, 26).astype(np.int32),
+        'residue_name_codes': residue_encoder.encode(_field(rows, 17, 20)),
+        'atom_name_codes': atom_encoder.encode(_field(rows, 12, 16)),
+        'atom_numbers': _field(rows, 6, 11).astype(np.int32),
+        'positions': positions,
+    }
+    return _table_from_columns(columns, residue_encoder, atom_encoder)
+
+
+def iter_pdb_chunks(pdb_file: str, chunk_size: int = DEFAULT_DECODE_BLOCK,
+                    dtype=np.float64) -> Iterator[CoordinateTable]:
+    """按固定原子数分块流式读取PDB文件的ATOM/HETATM记录（多MODEL文件只读第一个MODEL）"""
+    residue_encoder = _CategoryEncoder()
+    atom_encoder = _CategoryEncoder()
+
+    records = []
+    with open(pdb_file, 'rb') as f:
+        for line in f:
+            if line.startswith((b'ATOM', b'HETATM')):
+                records.append(line.rstrip(b'\r\n'))
+                if len(records) == chunk_size:
+                    yield _pdb_table(records, residue_encoder, atom_encoder, dtype)
+                    records = []
+            elif line.startswith(b'ENDMDL'):
+                break
+    if records:
+        yield _pdb_table(records, residue_encoder, atom_encoder, dtype)
+
+
+def index_pdb_frames(pdb_file: str) -> List[int]:
+    """返回PDB文件各MODEL记录的起始字节偏移（没有MODEL记录时整个文件为一帧）"""
+    mm = _map_file(pdb_file) if os.path.getsize(pdb_file) else None
+    if mm is None:
+        return [0]
+    offsets = [0] if mm[:6] == b'MODEL ' else []
+    try:
+        position = mm.find(b'\nMODEL ')
+        while position != -1:
+            offsets.append(position + 1)
+            position = mm.find(b'\nMODEL ', position + 1)
+    finally:
+        _close_map(mm)
+    return offsets or [0]
+
+
+def read_pdb_frame(pdb_file: str, offset: int = 0, dtype=np.float64) -> Dict:
+    """读取从offset开始的一个MODEL（到ENDMDL或下一个MODEL为止）
+
+    帧内没有CRYST1记录时使用文件开头（第一个MODEL之前）的CRYST1。
+    """
+    box_vectors = None
+    records = []
+    with open(pdb_file, 'rb') as f:
+        if offset > 0:
+            for line in f:
+                if line.startswith((b'MODEL', b'ATOM', b'HETATM')):
+                    break
+                if line.startswith(b'CRYST1'):
+                    box_vectors = _pdb_box(line)
+            f.seek(offset)
+        for k, line in enumerate(f):
+            if line.startswith((b'ATOM', b'HETATM')):
+                records.append(line.rstrip(b'\r\n'))
+            elif line.startswith(b'CRYST1'):
+                box_vectors = _pdb_box(line)
+            elif line.startswith((b'ENDMDL', b'END ', b'END\n', b'END\r')) or \
+                    (k > 0 and line.startswith(b'MODEL')):
+                break
+
+    return {
+        'table': _pdb_table(records, _CategoryEncoder(), _CategoryEncoder(), dtype),
+        'box_vectors': box_vectors,
+        'title': ''
+    }
+
+
+def _trr_header(mm, offset: int) -> Dict:
+    """解码offset处的.trr帧头，返回各数据块大小、原子数、步数、时间与实数类型"""
+    if offset + _TRR_PREAMBLE + 4 * len(_TRR_HEADER_INTS) > len(mm):
+        raise ValueError(f"帧头不完整（偏移 {offset}）")
+    magic, string_size, length = np.frombuffer(mm, dtype='>i4', count=3, offset=offset).tolist()
+    if magic != TRR_MAGIC or string_size != len(TRR_VERSION) + 1 or length != len(TRR_VERSION) \
+            or mm[offset + 12:offset + _TRR_PREAMBLE] != TRR_VERSION:
+        raise ValueError(f"不是TRR帧头（偏移 {offset}）")
+    header = dict(zip(_TRR_HEADER_INTS, np.frombuffer(
+        mm, dtype='>i4', count=len(_TRR_HEADER_INTS), offset=offset + _TRR_PREAMBLE).tolist()))
+    if header['ir_size'] or header['e_size'] or header['top_size'] or header['sym_size']:
+        raise ValueError(f"不支持含ir/e/top/sym数据的TRR帧（偏移 {offset}）")
+
+    # 单/双精度由盒子或坐标等数据块的大小确定
+    natoms = header['natoms']
+    if header['box_size']:
+        real_size = header['box_size'] // 9
+    elif natoms and (header['x_size'] or header['v_size'] or header['f_size']):
+        real_size = (header['x_size'] or header['v_size'] or header['f_size']) // (3 * natoms)
+    else:
+        real_size = 4
+    if real_size not in (4, 8):
+        raise ValueError(f"无法确定TRR帧的精度（偏移 {offset}）")
+    real = np.dtype('>f4' if real_size == 4 else '>f8')
+
+    ints_end = offset + _TRR_PREAMBLE + 4 * len(_TRR_HEADER_INTS)
+    header['time'], header['lambda'] = np.frombuffer(mm, dtype=real, count=2,
+                                                     offset=ints_end).tolist()
+    header['real'] = real
+    header['header_size'] = ints_end + 2 * real_size - offset
+    header['frame_size'] = header['header_size'] + sum(header[name] for name in _TRR_BLOCKS)
+    return header
+
+
+def index_trr_frames(trr_file: str) -> List[int]:
+    """.trr文件各帧的起始字节偏移
+
+    只依次解码帧头并按数据块大小跳到下一帧；结果按文件的大小与修改时间缓存，
+    同一文件只扫描一次。末尾写了一半的帧（轨迹仍在写出时）不计入。
+    """
+    stat = os.stat(trr_file)
+    key = (os.path.realpath(trr_file), stat.st_size, stat.st_mtime_ns)
+    if key in _trr_index_cache:
+        return list(_trr_index_cache[key])
+
+    offsets = []
+    if stat.st_size:
+        mm = _map_file(trr_file)
+        try:
+            offset = 0
+            while offset < len(mm):
+                try:
+                    header = _trr_header(mm, offset)
+                except ValueError as e:
+                    if offsets and offset + _TRR_PREAMBLE + 4 * len(_TRR_HEADER_INTS) > len(mm):
+                        break
+                    raise ValueError(f"TRR文件格式错误: {trr_file}: {e}")
+                if offset + header['frame_size'] > len(mm):
+                    break
+                offsets.append(offset)
+                offset += header['frame_size']
+        finally:
+            _close_map(mm)
+
+    if not offsets:
+        raise ValueError(f"TRR文件中没有完整的帧: {trr_file}")
+    _trr_index_cache[key] = offsets
+    return list(offsets)
+
+
+def read_trr_frame(trr_file: str, offset: int = 0, dtype=np.float64) -> Dict:
+    """读取从offset开始的一个.trr帧（见index_trr_frames）
+
+    数据块以大端dtype直接从内存映射解码，返回'positions'（Angstrom）、
+    'velocities'（Angstrom/fs）、'box_vectors'（Angstrom，.gro的顺序），帧中没有的项为None。
+    """
+    mm = _map_file(trr_file)
+    try:
+        try:
+            header = _trr_header(mm, offset)
+        except ValueError as e:
+            raise ValueError(f"TRR文件格式错误: {trr_file}: {e}")
+        if offset + header['frame_size'] > len(mm):
+            raise ValueError(f"TRR文件格式错误: {trr_file}: 帧数据不完整（偏移 {offset}）")
+
+        natoms = header['natoms']
+        real = header['real']
+        blocks = {}
+        position = offset + header['header_size']
+        for name in _TRR_BLOCKS:
+            size = header[name]
+            if size:
+                # 逐块复制为本机字节序，不保留对内存映射的引用
+                values = np.frombuffer(mm, dtype=real, count=size // real.itemsize, offset=position)
+                blocks[name] = values.astype(dtype)
+                values = None
+            position += size
+    finally:
+        _close_map(mm)
+
+    def vectors(name: str, scale: float) -> Optional[np.ndarray]:
+        if name not in blocks:
+            return None
+        if len(blocks[name]) != 3 * natoms:
+            raise ValueError(f"TRR文件格式错误: {trr_file}: {name}与原子数({natoms})不一致")
+        values = blocks[name].reshape(natoms, 3)
+        values *= scale
+        return values
+
+    return {
+        'table': None,
+        'positions': vectors('x_size', NM_TO_ANGSTROM),
+        'velocities': vectors('v_size', NM_PER_PS_TO_ANGSTROM_PER_FS),
+        'box_vectors': _trr_box(blocks.get('box_size')),
+        'title': f"step= {header['step']} t= {header['time']:g}",
+        'step': header['step'],
+        'time': header['time'],
+    }
+
+
+def _trr_box(box: Optional[np.ndarray]) -> Optional[List[float]]:
+    """3x3盒子矩阵（各行为盒子向量，nm）-> .gro顺序的盒子向量（Angstrom）"""
+    if box is None:
+        return None
+    m = (box.reshape(3, 3) * NM_TO_ANGSTROM).tolist()
+    vectors = [m[0][0], m[1][1], m[2][2]]
+    off_diagonal = [m[0][1], m[0][2], m[1][0], m[1][2], m[2][0], m[2][1]]
+    if any(off_diagonal):
+        vectors += off_diagonal
+    return vectors
+
+
+def select_frame(offsets: List[int], frame: int, coord_file: str) -> int:
+    """第frame帧（负数从末尾计）的起始偏移"""
+    if not -len(offsets) <= frame < len(offsets):
+        raise ValueError(f"帧号 {frame} 超出范围: {coord_file} 共 {len(offsets)} 帧")
+    return offsets[frame]
+
+
+def index_coordinate_frames(coord_file: str) -> List[int]:
+    """多帧坐标文件（首尾相接的.gro、多MODEL的.pdb或.trr）的各帧起始偏移"""
+    suffix = Path(coord_file).suffix.lower()
+    if suffix == '.gro':
+        return index_gro_frames(coord_file)
+    if suffix == '.pdb':
+        return index_pdb_frames(coord_file)
+    if suffix == '.trr':
+        return index_trr_frames(coord_file)
+    raise ValueError(f"不支持的坐标文件格式: {suffix}")
+
+
+def read_coordinate_frame(coord_file: str, offset: int = 0, dtype=np.float64) -> Dict:
+    """按index_coordinate_frames给出的偏移读取一帧：{'table', 'box_vectors', 'title'}
+
+    .trr帧不含原子名等信息，'table'为None，坐标与速度在'positions'/'velocities'中。
+    """
+    suffix = Path(coord_file).suffix.lower()
+    if suffix == '.gro':
+        return read_gro_table(coord_file, dtype=dtype, offset=offset)
+    if suffix == '.pdb':
+        return read_pdb_frame(coord_file, offset, dtype)
+    if suffix == '.trr':
+        return read_trr_frame(coord_file, offset, dtype)
+    raise ValueError(f"不支持的坐标文件格式: {suffix}")
@@ -4,11 +4,33 @@ GROMACS文件解析器
 解析.top, .itp, .gro, .pdb文件
 """
 
+import logging
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Dict, Iterable, List, Optional, Tuple, Any
 from dataclasses import dataclass
 
+import numpy as np
+
+from parsers.coordinate_reader import (
+    DEFAULT_DECODE_BLOCK, CoordinateTable, index_coordinate_frames, index_trr_frames,
+    iter_gro_chunks, iter_pdb_chunks, read_coordinate_frame, read_gro_header, read_gro_table,
+    read_pdb_header, read_trr_frame, select_frame
+)
+from parsers.bonded_parameters import BondedParameterResolver, atom_type_codes
+from parsers.bonded_sections import (
+    PARALLEL_MIN_LINES, ParsedSection, find_bonded_spans, iter_lexemes_with_spans,
+    parse_spans_parallel
+)
+from parsers.interaction_table import (
+    ATOM_KEYS, INTERACTION_ATOMS, InteractionTableBuilder, InteractionView,
+    as_interaction_table, canonical_codes, canonical_type_key, empty_interactions
+)
+from parsers.topology_lexer import assign_sections, gc_paused
+from parsers.topology_preprocessor import TopologyPreprocessor, file_digest
+
 @dataclass
 class Atom:
     """原子数据结构"""
@@ -63,17 +85,55 @@ class Molecule:
     angle_types: Dict[str, Dict] = None
     dihedral_types: Dict[str, Dict] = None
 
+
+def _parse_itp_worker(task: Tuple) -> Tuple[Dict, Dict[str, int]]:
+    """进程池任务：解析单个ITP文件，返回解析结果和缓存统计"""
+    itp_file, include_dirs, defines, cache_settings = task
+    logger = logging.getLogger('gro2mol2lmp')
+    
+    cache = None
+    if cache_settings is not None:
+        from utils.topology_cache import TopologyCache
+        cache_dir, max_size_mb = cache_settings
+        cache = TopologyCache(cache_dir, max_size_mb=max_size_mb, logger=logger)
+    
+    parser = GromacsParser(logger, include_dirs=include_dirs, defines=defines, cache=cache)
+    itp_data = parser._parse_itp_file(itp_file)
+    return itp_data, (cache.stats if cache is not None else {})
+
+
 class GromacsParser:
     """GROMACS文件解析器"""
     
-    def __init__(self, logger):
+    def __init__(self, logger, coordinate_dtype=np.float64,
+                 include_dirs: Optional[List[str]] = None,
+                 defines: Optional[Dict[str, List[str]]] = None,
+                 cache=None, jobs: int = 1):
         self.logger = logger
         self.molecules = {}
         self.system_composition = []
+        self.coordinate_dtype = coordinate_dtype
+        # 预处理器设置：#include搜索路径与预定义宏（类似grompp的-I/-D）
+        self.include_dirs = list(include_dirs or [])
+        self.defines = dict(defines or {})
+        # 可选的拓扑磁盘缓存（utils.topology_cache.TopologyCache）
+        self.cache = cache
+        # 并行解析ITP文件（及单个文件中超大成键section）的进程数
+        self.jobs = max(1, jobs)
+        # 达到该行数的成键section才分块并行解析
+        self.parallel_min_lines = PARALLEL_MIN_LINES
         
     def parse_system(self, top_file: str, coord_file: str, 
-                    itp_files: Optional[List[str]] = None) -> Dict:
-        """解析完整的GROMACS系统"""
+                    itp_files: Optional[List[str]] = None,
+                    stream_coordinates: bool = False,
+                    chunk_size: int = DEFAULT_DECODE_BLOCK,
+                    frame: int = 0) -> Dict:
+        """解析完整的GROMACS系统
+        
+        stream_coordinates为True时不加载坐标，而是在system_data['coordinate_chunks']
+        中提供按chunk_size分块的惰性迭代器，由生成器边读边写。
+        frame为多帧坐标文件（.trr、多帧.gro、多MODEL的.pdb）中使用的帧号（负数从末尾计）。
+        """
         system_data = {
             'molecules': {},
             'system_composition': [],
@@ -91,17 +151,19 @@ class GromacsParser:
         self.logger.info(f"解析拓扑文件: {top_file}")
         top_data = self._parse_topology_file(top_file)
         
-        # 解析ITP文件
+        # 解析ITP文件（按命令行顺序合并，后者覆盖前者）
         if itp_files:
-            for itp_file in itp_files:
-                self.logger.info(f"解析ITP文件: {itp_file}")
-                itp_data = self._parse_itp_file(itp_file)
+            for itp_data in self._parse_itp_files(itp_files):
                 # 合并ITP数据到系统中
                 self._merge_itp_data(system_data, itp_data)
         
         # 解析坐标文件
-        self.logger.info(f"解析坐标文件: {coord_file}")
-        coord_data = self._parse_coordinate_file(coord_file)
+        if stream_coordinates:
+            self.logger.info(f"流式读取坐标文件: {coord_file} (块大小: {chunk_size})")
+            coord_data = self._open_coordinate_stream(coord_file, chunk_size)
+        else:
+            self.logger.info(f"解析坐标文件: {coord_file}")
+            coord_data = self._parse_coordinate_file(coord_file, frame)
         
         # 合并拓扑数据
         if 'molecules' in top_data:
@@ -122,11 +184,25 @@ class GromacsParser:
         # 合并坐标数据
         if 'coordinates' in coord_data:
             system_data['coordinates'] = coord_data['coordinates']
+        if 'coordinate_table' in coord_data:
+            system_data['coordinate_table'] = coord_data['coordinate_table']
+        if 'coordinate_chunks' in coord_data:
+            del system_data['coordinates']
+            system_data['coordinate_chunks'] = coord_data['coordinate_chunks']
+            system_data['n_coordinates'] = coord_data['n_coordinates']
+        if 'positions' in coord_data:
+            # .trr只有坐标与速度，原子名和残基信息按拓扑中的分子组成展开
+            table = self._topology_coordinate_table(
+                system_data, coord_data['positions'], coord_data['velocities'])
+            system_data['coordinate_table'] = table
+            system_data['coordinates'] = table.as_atoms()
         if 'box_vectors' in coord_data:
             system_data['box_vectors'] = coord_data['box_vectors']
         if 'title' in coord_data:
             system_data['title'] = coord_data['title']
         
+        self._resolve_bonded_parameters(system_data)
+        
         return system_data
     
     def parse_itp_only(self, itp_files: List[str]) -> Dict:
@@ -143,10 +219,7 @@ class GromacsParser:
         }
         
         # 解析每个ITP文件
-        for itp_file in itp_files:
-            self.logger.info(f"解析ITP文件: {itp_file}")
-            itp_data = self._parse_itp_file(itp_file)
-            
+        for itp_data in self._parse_itp_files(itp_files):
             # 合并分子数据
             system_data['molecules'].update(itp_data.get('molecules', {}))
             
@@ -158,12 +231,45 @@ class GromacsParser:
                             itp_data['global_force_field'][ff_type]
                         )
         
+        self._resolve_bonded_parameters(system_data)
+        
         # 为单分子模式添加虚拟坐标（如果没有坐标信息）
         self._add_dummy_coordinates(system_data)
         
         self.logger.info(f"解析完成，发现 {len(system_data['molecules'])} 个分子类型")
         return system_data
     
+    def _parse_itp_files(self, itp_files: List[str]) -> List[Dict]:
+        """解析多个ITP文件，jobs>1时使用进程池并行
+        
+        结果总是按输入顺序返回，保证合并结果与串行解析一致。
+        """
+        n_workers = min(self.jobs, len(itp_files))
+        if n_workers <= 1:
+            results = []
+            for itp_file in itp_files:
+                self.logger.info(f"解析ITP文件: {itp_file}")
+                results.append(self._parse_itp_file(itp_file))
+            return results
+        
+        self.logger.info(f"使用 {n_workers} 个进程并行解析 {len(itp_files)} 个ITP文件")
+        cache_settings = None
+        if self.cache is not None:
+            cache_settings = (str(self.cache.cache_dir), self.cache.max_size / (1024 * 1024))
+        tasks = [(itp_file, self.include_dirs, self.defines, cache_settings)
+                 for itp_file in itp_files]
+        
+        results = []
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            # executor.map按提交顺序返回结果
+            for itp_file, (itp_data, cache_stats) in zip(itp_files, executor.map(_parse_itp_worker, tasks)):
+                self.logger.info(f"解析ITP文件: {itp_file}")
+                if self.cache is not None:
+                    for name, value in cache_stats.items():
+                        self.cache.stats[name] += value
+                results.append(itp_data)
+        return results
+    
     def _add_dummy_coordinates(self, system_data: Dict):
         """为没有坐标的原子添加虚拟坐标"""
         
@@ -178,59 +284,65 @@ class GromacsParser:
     
     def _parse_topology_file(self, top_file: str) -> Dict:
         """解析.top文件"""
-        data = {'molecules': {}, 'system_composition': [], 'global_force_field': {
-            'atom_types': {},
-            'bond_types': {},
-            'angle_types': {},
-            'dihedral_types': {}
-        }}
-        
-        with open(top_file, 'r') as f:
-            content = f.read()
-        
-        # 移除注释
-        content = self._remove_comments(content)
-        
-        # 解析各个section
-        sections = self._split_into_sections(content)
-        
-        for section_name, section_content in sections.items():
-            if section_name == 'system':
-                data['system_name'] = section_content.strip()
-            elif section_name == 'molecules':
-                data['system_composition'] = self._parse_molecules_section(section_content)
-            elif section_name == 'moleculetype':
-                # 如果top文件中定义了分子类型
-                mol_data = self._parse_moleculetype_section(section_content)
-                if mol_data:
-                    data['molecules'][mol_data['name']] = mol_data
-            elif section_name == 'atomtypes':
-                data['global_force_field']['atom_types'].update(self._parse_atomtypes_section(section_content))
-            elif section_name == 'bondtypes':
-                data['global_force_field']['bond_types'].update(self._parse_bondtypes_section(section_content))
-            elif section_name == 'angletypes':
-                data['global_force_field']['angle_types'].update(self._parse_angletypes_section(section_content))
-            elif section_name == 'dihedraltypes':
-                data['global_force_field']['dihedral_types'].update(self._parse_dihedraltypes_section(section_content))
-        
-        return data
+        return self._parse_topology_cached(top_file, 'top')
     
     def _parse_itp_file(self, itp_file: str) -> Dict:
         """解析.itp文件，支持多个分子类型"""
-        with open(itp_file, 'r') as f:
-            content = f.read()
-        
-        content = self._remove_comments(content)
+        data = self._parse_topology_cached(itp_file, 'itp')
         
-        # 将内容按分子类型分组
-        molecules_data = self._parse_multiple_molecules(content)
-        
-        return molecules_data
+        # 返回包含多个分子和全局力场的数据
+        return {
+            'molecules': data['molecules'],
+            'global_force_field': data['global_force_field']
+        }
+    
+    def _parse_topology_cached(self, path: str, kind: str) -> Dict:
+        """解析拓扑文件，启用缓存时优先从磁盘缓存读取"""
+        if self.cache is None:
+            return self._parse_topology(path)[0]
+        
+        key = self.cache.make_key(path, kind, self.include_dirs, self.defines)
+        data = self.cache.load(key)
+        if data is not None:
+            self.logger.debug(f"拓扑缓存命中: {path}")
+            return data
+        
+        data, dependencies = self._parse_topology(path)
+        self.cache.store(key, data, dependencies)
+        return data
+    
+    def _parse_topology(self, path: str) -> Tuple[Dict, List[Tuple[str, str]]]:
+        """解析拓扑文件，返回拓扑数据和依赖文件列表
+        
+        jobs>1且文件不含预处理指令时，超大的成键section在进程池中分块解析。
+        """
+        if self.jobs > 1 and not self.defines:
+            spans = find_bonded_spans(path, self.parallel_min_lines)
+            if spans:
+                n_lines = sum(span.n_lines for span in spans)
+                self.logger.info(f"使用 {self.jobs} 个进程并行解析 {len(spans)} 个成键section"
+                                 f"（{n_lines} 行）")
+                parsed = parse_spans_parallel(path, spans, self.jobs)
+                if parsed is not None:
+                    records = assign_sections(iter_lexemes_with_spans(path, spans, parsed))
+                    dependencies = [(os.path.abspath(path), file_digest(path))]
+                    return self._build_topology(records), dependencies
+                self.logger.debug(f"成键section包含非标准数据行，回退到串行解析: {path}")
+        
+        preprocessor = self._make_preprocessor()
+        data = self._build_topology(preprocessor.iter_records(path))
+        return data, preprocessor.dependencies
+    
+    def _make_preprocessor(self) -> TopologyPreprocessor:
+        """创建带有当前搜索路径和宏定义的预处理器"""
+        return TopologyPreprocessor(self.include_dirs, self.defines, self.logger)
     
-    def _parse_multiple_molecules(self, content: str) -> Dict:
-        """解析包含多个分子类型的内容"""
-        lines = content.split('\n')
+    def _build_topology(self, records: Iterable[Tuple[Optional[str], List[str], int]]) -> Dict:
+        """由词法记录流构建拓扑数据（.top与.itp共用）
         
+        每条记录在到达时立即转换，文本只在词法分析时切分一次，
+        不再保留整段section的中间副本。
+        """
         # 全局力场参数（在任何分子定义之前）
         global_force_field = {
             'atom_types': {},
@@ -239,163 +351,269 @@ class GromacsParser:
             'dihedral_types': {}
         }
         
-        molecules = {}
+        data = {
+            'molecules': {},
+            'system_composition': [],
+            'global_force_field': global_force_field
+        }
+        molecules = data['molecules']
+        system_lines = []
+        
+        # 分子内section的逐行解析函数（成键section写入列式构建器）
+        molecule_rows = {
+            'atoms': self._parse_atom_row,
+        }
+        interaction_builders = {}
+        # 全局力场section的逐行解析函数
+        force_field_rows = {
+            'atomtypes': ('atom_types', self._parse_atomtype_row),
+            'bondtypes': ('bond_types', self._parse_bondtype_row),
+            'angletypes': ('angle_types', self._parse_angletype_row),
+            'dihedraltypes': ('dihedral_types', self._parse_dihedraltype_row),
+        }
+        
         current_molecule = None
         current_section = None
-        section_content = []
-        
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            
-            # 跳过空行
-            if not line:
-                i += 1
-                continue
-            
-            # 检查是否是section标题
-            if line.startswith('[') and line.endswith(']'):
-                # 保存前一个section的内容
-                if current_section and section_content:
-                    self._process_section(current_molecule, current_section, 
-                                        '\n'.join(section_content), molecules, global_force_field)
+        target = None
+        row_parser = None
+        builder = None
+        
+        with gc_paused():
+            for section, tokens, lineno in records:
+                if section != current_section:
+                    # 结束前一个section
+                    self._finish_section(current_molecule, current_section, builder,
+                                         molecules, global_force_field)
+                    current_section = section
+                    target = None
+                    row_parser = None
+                    builder = None
+                    bonded_types = False
+                    previous_type = None
+                    if section in INTERACTION_ATOMS and current_molecule:
+                        # 同一分子中重复出现的section继续累积
+                        key = (current_molecule, section)
+                        builder = interaction_builders.get(key)
+                        if builder is None:
+                            builder = InteractionTableBuilder(INTERACTION_ATOMS[section])
+                            interaction_builders[key] = builder
+                    elif section in molecule_rows and current_molecule:
+                        target = molecules[current_molecule][section]
+                        row_parser = molecule_rows[section]
+                    elif section in force_field_rows:
+                        ff_type, row_parser = force_field_rows[section]
+                        target = global_force_field[ff_type]
+                        bonded_types = ff_type != 'atom_types'
                 
-                # 开始新的section
-                current_section = line[1:-1].strip()
-                section_content = []
-                
-                # 如果是moleculetype，创建新的分子
-                if current_section == 'moleculetype':
-                    # 读取下一行获取分子名称
-                    i += 1
-                    while i < len(lines) and not lines[i].strip():
-                        i += 1
-                    if i < len(lines):
-                        mol_line = lines[i].strip()
-                        parts = mol_line.split()
-                        if parts:
-                            mol_name = parts[0]
-                            nrexcl = int(parts[1]) if len(parts) > 1 else 1
-                            current_molecule = mol_name
-                            molecules[mol_name] = {
-                                'name': mol_name,
-                                'nrexcl': nrexcl,
-                                'atoms': [],
-                                'bonds': [],
-                                'angles': [],
-                                'dihedrals': []
-                            }
-                i += 1
-                continue
-            
-            # 收集section内容
-            if current_section:
-                section_content.append(line)
+                if builder is not None:
+                    if tokens.__class__ is ParsedSection:
+                        # 已在子进程中解析好的整段数据
+                        builder.extend_arrays(tokens.atoms, tokens.function_types,
+                                              tokens.param_counts, tokens.parameters)
+                        continue
+                    try:
+                        builder.add_tokens(tokens)
+                    except ValueError as e:
+                        raise ValueError(f"[ {section} ] 第{lineno}行解析失败: {e}")
+                elif row_parser is not None:
+                    try:
+                        item = row_parser(tokens)
+                    except ValueError as e:
+                        raise ValueError(f"[ {section} ] 第{lineno}行解析失败: {e}")
+                    if item is None:
+                        continue
+                    if isinstance(target, list):
+                        target.append(item)
+                    elif bonded_types:
+                        previous_type = self._add_bonded_type(target, *item, previous_type)
+                    else:
+                        target[item[0]] = item[1]
+                elif section == 'moleculetype':
+                    # moleculetype的数据行开始一个新分子
+                    mol_name = tokens[0]
+                    nrexcl = int(tokens[1]) if len(tokens) > 1 else 1
+                    current_molecule = mol_name
+                    molecules[mol_name] = {
+                        'name': mol_name,
+                        'nrexcl': nrexcl,
+                        'atoms': [],
+                        'bonds': empty_interactions(2),
+                        'angles': empty_interactions(3),
+                        'dihedrals': empty_interactions(4)
+                    }
+                elif section == 'system':
+                    system_lines.append(' '.join(tokens))
+                elif section == 'molecules':
+                    if len(tokens) >= 2:
+                        data['system_composition'].append((tokens[0], int(tokens[1])))
             
-            i += 1
+            # 结束最后一个section
+            self._finish_section(current_molecule, current_section, builder,
+                                 molecules, global_force_field)
         
-        # 处理最后一个section
-        if current_section and section_content:
-            self._process_section(current_molecule, current_section, 
-                                '\n'.join(section_content), molecules, global_force_field)
+        if system_lines:
+            data['system_name'] = '\n'.join(system_lines)
         
         # 为每个分子添加全局力场参数的引用
         for mol_name in molecules:
             molecules[mol_name]['global_force_field'] = global_force_field
         
-        # 返回包含多个分子和全局力场的数据
-        result = {
-            'molecules': molecules,
-            'global_force_field': global_force_field
-        }
-        
-        return result
+        return data
     
-    def _process_section(self, current_molecule: str, section_name: str, 
-                        content: str, molecules: Dict, global_force_field: Dict):
-        """处理单个section的内容"""
+    def _finish_section(self, current_molecule: Optional[str], section_name: Optional[str],
+                        builder: Optional[InteractionTableBuilder],
+                        molecules: Dict, global_force_field: Dict):
+        """section结束后的处理：生成列式成键数据，并从中提取类型"""
+        
+        if not current_molecule:
+            return
+        
+        if builder is not None:
+            molecules[current_molecule][section_name] = InteractionView(builder.build())
         
-        if section_name == 'atoms' and current_molecule:
-            molecules[current_molecule]['atoms'] = self._parse_atoms_section(content)
-        elif section_name == 'bonds' and current_molecule:
-            molecules[current_molecule]['bonds'] = self._parse_bonds_section(content)
-            # 从具体的bonds中提取bond types
+        if section_name == 'bonds':
             self._extract_bond_types_from_bonds(molecules[current_molecule], global_force_field)
-        elif section_name == 'angles' and current_molecule:
-            molecules[current_molecule]['angles'] = self._parse_angles_section(content)
-            # 从具体的angles中提取angle types
+        elif section_name == 'angles':
             self._extract_angle_types_from_angles(molecules[current_molecule], global_force_field)
-        elif section_name == 'dihedrals' and current_molecule:
-            molecules[current_molecule]['dihedrals'] = self._parse_dihedrals_section(content)
-            # 从具体的dihedrals中提取dihedral types
+        elif section_name == 'dihedrals':
             self._extract_dihedral_types_from_dihedrals(molecules[current_molecule], global_force_field)
-        elif section_name == 'atomtypes':
-            global_force_field['atom_types'].update(self._parse_atomtypes_section(content))
-        elif section_name == 'bondtypes':
-            global_force_field['bond_types'].update(self._parse_bondtypes_section(content))
-        elif section_name == 'angletypes':
-            global_force_field['angle_types'].update(self._parse_angletypes_section(content))
-        elif section_name == 'dihedraltypes':
-            global_force_field['dihedral_types'].update(self._parse_dihedraltypes_section(content))
-    
-    def _parse_coordinate_file(self, coord_file: str) -> Dict:
-        """解析坐标文件(.gro或.pdb)"""
+    
+    def _parse_coordinate_file(self, coord_file: str, frame: int = 0) -> Dict:
+        """解析坐标文件(.gro、.pdb或.trr)的第frame帧"""
         file_ext = Path(coord_file).suffix.lower()
         
-        if file_ext == '.gro':
+        if file_ext == '.trr':
+            return self._parse_trr_file(coord_file, frame)
+        elif frame != 0 and file_ext in ('.gro', '.pdb'):
+            return self._parse_coordinate_frame(coord_file, frame)
+        elif file_ext == '.gro':
             return self._parse_gro_file(coord_file)
         elif file_ext == '.pdb':
             return self._parse_pdb_file(coord_file)
         else:
             raise ValueError(f"不支持的坐标文件格式: {file_ext}")
     
-    def _parse_gro_file(self, gro_file: str) -> Dict:
-        """解析.gro文件"""
-        coordinates = []
+    def _open_coordinate_stream(self, coord_file: str, chunk_size: int) -> Dict:
+        """打开坐标文件的分块流，仅预先读取头部信息"""
+        file_ext = Path(coord_file).suffix.lower()
+        
+        if file_ext == '.gro':
+            header = read_gro_header(coord_file)
+            chunks = iter_gro_chunks(coord_file, chunk_size, self.coordinate_dtype)
+        elif file_ext == '.pdb':
+            header = read_pdb_header(coord_file)
+            chunks = iter_pdb_chunks(coord_file, chunk_size, self.coordinate_dtype)
+        else:
+            raise ValueError(f"不支持的坐标文件格式: {file_ext}")
         
-        with open(gro_file, 'r') as f:
-            lines = f.readlines()
+        return {
+            'coordinate_chunks': chunks,
+            'n_coordinates': header['n_atoms'],
+            'box_vectors': header['box_vectors'],
+            'title': header['title']
+        }
+    
+    def _parse_coordinate_frame(self, coord_file: str, frame: int) -> Dict:
+        """按帧偏移索引读取多帧.gro/.pdb中的一帧"""
+        offsets = index_coordinate_frames(coord_file)
+        frame_data = read_coordinate_frame(coord_file, select_frame(offsets, frame, coord_file),
+                                           self.coordinate_dtype)
+        table = frame_data['table']
         
-        # 第一行是标题
-        title = lines[0].strip()
+        self.logger.debug(f"坐标文件共 {len(offsets)} 帧，第 {frame % len(offsets)} 帧包含 {len(table)} 个原子")
         
-        # 第二行是原子数
-        n_atoms = int(lines[1].strip())
+        return {
+            'coordinates': table.as_atoms(),
+            'coordinate_table': table,
+            'box_vectors': frame_data['box_vectors'],
+            'title': frame_data['title']
+        }
+    
+    def _parse_trr_file(self, trr_file: str, frame: int) -> Dict:
+        """读取.trr轨迹的一帧（坐标、速度与盒子）"""
+        offsets = index_trr_frames(trr_file)
+        frame_data = read_trr_frame(trr_file, select_frame(offsets, frame, trr_file),
+                                    self.coordinate_dtype)
+        if frame_data['positions'] is None:
+            raise ValueError(f"TRR文件第 {frame} 帧中没有坐标: {trr_file}")
+        
+        self.logger.info(f"TRR文件共 {len(offsets)} 帧，使用第 {frame % len(offsets)} 帧 "
+                         f"(step {frame_data['step']}, t = {frame_data['time']:g} ps"
+                         f"{', 含速度' if frame_data['velocities'] is not None else ''})")
         
-        # 解析原子坐标
-        for i in range(2, 2 + n_atoms):
-            line = lines[i]
-            
-            # GRO格式解析
-            res_num = int(line[0:5])
-            res_name = line[5:10].strip()
-            atom_name = line[10:15].strip()
-            atom_num = int(line[15:20])
-            x = float(line[20:28]) * 10  # nm to Angstrom
-            y = float(line[28:36]) * 10
-            z = float(line[36:44]) * 10
-            
-            atom = Atom(
-                index=atom_num,
-                name=atom_name,
-                residue_name=res_name,
-                residue_number=res_num,
-                x=x, y=y, z=z
-            )
-            coordinates.append(atom)
-        
-        # 最后一行是盒子向量
-        box_line = lines[2 + n_atoms].strip().split()
-        box_vectors = [float(x) * 10 for x in box_line]  # nm to Angstrom
+        return {
+            'positions': frame_data['positions'],
+            'velocities': frame_data['velocities'],
+            'box_vectors': frame_data['box_vectors'],
+            'title': frame_data['title']
+        }
+    
+    def _topology_coordinate_table(self, system_data: Dict, positions, velocities) -> CoordinateTable:
+        """按system_composition展开拓扑中的原子名与残基，与给定的坐标组成坐标表"""
+        residue_codes: Dict[str, int] = {}
+        atom_codes: Dict[str, int] = {}
+        columns = []
+        residue_offset = 0
+        
+        for mol_name, mol_count in system_data.get('system_composition', []):
+            mol_data = system_data['molecules'].get(mol_name)
+            if mol_data is None:
+                raise ValueError(f"分子 {mol_name} 未定义，无法确定坐标对应的原子")
+            atoms = mol_data.get('atoms', [])
+            if not atoms or not mol_count:
+                continue
+            residues = np.array([atom.get('residue_number', 1) for atom in atoms], dtype=np.int32)
+            residues -= residues.min()
+            n_residues = int(residues.max()) + 1
+            # 各实例的残基按顺序连续编号
+            starts = residue_offset + 1 + n_residues * np.arange(mol_count, dtype=np.int32)
+            columns.append((
+                np.add.outer(starts, residues).ravel(),
+                np.tile(np.array([residue_codes.setdefault(atom.get('residue_name', ''),
+                                                           len(residue_codes))
+                                  for atom in atoms], dtype=np.int32), mol_count),
+                np.tile(np.array([atom_codes.setdefault(atom.get('name', ''), len(atom_codes))
+                                  for atom in atoms], dtype=np.int32), mol_count),
+            ))
+            residue_offset += n_residues * mol_count
+        
+        n_atoms = sum(len(column[0]) for column in columns)
+        if n_atoms != len(positions):
+            raise ValueError(f"坐标文件原子数({len(positions)})与拓扑中的原子数({n_atoms})不一致")
+        
+        def merged(k: int) -> np.ndarray:
+            if not columns:
+                return np.empty(0, dtype=np.int32)
+            return np.concatenate([column[k] for column in columns]).astype(np.int32)
+        
+        return CoordinateTable(
+            residue_numbers=merged(0),
+            residue_name_codes=merged(1),
+            residue_names=list(residue_codes),
+            atom_name_codes=merged(2),
+            atom_names=list(atom_codes),
+            atom_numbers=np.arange(1, n_atoms + 1, dtype=np.int32),
+            positions=positions,
+            velocities=velocities
+        )
+    
+    def _parse_gro_file(self, gro_file: str) -> Dict:
+        """解析.gro文件（内存映射 + 列式批量解码）"""
+        gro_data = read_gro_table(gro_file, dtype=self.coordinate_dtype)
+        table = gro_data['table']
+        
+        self.logger.debug(f"GRO文件包含 {len(table)} 个原子")
         
         return {
-            'coordinates': coordinates,
-            'box_vectors': box_vectors,
-            'title': title
+            # Atom对象仅在访问时按需创建
+            'coordinates': table.as_atoms(),
+            'coordinate_table': table,
+            'box_vectors': gro_data['box_vectors'],
+            'title': gro_data['title']
         }
     
     def _parse_pdb_file(self, pdb_file: str) -> Dict:
-        """解析.pdb文件"""
+        """解析.pdb文件（多MODEL文件只读取第一个MODEL）"""
         coordinates = []
         box_vectors = None
         
@@ -425,344 +643,201 @@ class GromacsParser:
                     b = float(line[15:24])
                     c = float(line[24:33])
                     box_vectors = [a, b, c]
+                
+                elif line.startswith('ENDMDL'):
+                    # 多MODEL文件的拓扑只对应第一个MODEL，其余帧见index_coordinate_frames
+                    break
         
         return {
             'coordinates': coordinates,
             'box_vectors': box_vectors
         }
     
-    def _remove_comments(self, content: str) -> str:
-        """移除GROMACS文件中的注释"""
-        lines = content.split('\n')
-        clean_lines = []
+    def _parse_atom_row(self, parts: List[str]) -> Optional[Dict]:
+        """解析atoms section的一行"""
+        if len(parts) < 6:
+            return None
         
-        for line in lines:
-            # 移除;后面的注释
-            comment_pos = line.find(';')
-            if comment_pos != -1:
-                line = line[:comment_pos]
-            
-            # 保留非空行
-            if line.strip():
-                clean_lines.append(line)
+        atom_name = parts[4]
+        # 如果原子名只是通用名称（如"C", "H"），添加索引号
+        if atom_name in ['C', 'H', 'N', 'O', 'S', 'P'] or atom_name == parts[1]:
+            atom_name = f"{atom_name}{parts[0]}"
         
-        return '\n'.join(clean_lines)
+        return {
+            'index': int(parts[0]),
+            'type': parts[1],
+            'residue_number': int(parts[2]),
+            'residue_name': parts[3],
+            'name': parts[4],  # 原始名称
+            'atom_name': atom_name,  # 生成的唯一名称
+            'charge_group': int(parts[5]),
+            'charge': float(parts[6]) if len(parts) > 6 else 0.0,
+            'mass': float(parts[7]) if len(parts) > 7 else 0.0
+        }
     
-    def _split_into_sections(self, content: str) -> Dict[str, str]:
-        """将内容分割成各个section"""
-        sections = {}
-        current_section = None
-        current_content = []
-        
-        for line in content.split('\n'):
-            line = line.strip()
-            if line.startswith('[') and line.endswith(']'):
-                # 保存前一个section
-                if current_section:
-                    sections[current_section] = '\n'.join(current_content)
-                
-                # 开始新的section
-                current_section = line[1:-1].strip()
-                current_content = []
-            elif current_section:
-                current_content.append(line)
-        
-        # 保存最后一个section
-        if current_section:
-            sections[current_section] = '\n'.join(current_content)
-        
-        return sections
-    
-    def _parse_molecules_section(self, content: str) -> List[Tuple[str, int]]:
-        """解析molecules section"""
-        molecules = []
-        for line in content.split('\n'):
-            line = line.strip()
-            if line:
-                parts = line.split()
-                if len(parts) >= 2:
-                    mol_name = parts[0]
-                    mol_count = int(parts[1])
-                    molecules.append((mol_name, mol_count))
-        return molecules
-    
-    def _parse_moleculetype_section(self, content: str) -> Dict:
-        """解析moleculetype section"""
-        lines = content.strip().split('\n')
-        if lines:
-            parts = lines[0].split()
-            if len(parts) >= 2:
-                return {
-                    'name': parts[0],
-                    'nrexcl': int(parts[1])
-                }
-        return {}
-    
-    def _parse_atoms_section(self, content: str) -> List[Dict]:
-        """解析atoms section"""
-        atoms = []
-        for line in content.split('\n'):
-            line = line.strip()
-            if line:
-                parts = line.split()
-                if len(parts) >= 6:
-                    atom_name = parts[4]
-                    # 如果原子名只是通用名称（如"C", "H"），添加索引号
-                    if atom_name in ['C', 'H', 'N', 'O', 'S', 'P'] or atom_name == parts[1]:
-                        atom_name = f"{atom_name}{parts[0]}"
-                    
-                    atom = {
-                        'index': int(parts[0]),
-                        'type': parts[1],
-                        'residue_number': int(parts[2]),
-                        'residue_name': parts[3],
-                        'name': parts[4],  # 原始名称
-                        'atom_name': atom_name,  # 生成的唯一名称
-                        'charge_group': int(parts[5]),
-                        'charge': float(parts[6]) if len(parts) > 6 else 0.0,
-                        'mass': float(parts[7]) if len(parts) > 7 else 0.0
-                    }
-                    atoms.append(atom)
-        return atoms
-    
-    def _parse_bonds_section(self, content: str) -> List[Dict]:
-        """解析bonds section"""
-        bonds = []
-        for line in content.split('\n'):
-            line = line.strip()
-            if line:
-                parts = line.split()
-                if len(parts) >= 3:
-                    bond = {
-                        'atom1': int(parts[0]),
-                        'atom2': int(parts[1]),
-                        'function_type': int(parts[2]),
-                        'parameters': [float(x) for x in parts[3:]]
-                    }
-                    bonds.append(bond)
-        return bonds
-    
-    def _parse_angles_section(self, content: str) -> List[Dict]:
-        """解析angles section"""
-        angles = []
-        for line in content.split('\n'):
-            line = line.strip()
-            if line:
-                parts = line.split()
-                if len(parts) >= 4:
-                    angle = {
-                        'atom1': int(parts[0]),
-                        'atom2': int(parts[1]),
-                        'atom3': int(parts[2]),
-                        'function_type': int(parts[3]),
-                        'parameters': [float(x) for x in parts[4:]]
-                    }
-                    angles.append(angle)
-        return angles
-    
-    def _parse_dihedrals_section(self, content: str) -> List[Dict]:
-        """解析dihedrals section"""
-        dihedrals = []
-        for line in content.split('\n'):
-            line = line.strip()
-            if line:
-                parts = line.split()
-                if len(parts) >= 5:
-                    dihedral = {
-                        'atom1': int(parts[0]),
-                        'atom2': int(parts[1]),
-                        'atom3': int(parts[2]),
-                        'atom4': int(parts[3]),
-                        'function_type': int(parts[4]),
-                        'parameters': [float(x) for x in parts[5:]]
-                    }
-                    dihedrals.append(dihedral)
-        return dihedrals
-    
-    def _parse_atomtypes_section(self, content: str) -> Dict:
-        """解析atomtypes section"""
-        atom_types = {}
-        for line in content.split('\n'):
-            line = line.strip()
-            if line:
-                parts = line.split()
-                if len(parts) >= 6:
-                    atom_type = {
-                        'name': parts[0],
-                        'atomic_number': int(parts[1]) if parts[1].isdigit() else 0,
-                        'mass': float(parts[2]),
-                        'charge': float(parts[3]),
-                        'particle_type': parts[4],
-                        'sigma': float(parts[5]),
-                        'epsilon': float(parts[6]) if len(parts) > 6 else 0.0
-                    }
-                    atom_types[parts[0]] = atom_type
-        return atom_types
-    
-    def _parse_bondtypes_section(self, content: str) -> Dict:
-        """解析bondtypes section"""
-        bond_types = {}
-        for line in content.split('\n'):
-            line = line.strip()
-            if line:
-                parts = line.split()
-                if len(parts) >= 4:
-                    key = f"{parts[0]}-{parts[1]}"
-                    bond_type = {
-                        'atom1': parts[0],
-                        'atom2': parts[1],
-                        'function_type': int(parts[2]),
-                        'parameters': [float(x) for x in parts[3:]]
-                    }
-                    bond_types[key] = bond_type
-        return bond_types
-    
-    def _parse_angletypes_section(self, content: str) -> Dict:
-        """解析angletypes section"""
-        angle_types = {}
-        for line in content.split('\n'):
-            line = line.strip()
-            if line:
-                parts = line.split()
-                if len(parts) >= 5:
-                    key = f"{parts[0]}-{parts[1]}-{parts[2]}"
-                    angle_type = {
-                        'atom1': parts[0],
-                        'atom2': parts[1],
-                        'atom3': parts[2],
-                        'function_type': int(parts[3]),
-                        'parameters': [float(x) for x in parts[4:]]
-                    }
-                    angle_types[key] = angle_type
-        return angle_types
-    
-    def _parse_dihedraltypes_section(self, content: str) -> Dict:
-        """解析dihedraltypes section"""
-        dihedral_types = {}
-        for line in content.split('\n'):
-            line = line.strip()
-            if line:
-                parts = line.split()
-                if len(parts) >= 6:
-                    key = f"{parts[0]}-{parts[1]}-{parts[2]}-{parts[3]}"
-                    dihedral_type = {
-                        'atom1': parts[0],
-                        'atom2': parts[1],
-                        'atom3': parts[2],
-                        'atom4': parts[3],
-                        'function_type': int(parts[4]),
-                        'parameters': [float(x) for x in parts[5:]]
-                    }
-                    dihedral_types[key] = dihedral_type
-        return dihedral_types
+    def _parse_atomtype_row(self, parts: List[str]) -> Optional[Tuple[str, Dict]]:
+        """解析atomtypes section的一行"""
+        if len(parts) < 6:
+            return None
+        return parts[0], {
+            'name': parts[0],
+            'atomic_number': int(parts[1]) if parts[1].isdigit() else 0,
+            'mass': float(parts[2]),
+            'charge': float(parts[3]),
+            'particle_type': parts[4],
+            'sigma': float(parts[5]),
+            'epsilon': float(parts[6]) if len(parts) > 6 else 0.0
+        }
     
-    def _extract_bond_types_from_bonds(self, molecule_data: Dict, global_force_field: Dict):
-        """从具体的bonds中提取bond types"""
-        if 'bonds' not in molecule_data or 'atoms' not in molecule_data:
-            return
-        
-        # 创建原子索引到类型的映射
-        atom_type_map = {}
-        for atom in molecule_data['atoms']:
-            atom_type_map[atom['index']] = atom['type']
+    def _parse_bondtype_row(self, parts: List[str]) -> Optional[Tuple[str, Dict]]:
+        """解析bondtypes section的一行"""
+        return self._parse_bonded_type_row(parts, 2)
+    
+    def _parse_angletype_row(self, parts: List[str]) -> Optional[Tuple[str, Dict]]:
+        """解析angletypes section的一行"""
+        return self._parse_bonded_type_row(parts, 3)
+    
+    def _parse_dihedraltype_row(self, parts: List[str]) -> Optional[Tuple[str, Dict]]:
+        """解析dihedraltypes section的一行"""
+        return self._parse_bonded_type_row(parts, 4)
+    
+    def _parse_bonded_type_row(self, parts: List[str], n_atoms: int) -> Optional[Tuple[str, Dict]]:
+        """解析成键类型表的一行，类型名取规范顺序（与从相互作用中提取的类型同名）"""
+        if len(parts) < n_atoms + 2:
+            return None
+        names = canonical_type_key(parts[:n_atoms])
+        entry: Dict[str, Any] = dict(zip(ATOM_KEYS, names))
+        entry['function_type'] = int(parts[n_atoms])
+        entry['parameters'] = [float(x) for x in parts[n_atoms + 1:]]
+        return '-'.join(names), entry
+    
+    def _add_bonded_type(self, types: Dict[str, Dict], name: str, entry: Dict,
+                         previous: Optional[Dict] = None) -> Dict:
+        """登记一条成键类型定义，返回记录这一行的条目
+        
+        previous为同一section中上一行登记的条目。与之原子类型相同的连续9型二面角
+        是同一条目的多个傅里叶项，依次记入该条目的terms（含第一项）。
+        同一原子类型组合的其他定义（如函数类型不同的二面角）保留先出现的一条，
+        其余按出现顺序记入该条的variants，补全参数时按(函数类型, 类型组合)查找。
+        """
+        if (previous is not None and entry['function_type'] == 9
+                and previous.get('function_type') == 9 and previous.get('parameters')
+                and all(previous.get(key) == entry[key] for key in ATOM_KEYS if key in entry)):
+            previous.setdefault('terms', [previous['parameters']]).append(entry['parameters'])
+            return previous
+        existing = types.get(name)
+        if existing is None or not existing.get('parameters'):
+            types[name] = entry
+        else:
+            existing.setdefault('variants', []).append(entry)
+        return entry
+    
+    def _resolve_bonded_parameters(self, system_data: Dict):
+        """从全局力场的[ *types ]表补全没有参数的成键相互作用，并更新提取的类型"""
+        global_ff = system_data.get('global_force_field', {})
+        resolver = BondedParameterResolver(global_ff)
+        totals = {section: [0, 0] for section in INTERACTION_ATOMS}
         
-        # 处理每个键
-        for bond in molecule_data['bonds']:
-            atom1_idx = bond['atom1']
-            atom2_idx = bond['atom2']
-            
-            if atom1_idx in atom_type_map and atom2_idx in atom_type_map:
-                atom1_type = atom_type_map[atom1_idx]
-                atom2_type = atom_type_map[atom2_idx]
-                
-                # 创建键类型名称（按字母顺序排序以保证一致性）
-                if atom1_type <= atom2_type:
-                    bond_type_name = f"{atom1_type}-{atom2_type}"
-                else:
-                    bond_type_name = f"{atom2_type}-{atom1_type}"
-                
-                # 如果该键类型还没有记录，则添加
-                if bond_type_name not in global_force_field['bond_types']:
-                    global_force_field['bond_types'][bond_type_name] = {
-                        'atom1': atom1_type,
-                        'atom2': atom2_type,
-                        'function_type': bond.get('function_type', 1),
-                        'parameters': bond.get('parameters', [])
-                    }
-                    self.logger.debug(f"提取键类型: {bond_type_name}, 参数: {bond.get('parameters', [])}")
+        for mol_name, mol_data in system_data['molecules'].items():
+            counts = resolver.resolve_molecule(mol_data)
+            for section, (n_resolved, n_unresolved) in counts.items():
+                totals[section][0] += n_resolved
+                totals[section][1] += n_unresolved
+            if any(n_resolved for n_resolved, _ in counts.values()):
+                self._extract_bond_types_from_bonds(mol_data, global_ff, fill_empty=True)
+                self._extract_angle_types_from_angles(mol_data, global_ff, fill_empty=True)
+                self._extract_dihedral_types_from_dihedrals(mol_data, global_ff, fill_empty=True)
+        
+        for section, (n_resolved, n_unresolved) in totals.items():
+            if n_resolved or n_unresolved:
+                self.logger.info(f"[ {section} ] 从类型表补全参数: {n_resolved} 项，"
+                                 f"未找到: {n_unresolved} 项")
+            if n_unresolved:
+                self.logger.warning(f"[ {section} ] 中有 {n_unresolved} 项没有参数且在类型表中找不到")
+        
+        for section, truncated in resolver.truncated.items():
+            self.logger.warning(
+                f"[ {section} ] 中 {sum(truncated.values())} 项使用了多项9型二面角类型，"
+                f"每个类型只能写出一组参数，只保留了第一项: {', '.join(sorted(truncated))}")
+    
+    def _extract_bond_types_from_bonds(self, molecule_data: Dict, global_force_field: Dict,
+                                       fill_empty: bool = False):
+        """从具体的bonds中提取bond types（类型名取规范顺序以保证一致性）"""
+        self._extract_interaction_types(molecule_data, global_force_field, 'bonds',
+                                        'bond_types', '键类型', fill_empty=fill_empty)
     
-    def _extract_angle_types_from_angles(self, molecule_data: Dict, global_force_field: Dict):
-        """从具体的angles中提取angle types"""
-        if 'angles' not in molecule_data or 'atoms' not in molecule_data:
+    def _extract_angle_types_from_angles(self, molecule_data: Dict, global_force_field: Dict,
+                                         fill_empty: bool = False):
+        """从具体的angles中提取angle types（中心原子在中间，两端取规范顺序）"""
+        self._extract_interaction_types(molecule_data, global_force_field, 'angles',
+                                        'angle_types', '角度类型', fill_empty=fill_empty)
+    
+    def _extract_dihedral_types_from_dihedrals(self, molecule_data: Dict, global_force_field: Dict,
+                                               fill_empty: bool = False):
+        """从具体的dihedrals中提取dihedral types（正反方向取规范顺序）"""
+        self._extract_interaction_types(molecule_data, global_force_field, 'dihedrals',
+                                        'dihedral_types', '二面角类型', fill_empty=fill_empty)
+    
+    def _extract_interaction_types(self, molecule_data: Dict, global_force_field: Dict,
+                                   section: str, ff_type: str, label: str,
+                                   fill_empty: bool = False):
+        """批量提取一类成键相互作用的类型
+        
+        原子类型名先映射为整数编码（编码顺序与名称的字典序一致），
+        再以花式索引得到每个相互作用的类型编码组合，用np.unique找出
+        各组合首次出现的相互作用作为代表。组合先经canonical_codes化为规范顺序，
+        正反方向的相互作用归为同一类型，类型的原子顺序即规范顺序，
+        参数取其首次出现的相互作用。fill_empty为True时，
+        已有但没有参数的类型（成键参数补全前提取的）在代表有参数时原地补上参数。
+        """
+        if section not in molecule_data or 'atoms' not in molecule_data:
             return
         
-        # 创建原子索引到类型的映射
-        atom_type_map = {}
-        for atom in molecule_data['atoms']:
-            atom_type_map[atom['index']] = atom['type']
-        
-        # 处理每个角度
-        for angle in molecule_data['angles']:
-            atom1_idx = angle['atom1']
-            atom2_idx = angle['atom2']  # 中心原子
-            atom3_idx = angle['atom3']
-            
-            if all(idx in atom_type_map for idx in [atom1_idx, atom2_idx, atom3_idx]):
-                atom1_type = atom_type_map[atom1_idx]
-                atom2_type = atom_type_map[atom2_idx]  # 中心原子
-                atom3_type = atom_type_map[atom3_idx]
-                
-                # 创建角度类型名称（中心原子在中间）
-                angle_type_name = f"{atom1_type}-{atom2_type}-{atom3_type}"
-                
-                # 如果该角度类型还没有记录，则添加
-                if angle_type_name not in global_force_field['angle_types']:
-                    global_force_field['angle_types'][angle_type_name] = {
-                        'atom1': atom1_type,
-                        'atom2': atom2_type,
-                        'atom3': atom3_type,
-                        'function_type': angle.get('function_type', 1),
-                        'parameters': angle.get('parameters', [])
-                    }
-                    self.logger.debug(f"提取角度类型: {angle_type_name}, 参数: {angle.get('parameters', [])}")
-    
-    def _extract_dihedral_types_from_dihedrals(self, molecule_data: Dict, global_force_field: Dict):
-        """从具体的dihedrals中提取dihedral types"""
-        if 'dihedrals' not in molecule_data or 'atoms' not in molecule_data:
+        n_atoms = INTERACTION_ATOMS[section]
+        table = as_interaction_table(molecule_data[section], n_atoms)
+        if len(table) == 0:
             return
         
-        # 创建原子索引到类型的映射
-        atom_type_map = {}
-        for atom in molecule_data['atoms']:
-            atom_type_map[atom['index']] = atom['type']
-        
-        # 处理每个二面角
-        for dihedral in molecule_data['dihedrals']:
-            atom1_idx = dihedral['atom1']
-            atom2_idx = dihedral['atom2']  # 中心键的原子
-            atom3_idx = dihedral['atom3']  # 中心键的原子
-            atom4_idx = dihedral['atom4']
-            
-            if all(idx in atom_type_map for idx in [atom1_idx, atom2_idx, atom3_idx, atom4_idx]):
-                atom1_type = atom_type_map[atom1_idx]
-                atom2_type = atom_type_map[atom2_idx]
-                atom3_type = atom_type_map[atom3_idx]
-                atom4_type = atom_type_map[atom4_idx]
-                
-                # 创建二面角类型名称
-                dihedral_type_name = f"{atom1_type}-{atom2_type}-{atom3_type}-{atom4_type}"
-                
-                # 如果该二面角类型还没有记录，则添加
-                if dihedral_type_name not in global_force_field['dihedral_types']:
-                    global_force_field['dihedral_types'][dihedral_type_name] = {
-                        'atom1': atom1_type,
-                        'atom2': atom2_type,
-                        'atom3': atom3_type,
-                        'atom4': atom4_type,
-                        'function_type': dihedral.get('function_type', 1),
-                        'parameters': dihedral.get('parameters', [])
-                    }
-                    self.logger.debug(f"提取二面角类型: {dihedral_type_name}, 参数: {dihedral.get('parameters', [])}")
+        # 原子索引 -> 类型编码（未定义的原子编码为-1）
+        type_names, codes = atom_type_codes(molecule_data['atoms'], table.atoms)
+        rows = np.flatnonzero((codes >= 0).all(axis=1))
+        if len(rows) == 0:
+            return
+        codes = codes[rows]
+        
+        # 编码与类型名字典序一致，正反方向的组合归为同一类型
+        canonical = canonical_codes(codes)
+        
+        # 类型编码组合压缩为单个整数；类型过多时按行比较
+        n_types = len(type_names)
+        if n_types ** n_atoms < 2 ** 63:
+            keys = np.zeros(len(canonical), dtype=np.int64)
+            for column in range(n_atoms):
+                keys = keys * n_types + canonical[:, column]
+            _, first = np.unique(keys, return_index=True)
+        else:
+            _, first = np.unique(canonical, axis=0, return_index=True)
+        first.sort()
+        
+        types = global_force_field[ff_type]
+        for i in first.tolist():
+            atom_types = [type_names[c] for c in canonical[i].tolist()]
+            name = '-'.join(atom_types)
+            existing = types.get(name)
+            if existing is not None and (not fill_empty or existing.get('parameters')):
+                continue
+            row = table.row(int(rows[i]))
+            if existing is not None and not row['parameters']:
+                continue
+            entry = dict(zip(ATOM_KEYS, atom_types))
+            entry['function_type'] = row['function_type']
+            entry['parameters'] = row['parameters']
+            if existing is not None:
+                # 分子的global_force_field与系统的类型表共享同一字典
+                existing.update(entry)
+            else:
+                types[name] = entry
+            self.logger.debug(f"提取{label}: {name}, 参数: {row['parameters']}")
 
     def _merge_itp_data(self, system_data: Dict, itp_data: Dict):
         """将ITP数据合并到系统数据中，支持多个分子类型"""
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+成键相互作用的列式存储
+键/角/二面角以int32原子索引数组、int8函数类型数组和去重参数表的形式保存
+"""
+
+from array import array
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+ATOM_KEYS = ('atom1', 'atom2', 'atom3', 'atom4')
+
+# section名 -> 每个相互作用的原子数
+INTERACTION_ATOMS = {'bonds': 2, 'angles': 3, 'dihedrals': 4}
+
+
+class InteractionTable:
+    """一类成键相互作用的列式数据
+
+    atoms为(n, k)的int32数组，function_types为int8数组，
+    param_index指向去重后的参数表parameters（(m, width)的float64数组），
+    param_counts记录参数表每行的有效参数个数。
+    """
+
+    def __init__(self, atoms: np.ndarray, function_types: np.ndarray,
+                 param_index: np.ndarray, parameters: np.ndarray,
+                 param_counts: np.ndarray):
+        self.atoms = atoms
+        self.function_types = function_types
+        self.param_index = param_index
+        self.parameters = parameters
+        self.param_counts = param_counts
+
+    def __len__(self) -> int:
+        return len(self.function_types)
+
+    @property
+    def n_atoms(self) -> int:
+        """每个相互作用包含的原子数"""
+        return self.atoms.shape[1]
+
+    def parameter_lists(self) -> List[List[float]]:
+        """参数表中每行的有效参数"""
+        return [row[:n] for row, n in zip(self.parameters.tolist(), self.param_counts.tolist())]
+
+    def row(self, i: int) -> Dict:
+        """第i个相互作用的字典形式（与原解析结果格式相同）"""
+        row = dict(zip(ATOM_KEYS, self.atoms[i].tolist()))
+        row['function_type'] = int(self.function_types[i])
+        p = int(self.param_index[i])
+        row['parameters'] = self.parameters[p, :self.param_counts[p]].tolist()
+        return row
+
+    def iter_rows(self) -> Iterator[Dict]:
+        """按顺序产生字典形式的相互作用"""
+        keys = ATOM_KEYS[:self.n_atoms]
+        parameter_lists = self.parameter_lists()
+        for atom_row, function_type, p in zip(self.atoms.tolist(), self.function_types.tolist(),
+                                              self.param_index.tolist()):
+            row = dict(zip(keys, atom_row))
+            row['function_type'] = function_type
+            row['parameters'] = list(parameter_lists[p])
+            yield row
+
+    def expanded_parameters(self) -> np.ndarray:
+        """每个相互作用各自的参数（(n, width)数组，未使用的位置为NaN）"""
+        width = self.parameters.shape[1]
+        padded = np.where(np.arange(width) < self.param_counts[:, None], self.parameters, np.nan)
+        return padded[self.param_index]
+
+    def same_values(self, other: 'InteractionTable') -> bool:
+        """逐个相互作用比较原子、函数类型和参数值（与参数表的去重方式无关）"""
+        if len(self) != len(other) or self.n_atoms != other.n_atoms:
+            return False
+        if not (np.array_equal(self.atoms, other.atoms) and
+                np.array_equal(self.function_types, other.function_types)):
+            return False
+        if not np.array_equal(self.param_counts[self.param_index],
+                              other.param_counts[other.param_index]):
+            return False
+        width = min(self.parameters.shape[1], other.parameters.shape[1])
+        ours = self.expanded_parameters()
+        theirs = other.expanded_parameters()
+        extra = np.concatenate([ours[:, width:], theirs[:, width:]], axis=1)
+        return (np.array_equal(ours[:, :width], theirs[:, :width], equal_nan=True)
+                and bool(np.isnan(extra).all()))
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Dict], n_atoms: int) -> 'InteractionTable':
+        """由字典形式的相互作用列表构建"""
+        builder = InteractionTableBuilder(n_atoms)
+        keys = ATOM_KEYS[:n_atoms]
+        for row in rows:
+            builder.add(
+                [row[key] for key in keys],
+                row.get('function_type', 1),
+                row.get('parameters', [])
+            )
+        return builder.build()
+
+
+class InteractionTableBuilder:
+    """逐行累积相互作用，参数按内容去重"""
+
+    def __init__(self, n_atoms: int):
+        self.n_atoms = n_atoms
+        self._atoms = array('i')
+        self._function_types = array('b')
+        self._param_index = array('i')
+        self._parameters: List[List[float]] = []
+        # 参数的原始文本 -> 参数表行号
+        self._token_index: Dict[tuple, int] = {}
+        # 参数值 -> 参数表行号
+        self._value_index: Dict[tuple, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._function_types)
+
+    def add_tokens(self, tokens: List[str]) -> bool:
+        """解析一行数据并加入；列数不足时返回False"""
+        n_atoms = self.n_atoms
+        if len(tokens) <= n_atoms:
+            return False
+
+        key = tuple(tokens[n_atoms + 1:])
+        p = self._token_index.get(key)
+        if p is None:
+            p = self._parameter_slot([float(x) for x in key])
+            self._token_index[key] = p
+
+        self._atoms.extend(map(int, tokens[:n_atoms]))
+        self._append_function_type(int(tokens[n_atoms]))
+        self._param_index.append(p)
+        return True
+
+    def add(self, atoms: Sequence[int], function_type: int, parameters: Sequence[float]):
+        """加入一个已解析的相互作用"""
+        self._atoms.extend(atoms)
+        self._append_function_type(function_type)
+        self._param_index.append(self._parameter_slot([float(x) for x in parameters]))
+
+    def extend_arrays(self, atoms: np.ndarray, function_types: np.ndarray,
+                      param_counts: np.ndarray, parameters: np.ndarray):
+        """批量加入已解析的数组（parameters按行补齐，param_counts为每行参数个数）"""
+        if len(function_types) == 0:
+            return
+        width = parameters.shape[1]
+        padded = np.where(np.arange(width) < param_counts[:, None], parameters, 0.0)
+        # 按位比较参数，只对不同的参数组合建立参数表行
+        keys = np.concatenate([param_counts.astype(np.uint64)[:, None],
+                               np.ascontiguousarray(padded).view(np.uint64)], axis=1)
+        _, first, inverse = np.unique(keys, axis=0, return_index=True,
+                                                return_inverse=True)
+        slots = np.array([
+            self._parameter_slot(padded[i, :param_counts[i]].tolist())
+            for i in first.tolist()
+        ], dtype=np.int32)
+
+        self._atoms.frombytes(np.ascontiguousarray(atoms, dtype=np.int32).tobytes())
+        if function_types.min() < -128 or function_types.max() > 127:
+            raise ValueError("函数类型超出范围")
+        self._function_types.frombytes(function_types.astype(np.int8).tobytes())
+        self._param_index.frombytes(slots[inverse.reshape(-1)].tobytes())
+
+    def build(self) -> InteractionTable:
+        """生成列式数据（构建器可继续追加，之后需重新build）"""
+        atoms = np.frombuffer(self._atoms, dtype=np.int32).reshape(-1, self.n_atoms).copy()
+        function_types = np.frombuffer(self._function_types, dtype=np.int8).copy()
+        param_index = np.frombuffer(self._param_index, dtype=np.int32).copy()
+
+        width = max((len(p) for p in self._parameters), default=0)
+        parameters = np.zeros((len(self._parameters), width), dtype=np.float64)
+        param_counts = np.zeros(len(self._parameters), dtype=np.int8)
+        for i, p in enumerate(self._parameters):
+            parameters[i, :len(p)] = p
+            param_counts[i] = len(p)
+
+        return InteractionTable(atoms, function_types, param_index, parameters, param_counts)
+
+    def _append_function_type(self, function_type: int):
+        try:
+            self._function_types.append(function_type)
+        except OverflowError:
+            raise ValueError(f"函数类型超出范围: {function_type}")
+
+    def _parameter_slot(self, values: List[float]) -> int:
+        """返回参数组在参数表中的行号（按精确值去重，区分-0.0与0.0）"""
+        key = tuple(value.hex() for value in values)
+        p = self._value_index.get(key)
+        if p is None:
+            p = len(self._parameters)
+            self._parameters.append(values)
+            self._value_index[key] = p
+        return p
+
+
+class InteractionView(Sequence):
+    """InteractionTable的只读视图，按需产生字典形式的相互作用
+
+    供仍按列表/字典访问成键数据的代码使用，列式数据可通过.table直接访问。
+    """
+
+    def __init__(self, table: InteractionTable):
+        self.table = table
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.table.row(i) for i in range(*index.indices(len(self.table)))]
+        if index < 0:
+            index += len(self.table)
+        if not 0 <= index < len(self.table):
+            raise IndexError("相互作用索引超出范围")
+        return self.table.row(index)
+
+    def __iter__(self) -> Iterator[Dict]:
+        return self.table.iter_rows()
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, InteractionView):
+            return self.table.same_values(other.table)
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"InteractionView({len(self)} x {self.table.n_atoms})"
+
+
+def empty_interactions(n_atoms: int) -> InteractionView:
+    """空的相互作用视图"""
+    return InteractionView(InteractionTableBuilder(n_atoms).build())
+
+
+def as_interaction_table(interactions, n_atoms: int) -> InteractionTable:
+    """取得相互作用的列式数据；字典列表会被转换"""
+    table = getattr(interactions, 'table', None)
+    if table is not None:
+        return table
+    return InteractionTable.from_rows(interactions or [], n_atoms)
+
+
+def canonical_codes(codes: np.ndarray) -> np.ndarray:
+    """类型编码组合的规范形式
+
+    键、角度和二面角正反两个方向是同一种相互作用，每行取正序与逆序中
+    字典序较小的一个。编码顺序与类型名的字典序一致时，结果与canonical_type_key相同。
+    """
+    codes = np.asarray(codes)
+    if codes.ndim != 2 or len(codes) == 0:
+        return codes
+    flipped = codes[:, ::-1]
+    differs = codes != flipped
+    first = differs.argmax(axis=1)
+    rows = np.arange(len(codes))
+    flip = differs.any(axis=1) & (flipped[rows, first] < codes[rows, first])
+    return np.where(flip[:, None], flipped, codes)
+
+
+def canonical_type_key(names: Sequence[str]) -> Tuple[str, ...]:
+    """类型名组合的规范顺序（正序与逆序中字典序较小的一个）"""
+    names = tuple(names)
+    return min(names, names[::-1])
+
+
+def canonical_type_name(names: Sequence[str]) -> str:
+    """成键类型的规范名称，如'c3-hc'，各解析器与写出器共用"""
+    return '-'.join(canonical_type_key(names))
+
+
+def canonical_type_table(types: Dict[str, Dict], n_atoms: int) -> Dict[str, Dict]:
+    """按规范名称重建成键类型表
+
+    正反方向重复的类型合并为一个，保留先出现的定义（先出现的没有参数时取
+    后面有参数的）；各条目的原子顺序改为规范顺序。缺少原子字段的条目原样保留。
+    """
+    keys = ATOM_KEYS[:n_atoms]
+    canonical: Dict[str, Dict] = {}
+    for key, entry in types.items():
+        if any(k not in entry for k in keys):
+            canonical.setdefault(key, entry)
+            continue
+        names = canonical_type_key(entry[k] for k in keys)
+        name = '-'.join(names)
+        existing = canonical.get(name)
+        if existing is not None and (existing.get('parameters') or not entry.get('parameters')):
+            continue
+        canonical[name] = dict(entry, **dict(zip(keys, names)))
+    return canonical
@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*-
+"""
+moltemplate力场文件(.lt)的索引视图
+一次扫描解析质量、电荷、pair/成键coeff、By Type规则和In Init设置，
+规则按精确类型组合建立哈希索引，通配符规则单独保存。
+索引以二进制形式缓存在力场文件旁，按修改时间/内容哈希失效。
+"""
+
+import os
+import pickle
+import re
+import tempfile
+from fnmatch import translate
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from parsers.topology_preprocessor import file_digest
+
+# 力场中成键项的种类 -> (coeff命令, By Type section前缀, 原子数)
+BONDED_KINDS = {
+    'bond': ('bond_coeff', 'Data Bonds By Type', 2),
+    'angle': ('angle_coeff', 'Data Angles By Type', 3),
+    'dihedral': ('dihedral_coeff', 'Data Dihedrals By Type', 4),
+    'improper': ('improper_coeff', 'Data Impropers By Type', 4),
+}
+
+# improper的对称模块 -> 中心原子在规则中的位置
+IMPROPER_CENTERS = {
+    'gaff_imp.py': 2,
+    'cenIsortJKL.py': 0,
+    'cenIsortJKL': 0,
+    'cenJsortIKL.py': 1,
+    'cenJsortIKL': 1,
+}
+
+# 包根目录，内置力场文件的相对路径以此为准
+PACKAGE_DIR = Path(__file__).parent.parent
+
+# 索引结构变化时递增，使旧的索引缓存自动失效
+LT_INDEX_FORMAT = 1
+
+INDEX_SUFFIX = '.idx'
+
+_BLOCK_RE = re.compile(r'^write(?:_once)?\(\s*["\']([^"\']*)["\']\s*\)\s*\{')
+_REPLACE_RE = re.compile(r'^replace\s*\{\s*@atom:(\S+)\s+@atom:(\S+)\s*\}')
+_IMPORT_RE = re.compile(r'^import\s+["\']?([^"\'\s]+)')
+
+
+def _strip_comment(line: str) -> str:
+    return line.split('#', 1)[0].strip()
+
+
+def _is_pattern(name: str) -> bool:
+    return any(c in name for c in '*?[') or (len(name) > 1 and name.startswith('/') and name.endswith('/'))
+
+
+def _compile(name: str):
+    """类型名模式（glob或/正则/）编译为正则"""
+    if len(name) > 1 and name.startswith('/') and name.endswith('/'):
+        return re.compile(name[1:-1] + r'\Z')
+    return re.compile(translate(name))
+
+
+class TypeRules:
+    """一类成键项的By Type规则
+
+    规则按文件中的顺序编号，多条规则匹配时后出现的优先（与moltemplate相同）。
+    不含通配符的规则存入以类型组合为键的字典，通配符规则逐条匹配
+    （正则在首次匹配时才编译，不写入索引缓存）；匹配结果按类型组合缓存。
+    """
+
+    def __init__(self, n_atoms: int, symmetric: bool = True):
+        self.n_atoms = n_atoms
+        self.symmetric = symmetric
+        self.names: List[str] = []
+        self.patterns: List[Tuple[str, ...]] = []
+        # 规则在力场文件中的位置(文件名, 行号)
+        self.locations: List[Optional[Tuple[str, int]]] = []
+        self._exact: Dict[Tuple[str, ...], int] = {}
+        # 通配符规则的编号及其编译后的正则
+        self._wildcard: List[int] = []
+        self._regexes: Optional[List[List]] = None
+        self._memo: Dict[Tuple[str, ...], Optional[int]] = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_regexes'] = None
+        state['_memo'] = {}
+        return state
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, name: str, patterns: Sequence[str], location: Optional[Tuple[str, int]] = None):
+        position = len(self.names)
+        self.names.append(name)
+        self.patterns.append(tuple(patterns))
+        self.locations.append(location)
+        self._memo.clear()
+        if any(_is_pattern(p) for p in patterns):
+            self._wildcard.append(position)
+            self._regexes = None
+        else:
+            self._exact[tuple(patterns)] = position
+
+    def match_position(self, types: Tuple[str, ...]) -> Optional[int]:
+        """匹配规则的编号（按给定顺序；symmetric时也尝试反向）"""
+        if types in self._memo:
+            return self._memo[types]
+        candidates = [types]
+        if self.symmetric:
+            candidates.append(types[::-1])
+
+        best = None
+        for candidate in candidates:
+            position = self._exact.get(candidate)
+            if position is not None and (best is None or position > best):
+                best = position
+        if self._regexes is None:
+            self._regexes = [[_compile(p) for p in self.patterns[position]]
+                             for position in self._wildcard]
+        for position, regexes in zip(reversed(self._wildcard), reversed(self._regexes)):
+            if best is not None and position < best:
+                break
+            if any(all(r.match(t) for r, t in zip(regexes, candidate)) for candidate in candidates):
+                best = position
+                break
+        self._memo[types] = best
+        return best
+
+    def match(self, types: Tuple[str, ...]) -> Optional[str]:
+        """匹配规则的类型名"""
+        position = self.match_position(types)
+        return None if position is None else self.names[position]
+
+
+class LtForceField:
+    """一个.lt力场文件的索引表
+
+    所有原子类型名都经过replace展开为全名；coeffs中每个类型名对应
+    一条或多条coeff参数（不含类型名本身）。locations记录原子类型（质量）
+    和各成键coeff在文件中的位置，By Type规则的位置见TypeRules.locations。
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.name: Optional[str] = None
+        self.replacements: Dict[str, str] = {}
+        self.masses: Dict[str, float] = {}
+        self.charges: Dict[str, float] = {}
+        # (类型模式1, 类型模式2, 参数)，按文件中的顺序
+        self.pair_coeffs: List[Tuple[str, str, str]] = []
+        self._raw_pairs: List[Tuple[str, str, str]] = []
+        self.coeffs: Dict[str, Dict[str, List[str]]] = {kind: {} for kind in BONDED_KINDS}
+        self.rules: Dict[str, TypeRules] = {
+            kind: TypeRules(n_atoms, symmetric=(kind != 'improper'))
+            for kind, (_, _, n_atoms) in BONDED_KINDS.items()
+        }
+        self.improper_center = 0
+        self.init_lines: List[str] = []
+        self.missing_imports: List[str] = []
+        # 'atom'或成键种类 -> 名称 -> (文件名, 行号)；用行号而非字节偏移，便于在报告中定位
+        self.locations: Dict[str, Dict[str, Tuple[str, int]]] = {
+            kind: {} for kind in ('atom',) + tuple(BONDED_KINDS)
+        }
+        # 索引依赖的文件：(路径, mtime_ns, 大小, 内容哈希)，不存在的导入文件后三项为None
+        self.sources: List[Tuple[str, Optional[int], Optional[int], Optional[str]]] = []
+        self._parse(self.path)
+
+    def full_type(self, name: str) -> str:
+        """原子类型的全名（经过replace展开）"""
+        return self.replacements.get(name, name)
+
+    def where(self, kind: str, name: str) -> str:
+        """原子类型或coeff在力场文件中的位置，形如gaff2.lt:1234"""
+        location = self.locations[kind].get(name)
+        return f"{location[0]}:{location[1]}" if location else self.path.name
+
+    def matching_types(self, pattern: str, full_names: Dict[str, str]) -> List[str]:
+        """与类型名或类型模式（如pair_coeff中的模式）匹配的原子类型
+
+        full_names为原子类型名 -> 全名，返回全名与pattern匹配的原子类型名。
+        """
+        if pattern in full_names.values():
+            return [name for name, full in full_names.items() if full == pattern]
+        if not _is_pattern(pattern):
+            return []
+        regex = _compile(pattern)
+        return [name for name, full in full_names.items() if regex.match(full)]
+
+    def _matching_rules(self, matcher: '_TypeMatcher') -> Dict[str, Set[str]]:
+        """各类By Type规则中每个位置都能匹配到体系原子类型的规则名"""
+        return {
+            kind: {name for name, patterns in zip(rules.names, rules.patterns)
+                   if all(matcher(p) for p in patterns)}
+            for kind, rules in self.rules.items()
+        }
+
+    def write_subset(self, atom_types: Iterable[str], output_file: Path) -> Tuple[int, int]:
+        """写出只包含给定原子类型相关参数的精简力场文件
+
+        保留文件结构与In Init等设置；数据行中引用的原子类型模式都能匹配
+        给定类型时才保留，coeff行只保留对应规则被保留的类型。
+        返回(原文件行数, 精简后行数)。
+        """
+        atom_types = list(atom_types)
+        matcher = _TypeMatcher(self.full_type(t) for t in atom_types)
+        used_short = set(atom_types)
+        kept_rules = self._matching_rules(matcher)
+        coeff_kinds = {command: kind for kind, (command, _, _) in BONDED_KINDS.items()}
+
+        n_in = n_out = 0
+        block = rule_kind = None
+        with open(self.path, 'r', encoding='utf-8') as src, \
+                open(output_file, 'w', encoding='utf-8') as dst:
+            dst.write(f"# Subset of {self.path.name} for atom types: {' '.join(sorted(used_short))}\n\n")
+            for raw in src:
+                n_in += 1
+                line = raw.strip()
+                if not line or line.startswith('#'):
+                    continue
+
+                if block is None:
+                    match = _REPLACE_RE.match(line)
+                    if match and match.group(1) not in used_short:
+                        continue
+                    match = _IMPORT_RE.match(line)
+                    if match:
+                        imported = (self.path.parent / match.group(1)).resolve()
+                        raw = raw.replace(match.group(1), str(imported), 1)
+                    match = _BLOCK_RE.match(line)
+                    if match:
+                        block = match.group(1)
+                        rule_kind = _rule_kind(block)
+                elif line.startswith('}'):
+                    block = rule_kind = None
+                elif block != 'In Init':
+                    tokens = _strip_comment(line).split()
+                    if not all(matcher(self._atom(t)) for t in tokens if t.startswith('@atom:')):
+                        continue
+                    kind = coeff_kinds.get(tokens[0])
+                    if kind is not None and tokens[1].split(':', 1)[1] not in kept_rules[kind]:
+                        continue
+                    if rule_kind is not None and tokens[0].split(':', 1)[1] not in kept_rules[rule_kind]:
+                        continue
+
+                dst.write(raw)
+                n_out += 1
+        return n_in, n_out
+
+    def _parse(self, path: Path):
+        block = None
+        # 原始类型名先暂存，replace可能出现在使用之后
+        raw_masses, raw_charges, raw_rules = [], [], []
+        stat = os.stat(path)
+        self.sources.append((str(path), stat.st_mtime_ns, stat.st_size, file_digest(str(path))))
+
+        with open(path, 'r', encoding='utf-8') as f:
+            for lineno, raw in enumerate(f, 1):
+                line = raw.strip()
+                if not line or line.startswith('#'):
+                    continue
+
+                if block is None:
+                    match = _BLOCK_RE.match(line)
+                    if match:
+                        block = match.group(1)
+                        continue
+                    match = _REPLACE_RE.match(line)
+                    if match:
+                        self.replacements[match.group(1)] = match.group(2)
+                        continue
+                    match = _IMPORT_RE.match(line)
+                    if match:
+                        self._import(path.parent / match.group(1))
+                        continue
+                    if self.name is None and line.endswith('{'):
+                        self.name = line.split()[0]
+                    continue
+
+                if line.startswith('}'):
+                    block = None
+                    continue
+
+                if block == 'In Init':
+                    self.init_lines.append(raw.rstrip('\n').strip())
+                    continue
+
+                tokens = _strip_comment(line).split()
+                if not tokens:
+                    continue
+
+                if block == 'Data Masses':
+                    raw_masses.append((tokens[0], float(tokens[1]), lineno))
+                elif block == 'In Charges':
+                    if tokens[:2] == ['set', 'type'] and len(tokens) >= 5:
+                        raw_charges.append((tokens[2], float(tokens[4])))
+                elif block == 'In Settings':
+                    self._parse_settings_line(tokens, (path.name, lineno))
+                else:
+                    for kind, (_, prefix, n_atoms) in BONDED_KINDS.items():
+                        if block.startswith(prefix):
+                            raw_rules.append((kind, tokens[0], tokens[1:1 + n_atoms], lineno))
+                            if kind == 'improper':
+                                module = block[len(prefix):].strip(' ()')
+                                self.improper_center = IMPROPER_CENTERS.get(module, 0)
+                            break
+
+        for name, mass, lineno in raw_masses:
+            self.masses[self._atom(name)] = mass
+            self.locations['atom'][self._atom(name)] = (path.name, lineno)
+        for name, charge in raw_charges:
+            self.charges[self._atom(name)] = charge
+        for kind, name, patterns, lineno in raw_rules:
+            self.rules[kind].add(name.split(':', 1)[1], [self._atom(p) for p in patterns],
+                                 (path.name, lineno))
+        for a, b, args in self._raw_pairs:
+            self.pair_coeffs.append((self._atom(a), self._atom(b), args))
+        self._raw_pairs = []
+
+    def _parse_settings_line(self, tokens: List[str], location: Tuple[str, int]):
+        command = tokens[0]
+        if command == 'pair_coeff' and len(tokens) >= 3:
+            self._raw_pairs.append((tokens[1], tokens[2], ' '.join(tokens[3:])))
+            return
+        for kind, (coeff_command, _, _) in BONDED_KINDS.items():
+            if command == coeff_command and len(tokens) >= 2:
+                name = tokens[1].split(':', 1)[1]
+                self.coeffs[kind].setdefault(name, []).append(' '.join(tokens[2:]))
+                self.locations[kind].setdefault(name, location)
+                return
+
+    def _import(self, path: Path):
+        """合并被导入的力场文件（不存在时记录下来）"""
+        if not path.exists():
+            self.missing_imports.append(path.name)
+            self.sources.append((str(path), None, None, None))
+            return
+        imported = load_force_field(str(path))
+        self.sources.extend(imported.sources)
+        for kind, locations in imported.locations.items():
+            self.locations[kind].update(locations)
+        self.replacements.update(imported.replacements)
+        self.masses.update(imported.masses)
+        self.charges.update(imported.charges)
+        self.pair_coeffs.extend(imported.pair_coeffs)
+        for kind in BONDED_KINDS:
+            for name, lines in imported.coeffs[kind].items():
+                self.coeffs[kind].setdefault(name, []).extend(lines)
+            rules = imported.rules[kind]
+            for name, patterns, location in zip(rules.names, rules.patterns, rules.locations):
+                self.rules[kind].add(name, patterns, location)
+        self.improper_center = imported.improper_center
+        self.init_lines.extend(imported.init_lines)
+
+    def _atom(self, token: str) -> str:
+        name = token.split(':', 1)[1] if token.startswith('@atom:') else token
+        return self.full_type(name)
+
+
+class _TypeMatcher:
+    """判断类型名或类型模式是否匹配给定原子类型集合中的任一类型（结果缓存）"""
+
+    def __init__(self, full_types: Iterable[str]):
+        self.types = set(full_types)
+        self._memo: Dict[str, bool] = {}
+
+    def __call__(self, pattern: str) -> bool:
+        result = self._memo.get(pattern)
+        if result is None:
+            if _is_pattern(pattern):
+                regex = _compile(pattern)
+                result = any(regex.match(t) for t in self.types)
+            else:
+                result = pattern in self.types
+            self._memo[pattern] = result
+        return result
+
+
+def _rule_kind(block: str) -> Optional[str]:
+    """By Type section对应的成键项种类"""
+    for kind, (_, prefix, _) in BONDED_KINDS.items():
+        if block.startswith(prefix):
+            return kind
+    return None
+
+
+_loaded: Dict[str, Tuple[Tuple[float, int], LtForceField]] = {}
+
+
+def resolve_force_field_file(file: str) -> Path:
+    """力场文件的路径（相对路径按当前目录、包目录的顺序查找）"""
+    path = Path(file)
+    if path.is_absolute() or path.exists():
+        return path
+    return PACKAGE_DIR / path
+
+
+def load_force_field(path: str) -> LtForceField:
+    """加载力场文件的索引表
+
+    同一进程内按修改时间和大小缓存；跨进程使用力场文件旁的二进制索引，
+    不存在或已失效时重新解析并写回。
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime, stat.st_size)
+    cached = _loaded.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    force_field = _read_index(Path(path))
+    if force_field is None:
+        force_field = LtForceField(path)
+        _write_index(force_field)
+    _loaded[path] = (stamp, force_field)
+    return force_field
+
+
+def index_path(path: Path) -> Path:
+    """力场文件的索引缓存路径（与力场文件同目录的隐藏文件）"""
+    return path.with_name(f".{path.name}{INDEX_SUFFIX}")
+
+
+def _sources_valid(sources) -> bool:
+    """索引依赖的文件是否未变（mtime变化但内容哈希相同也视为有效）"""
+    for source, mtime_ns, size, digest in sources:
+        try:
+            stat = os.stat(source)
+        except OSError:
+            if digest is None:
+                continue
+            return False
+        if digest is None or stat.st_size != size:
+            return False
+        if stat.st_mtime_ns != mtime_ns and file_digest(source) != digest:
+            return False
+    return True
+
+
+def _read_index(path: Path) -> Optional[LtForceField]:
+    try:
+        with open(index_path(path), 'rb') as f:
+            entry = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    if not isinstance(entry, dict) or entry.get('format') != LT_INDEX_FORMAT:
+        return None
+    force_field = entry.get('force_field')
+    if not isinstance(force_field, LtForceField) or force_field.path != path:
+        return None
+    if not _sources_valid(force_field.sources):
+        return None
+    return force_field
+
+
+def _write_index(force_field: LtForceField):
+    """写入索引缓存（先写临时文件再原子替换）；目录不可写时跳过"""
+    target = index_path(force_field.path)
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=target.parent, suffix='.tmp')
+    except OSError:
+        return
+    try:
+        os.chmod(tmp_path, 0o644)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump({'format': LT_INDEX_FORMAT, 'force_field': force_field}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, target)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+分子拓扑指纹
+对原子（编号、名称、类型、电荷、质量）与各成键项（原子、函数类型、参数）
+计算内容哈希，名称不同但拓扑完全相同的分子类型可共用一份定义
+"""
+
+import hashlib
+from typing import Dict
+
+import numpy as np
+
+from parsers.interaction_table import INTERACTION_ATOMS, as_interaction_table
+
+# 参与指纹计算的原子字段
+FINGERPRINT_ATOM_KEYS = ('index', 'name', 'atom_name', 'type', 'charge', 'mass', 'x', 'y', 'z')
+
+
+def molecule_fingerprint(molecule_data: Dict) -> str:
+    """分子拓扑的SHA1指纹（与分子名称无关）"""
+    digest = hashlib.sha1()
+    atoms = molecule_data.get('atoms', [])
+    digest.update(f"atoms {len(atoms)}\n".encode())
+    for atom in atoms:
+        digest.update(repr(tuple(atom.get(key) for key in FINGERPRINT_ATOM_KEYS)).encode())
+
+    for section, n_atoms in INTERACTION_ATOMS.items():
+        table = as_interaction_table(molecule_data.get(section), n_atoms)
+        digest.update(f"\n{section} {len(table)}\n".encode())
+        if len(table):
+            digest.update(np.ascontiguousarray(table.atoms, dtype=np.int64).tobytes())
+            digest.update(np.ascontiguousarray(table.function_types, dtype=np.int64).tobytes())
+            # 参数按相互作用展开后比较，与参数表的去重方式和宽度无关
+            counts = table.param_counts[table.param_index].astype(np.int64)
+            width = int(counts.max())
+            digest.update(counts.tobytes())
+            digest.update(np.ascontiguousarray(table.expanded_parameters()[:, :width]).tobytes())
+    return digest.hexdigest()
+
+
+def molecule_aliases(molecules: Dict[str, Dict]) -> Dict[str, str]:
+    """分子名称 -> 拓扑相同的分子中最先定义的名称（唯一的分子指向自身）"""
+    first_by_fingerprint: Dict[str, str] = {}
+    aliases = {}
+    for mol_name, mol_data in molecules.items():
+        fingerprint = molecule_fingerprint(mol_data)
+        aliases[mol_name] = first_by_fingerprint.setdefault(fingerprint, mol_name)
+    return aliases
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+GROMACS拓扑预处理器
+处理#include / #ifdef / #ifndef / #else / #endif / #define / #undef，
+被包含文件的词法结果按内容哈希在进程内缓存
+"""
+
+import hashlib
+import os
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+
+from parsers.topology_lexer import (
+    DATA, DIRECTIVE, Lexeme, Record, assign_sections, gc_paused, lex_lines
+)
+
+# 进程内词法缓存：内容哈希 -> 词法单元列表
+_LEXEME_CACHE: Dict[str, List[Lexeme]] = {}
+# (路径, mtime, 大小) -> 内容哈希，避免重复读取未修改的文件
+_DIGEST_MEMO: Dict[Tuple[str, int, int], str] = {}
+_CACHE_STATS = {'hits': 0, 'misses': 0}
+
+# 防止循环包含
+MAX_INCLUDE_DEPTH = 64
+
+
+def file_digest(path: str) -> str:
+    """计算文件内容的SHA1哈希（按mtime/大小记忆）"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    digest = _DIGEST_MEMO.get(key)
+    if digest is None:
+        with open(path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        _DIGEST_MEMO[key] = digest
+    return digest
+
+
+def lex_file_cached(path: str) -> Tuple[List[Lexeme], str]:
+    """返回文件的词法单元，同一内容在进程内只切分一次"""
+    digest = file_digest(path)
+    lexemes = _LEXEME_CACHE.get(digest)
+    if lexemes is None:
+        _CACHE_STATS['misses'] += 1
+        with open(path, 'r') as f, gc_paused():
+            lexemes = list(lex_lines(f))
+        _LEXEME_CACHE[digest] = lexemes
+    else:
+        _CACHE_STATS['hits'] += 1
+    return lexemes, digest
+
+
+def get_lexeme_cache_stats() -> Dict[str, int]:
+    """返回词法缓存的命中统计"""
+    return dict(_CACHE_STATS, entries=len(_LEXEME_CACHE))
+
+
+def clear_lexeme_cache():
+    """清空进程内词法缓存"""
+    _LEXEME_CACHE.clear()
+    _DIGEST_MEMO.clear()
+    _CACHE_STATS['hits'] = 0
+    _CACHE_STATS['misses'] = 0
+
+
+def gmxlib_dirs() -> List[str]:
+    """从GMXLIB环境变量获取包含文件搜索路径"""
+    value = os.environ.get('GMXLIB', '')
+    return [path for path in value.split(os.pathsep) if path]
+
+
+def parse_define_args(defines: Optional[List[str]]) -> Dict[str, List[str]]:
+    """将命令行的NAME或NAME=VALUE形式转换为宏定义"""
+    result = {}
+    for item in defines or []:
+        name, _, value = item.partition('=')
+        result[name.strip()] = value.split()
+    return result
+
+
+class TopologyPreprocessor:
+    """GROMACS拓扑预处理器（与grompp -pp的行为一致）"""
+
+    def __init__(self, include_dirs: Optional[List[str]] = None,
+                 defines: Optional[Dict[str, List[str]]] = None, logger=None):
+        self.include_dirs = [str(d) for d in (include_dirs or [])] + gmxlib_dirs()
+        self.defines = {name: list(value) for name, value in (defines or {}).items()}
+        self.logger = logger
+        # 本次预处理涉及的所有文件：(绝对路径, 内容哈希)
+        self.dependencies: List[Tuple[str, str]] = []
+
+    def iter_records(self, path: str) -> Iterator[Record]:
+        """预处理文件并产生(section, tokens, 行号)记录"""
+        return assign_sections(self.iter_lexemes(path))
+
+    def iter_lexemes(self, path: str, depth: int = 0) -> Iterator[Lexeme]:
+        """展开包含文件、求值条件编译并替换宏后的词法单元"""
+        if depth > MAX_INCLUDE_DEPTH:
+            raise ValueError(f"包含层级过深（可能存在循环包含）: {path}")
+
+        if depth == 0:
+            # 顶层文件直接流式读取，只有被包含的共享文件进入缓存
+            self.dependencies.append((os.path.abspath(path), file_digest(path)))
+            with open(path, 'r') as f:
+                yield from self._evaluate(lex_lines(f), path, depth)
+        else:
+            lexemes, digest = lex_file_cached(path)
+            self.dependencies.append((os.path.abspath(path), digest))
+            yield from self._evaluate(lexemes, path, depth)
+
+    def _evaluate(self, lexemes: Iterable[Lexeme], path: str, depth: int) -> Iterator[Lexeme]:
+        """对一个文件的词法单元求值预处理指令"""
+        # 条件栈：每项为 [当前分支是否生效, 是否已进入#else, 外层是否生效]
+        conditions: List[List[bool]] = []
+        active = True
+
+        for kind, tokens, lineno in lexemes:
+            if kind is DIRECTIVE:
+                directive, args = self._split_directive(tokens)
+
+                if directive in ('ifdef', 'ifndef'):
+                    if not args:
+                        raise ValueError(f"{path}:{lineno}: #{directive} 缺少宏名")
+                    defined = args[0] in self.defines
+                    taken = defined if directive == 'ifdef' else not defined
+                    conditions.append([taken, False, active])
+                    active = active and taken
+                elif directive == 'else':
+                    if not conditions or conditions[-1][1]:
+                        raise ValueError(f"{path}:{lineno}: 不匹配的 #else")
+                    condition = conditions[-1]
+                    condition[0] = not condition[0]
+                    condition[1] = True
+                    active = condition[2] and condition[0]
+                elif directive == 'endif':
+                    if not conditions:
+                        raise ValueError(f"{path}:{lineno}: 不匹配的 #endif")
+                    active = conditions.pop()[2]
+                elif not active:
+                    continue
+                elif directive == 'define':
+                    if not args:
+                        raise ValueError(f"{path}:{lineno}: #define 缺少宏名")
+                    self.defines[args[0]] = args[1:]
+                elif directive == 'undef':
+                    if args:
+                        self.defines.pop(args[0], None)
+                elif directive == 'include':
+                    if not args:
+                        raise ValueError(f"{path}:{lineno}: #include 缺少文件名")
+                    include_path = self._resolve_include(args[0], path, lineno)
+                    yield from self.iter_lexemes(include_path, depth + 1)
+                elif self.logger:
+                    self.logger.warning(f"{path}:{lineno}: 忽略不支持的预处理指令 #{directive}")
+                continue
+
+            if not active:
+                continue
+
+            if kind is DATA and self.defines:
+                tokens = self._expand_macros(tokens)
+            yield kind, tokens, lineno
+
+        if conditions:
+            raise ValueError(f"{path}: 缺少 #endif")
+
+    def _split_directive(self, tokens: List[str]) -> Tuple[str, List[str]]:
+        """拆分指令名与参数，兼容'# include'写法"""
+        if tokens[0] == '#':
+            return (tokens[1] if len(tokens) > 1 else ''), tokens[2:]
+        return tokens[0][1:], tokens[1:]
+
+    def _expand_macros(self, tokens: List[str], expanding: FrozenSet[str] = frozenset()) -> List[str]:
+        """按整词替换宏（例如力场中的gb_/ga_参数宏）
+
+        宏的内容中引用的其他宏继续展开；与C预处理器相同，正在展开的宏
+        在自身内容中不再展开，循环引用的宏名原样保留。
+        """
+        defines = self.defines
+        if not any(token in defines for token in tokens):
+            return tokens
+        expanded = []
+        for token in tokens:
+            value = defines.get(token)
+            if value is None or token in expanding:
+                expanded.append(token)
+            else:
+                expanded.extend(self._expand_macros(value, expanding | {token}))
+        return expanded
+
+    def _resolve_include(self, name: str, current_file: str, lineno: int) -> str:
+        """按当前文件目录、包含路径、GMXLIB的顺序查找被包含文件"""
+        name = name.strip('"<>')
+        candidates = [Path(current_file).parent / name]
+        candidates.extend(Path(d) / name for d in self.include_dirs)
+
+        for candidate in candidates:
+            if candidate.is_file():
+                return str(candidate)
+
+        raise FileNotFoundError(f"找不到包含文件: {name} (来自 {current_file}:{lineno})")
@@ -5,19 +5,52 @@
 测试GROMACS解析器和moltemplate生成器的基本功能
 """
 
+import io
+from itertools import combinations
+import time
 import unittest
 import tempfile
 import shutil
 from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 import sys
 
+import numpy as np
+
 # 添加父目录到路径
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+GAFF2_FILE = Path(__file__).parent.parent / "force_fields" / "gaff2.lt"
+
 from parsers.gromacs_parser import GromacsParser
+from parsers.bonded_sections import find_bonded_spans
+from parsers.coordinate_reader import (
+    CoordinateTable, index_coordinate_frames, read_coordinate_frame, read_gro_table,
+    read_pdb_header
+)
+from parsers.interaction_table import (
+    InteractionTable, InteractionView, canonical_codes, canonical_type_key
+)
+from parsers.lt_force_field import load_force_field
+from parsers.molecule_fingerprint import molecule_aliases
+from parsers.topology_lexer import iter_topology_records
+from parsers.topology_preprocessor import (
+    TopologyPreprocessor, clear_lexeme_cache, get_lexeme_cache_stats
+)
+from generators.atom_lookup import AtomLookup
+from generators.data_refresh import DataCoordinateRefresher
+from generators.bulk_writer import write_fixed_rows, write_lines, write_rows
+from generators.fixed_format import format_rows
+from generators.frame_writer import FrameWriter
+from generators.lammps_data_writer import LammpsDataWriter, _split_instances
 from generators.moltemplate_generator import MoltemplateGenerator
+from generators.standard_ff_data_writer import (
+    StandardForceFieldDataWriter, angle_rows, bond_graph, dihedral_rows, improper_candidates
+)
 from utils.force_field_manager import ForceFieldManager
 from utils.logger import setup_logger
+from utils.topology_cache import TopologyCache
 
 
 class TestGromacsParser(unittest.TestCase):
@@ -57,9 +90,9 @@ Water 10
         # 创建测试.gro文件
         gro_content = """Test System
 3
-    1WATER     OW    1   1.000   1.000   1.000
-    1WATER    HW1    2   1.100   1.000   1.000
-    1WATER    HW2    3   0.900   1.000   1.000
+    1WATER   OW    1   1.000   1.000   1.000
+    1WATER  HW1    2   1.100   1.000   1.000
+    1WATER  HW2    3   0.900   1.000   1.000
    3.000   3.000   3.000
 """
         self.gro_file = self.temp_dir / "test.gro"
@@ -96,6 +129,40 @@ Water 2
         self.assertEqual(len(coord_data['coordinates']), 3)
         self.assertEqual(len(coord_data['box_vectors']), 3)
     
+    def test_gro_coordinate_table(self):
+        """测试GRO文件的列式坐标表"""
+        coord_data = self.parser._parse_gro_file(str(self.gro_file))
+        table = coord_data['coordinate_table']
+        
+        self.assertEqual(table.atom_numbers.dtype, np.int32)
+        self.assertEqual(table.residue_numbers.dtype, np.int32)
+        self.assertEqual(table.positions.shape, (3, 3))
+        self.assertEqual(table.residue_names, ['WATER'])
+        self.assertEqual(list(table.atom_name_array()), ['OW', 'HW1', 'HW2'])
+        np.testing.assert_allclose(table.positions[1], [11.0, 10.0, 10.0])
+        
+        # Atom对象按需创建
+        atom = coord_data['coordinates'][2]
+        self.assertEqual(atom.name, 'HW2')
+        self.assertEqual(atom.index, 3)
+        self.assertAlmostEqual(atom.x, 9.0)
+    
+    def test_stream_gro_chunks(self):
+        """测试GRO文件的分块流式读取"""
+        system_data = self.parser.parse_system(
+            str(self.top_file), str(self.gro_file),
+            stream_coordinates=True, chunk_size=2
+        )
+        
+        self.assertNotIn('coordinates', system_data)
+        self.assertEqual(system_data['n_coordinates'], 3)
+        self.assertEqual(system_data['box_vectors'], [30.0, 30.0, 30.0])
+        
+        chunks = list(system_data['coordinate_chunks'])
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertEqual(list(chunks[1].atom_name_array()), ['HW2'])
+        np.testing.assert_allclose(chunks[1].positions[0], [9.0, 10.0, 10.0])
+    
     def test_parse_topology_file(self):
         """测试拓扑文件解析"""
         top_data = self.parser._parse_topology_file(str(self.top_file))
@@ -116,6 +183,185 @@ Water 2
         self.assertEqual(len(itp_data['atoms']), 3)
         self.assertEqual(len(itp_data['bonds']), 2)
     
+    def test_interaction_table(self):
+        """测试成键相互作用的列式存储与只读字典视图"""
+        itp_data = self.parser._parse_itp_file(str(self.itp_file))
+        bonds = itp_data['molecules']['Water']['bonds']
+        table = bonds.table
+        
+        self.assertEqual(table.atoms.dtype, np.int32)
+        self.assertEqual(table.atoms.tolist(), [[1, 2], [1, 3]])
+        self.assertEqual(table.function_types.dtype, np.int8)
+        # 两个键参数相同，参数表中只保存一份
+        self.assertEqual(table.parameters.shape, (1, 2))
+        self.assertEqual(table.param_index.tolist(), [0, 0])
+        self.assertEqual(bonds[1], {'atom1': 1, 'atom2': 3, 'function_type': 1,
+                                    'parameters': [0.1, 345000.0]})
+        self.assertEqual(bonds, list(bonds))
+        self.assertEqual(len(itp_data['molecules']['Water']['dihedrals']), 0)
+
+    def test_extract_bonded_types(self):
+        """测试批量提取成键类型：类型名规范化、首次出现的参数优先、跳过未定义原子"""
+        molecule = {
+            'atoms': [
+                {'index': 1, 'type': 'OW'},
+                {'index': 2, 'type': 'HW'},
+                {'index': 5, 'type': 'CT'},
+            ],
+            'bonds': [
+                {'atom1': 1, 'atom2': 2, 'function_type': 1, 'parameters': [0.1, 1.0]},
+                {'atom1': 2, 'atom2': 1, 'function_type': 1, 'parameters': [0.2, 2.0]},
+                {'atom1': 5, 'atom2': 1, 'function_type': 1, 'parameters': [0.3, 3.0]},
+                {'atom1': 2, 'atom2': 9, 'function_type': 1, 'parameters': [0.4, 4.0]},
+            ],
+            'angles': [
+                {'atom1': 2, 'atom2': 1, 'atom3': 5, 'function_type': 1, 'parameters': [109.5, 1.0]},
+                {'atom1': 5, 'atom2': 1, 'atom3': 2, 'function_type': 1, 'parameters': [120.0, 2.0]},
+            ],
+        }
+        force_field = {'bond_types': {'CT-OW': {'parameters': []}}, 'angle_types': {}}
+        self.parser._extract_bond_types_from_bonds(molecule, force_field)
+        self.parser._extract_angle_types_from_angles(molecule, force_field)
+
+        self.assertEqual(list(force_field['bond_types']), ['CT-OW', 'HW-OW'])
+        self.assertEqual(force_field['bond_types']['HW-OW'],
+                         {'atom1': 'HW', 'atom2': 'OW', 'function_type': 1,
+                          'parameters': [0.1, 1.0]})
+        self.assertEqual(force_field['bond_types']['CT-OW'], {'parameters': []})
+        # 正反方向的角度归为同一类型，参数取首次出现的
+        self.assertEqual(list(force_field['angle_types']), ['CT-OW-HW'])
+        self.assertEqual(force_field['angle_types']['CT-OW-HW']['parameters'], [109.5, 1.0])
+
+    def test_resolve_bonded_parameters(self):
+        """测试从[ *types ]表补全参数：正反方向、通配符优先级与未找到的计数"""
+        top_file = self.temp_dir / "types.top"
+        top_file.write_text(
+            "[ bondtypes ]\nHC CT 1 0.109 284512.0\n"
+            "[ angletypes ]\nHC CT CT 1 110.7 313.8\n"
+            "[ dihedraltypes ]\n"
+            "X CT CT X 9 0.0 0.6276 3\n"
+            "HC CT CT HC 9 0.0 0.6 3\n"
+            "X CT CT OH 9 0.0 1.0 3\n"
+            "[ moleculetype ]\nETH 3\n"
+            "[ atoms ]\n"
+            "1 CT 1 ETH C1 1 0.0 12.011\n2 CT 1 ETH C2 1 0.0 12.011\n"
+            "3 HC 1 ETH H1 1 0.0 1.008\n4 HC 1 ETH H2 1 0.0 1.008\n"
+            "5 OH 1 ETH O 1 0.0 15.999\n"
+            "[ bonds ]\n3 1 1\n2 4 1\n1 2 1 0.15 200000.0\n2 5 1\n"
+            "[ angles ]\n2 1 3 1\n"
+            "[ dihedrals ]\n4 2 1 3 9\n3 1 2 5 9\n5 2 1 2 9\n4 2 1 2 9\n"
+            "[ system ]\nEthanol\n[ molecules ]\nETH 1\n"
+        )
+        gro_file = self.temp_dir / "types.gro"
+        gro_file.write_text("Ethanol\n5\n" + "".join(
+            f"    1ETH      A{i:5d}   0.100   0.100   0.100\n" for i in range(1, 6)) + "   1.0 1.0 1.0\n")
+
+        system_data = self.parser.parse_system(str(top_file), str(gro_file))
+        molecule = system_data['molecules']['ETH']
+        bonds = [row['parameters'] for row in molecule['bonds']]
+        self.assertEqual(bonds, [[0.109, 284512.0], [0.109, 284512.0], [0.15, 200000.0], []])
+        self.assertEqual(molecule['angles'][0]['parameters'], [110.7, 313.8])
+        dihedrals = [row['parameters'] for row in molecule['dihedrals']]
+        # 精确匹配优先于通配符，通配符少的优先（OH-CT-CT-CT反向匹配X-CT-CT-OH）
+        self.assertEqual(dihedrals, [[0.0, 0.6, 3.0], [0.0, 1.0, 3.0],
+                                     [0.0, 1.0, 3.0], [0.0, 0.6276, 3.0]])
+        # 补全后提取的类型带有参数
+        bond_types = system_data['global_force_field']['bond_types']
+        self.assertEqual(bond_types['CT-HC']['parameters'], [0.109, 284512.0])
+        self.assertEqual(bond_types['CT-OH']['parameters'], [])
+
+    def test_resolve_mixed_function_types(self):
+        """测试同名的多条二面角类型按函数类型分别查找，连续的9型行合并为多项并报告被丢弃的项"""
+        top_file = self.temp_dir / "mixed.top"
+        top_file.write_text(
+            "[ dihedraltypes ]\n"
+            "ca ca ca ha 9 180.0 15.0 2\n"
+            "ca ca ca ha 9 0.0 1.0 3\n"
+            "ca ca ca ha 4 180.0 4.6 2\n"
+            "[ moleculetype ]\nBEN 3\n"
+            "[ atoms ]\n"
+            "1 ca 1 BEN C1 1 0.0 12.011\n2 ca 1 BEN C2 1 0.0 12.011\n"
+            "3 ca 1 BEN C3 1 0.0 12.011\n4 ha 1 BEN H4 1 0.0 1.008\n"
+            "[ dihedrals ]\n1 2 3 4 9\n1 2 3 4 4\n"
+            "[ system ]\nBenzene\n[ molecules ]\nBEN 1\n"
+        )
+        gro_file = self.temp_dir / "mixed.gro"
+        gro_file.write_text("Benzene\n4\n" + "".join(
+            f"    1BEN      A{i:5d}   0.100   0.100   0.100\n" for i in range(1, 5)) + "   1.0 1.0 1.0\n")
+
+        with self.assertLogs(self.logger, level='WARNING') as logs:
+            system_data = self.parser.parse_system(str(top_file), str(gro_file))
+        dihedral_type = system_data['global_force_field']['dihedral_types']['ca-ca-ca-ha']
+        self.assertEqual(dihedral_type['terms'], [[180.0, 15.0, 2.0], [0.0, 1.0, 3.0]])
+        self.assertEqual(dihedral_type['variants'][0]['function_type'], 4)
+        dihedrals = [row['parameters'] for row in system_data['molecules']['BEN']['dihedrals']]
+        self.assertEqual(dihedrals, [[180.0, 15.0, 2.0], [180.0, 4.6, 2.0]])
+        # 第二项（0.0 1.0 3）无法写出，必须给出警告
+        self.assertTrue(any("1 项使用了多项9型二面角类型" in line and "ca-ca-ca-ha" in line
+                            for line in logs.output))
+
+    def test_topology_lexer(self):
+        """测试拓扑词法分析器"""
+        lines = [
+            "; 注释行",
+            "[ bonds ]",
+            "1 2 1 0.1 345000 ; 行尾注释",
+            "",
+            "[bonds]",
+            "1 3 1 0.1 345000",
+        ]
+        records = list(iter_topology_records(lines))
+        
+        self.assertEqual(records, [
+            ('bonds', ['1', '2', '1', '0.1', '345000'], 3),
+            ('bonds', ['1', '3', '1', '0.1', '345000'], 6),
+        ])
+    
+    def test_preprocessor_include_and_defines(self):
+        """测试#include/#ifdef/#define预处理与包含文件缓存"""
+        ff_dir = self.temp_dir / "ff"
+        ff_dir.mkdir()
+        (ff_dir / "forcefield.itp").write_text(
+            "#define b0_oh 0.0960\n"
+            "#define gb_oh b0_oh 462750.4\n"
+            "[ atomtypes ]\n"
+            "OW 8 15.999 0.0 A 0.315 0.636\n"
+            "#ifdef FLEXIBLE\n"
+            "HW 1 1.008 0.0 A 0.0 0.0\n"
+            "#else\n"
+            "HW 1 1.008 0.0 A 0.1 0.1\n"
+            "#endif\n"
+        )
+        mol_itp = self.temp_dir / "mol.itp"
+        mol_itp.write_text(
+            '#include "forcefield.itp"\n'
+            "[ moleculetype ]\n"
+            "SOL 2\n"
+            "[ atoms ]\n"
+            "1 OW 1 SOL OW 1 -0.834 15.999\n"
+            "2 HW 1 SOL HW1 1 0.417 1.008\n"
+            "[ bonds ]\n"
+            "1 2 1 gb_oh\n"
+        )
+        
+        clear_lexeme_cache()
+        parser = GromacsParser(self.logger, include_dirs=[str(ff_dir)],
+                               defines={'FLEXIBLE': []})
+        itp_data = parser._parse_itp_file(str(mol_itp))
+        parser._parse_itp_file(str(mol_itp))
+        
+        atom_types = itp_data['global_force_field']['atom_types']
+        self.assertEqual(atom_types['HW']['sigma'], 0.0)
+        self.assertEqual(itp_data['molecules']['SOL']['bonds'][0]['parameters'],
+                         [0.0960, 462750.4])
+        # 共享的包含文件只切分一次，第二次解析命中缓存
+        self.assertEqual(get_lexeme_cache_stats()['misses'], 1)
+        self.assertEqual(get_lexeme_cache_stats()['hits'], 1)
+        
+        # 循环引用的宏展开到自身时停止
+        preprocessor = TopologyPreprocessor([], {'A': ['B', '1'], 'B': ['A', '2']})
+        self.assertEqual(preprocessor._expand_macros(['A', 'x']), ['A', '2', '1', 'x'])
+    
     def test_parse_system(self):
         """测试完整系统解析"""
         system_data = self.parser.parse_system(
@@ -128,6 +374,114 @@ Water 2
         self.assertIn('system_composition', system_data)
         self.assertIn('coordinates', system_data)
         self.assertIn('box_vectors', system_data)
+    
+    def test_parallel_itp_parsing(self):
+        """测试多进程解析ITP文件与串行结果一致"""
+        itp_files = []
+        for i in range(3):
+            itp_file = self.temp_dir / f"mol{i}.itp"
+            itp_file.write_text(self.itp_file.read_text().replace("Water 2", f"Water{i} 2"))
+            itp_files.append(str(itp_file))
+        # 最后一个文件覆盖同名分子，检验合并顺序
+        itp_files.append(str(self.itp_file))
+        
+        serial = GromacsParser(self.logger).parse_itp_only(itp_files)
+        parallel = GromacsParser(self.logger, jobs=2).parse_itp_only(itp_files)
+        
+        self.assertEqual(parallel, serial)
+        self.assertEqual(list(parallel['molecules']),
+                         ['Water0', 'Water1', 'Water2', 'Water'])
+    
+    def test_parallel_bonded_sections(self):
+        """测试超大成键section分块并行解析与串行结果一致"""
+        lines = ["[ moleculetype ]", "Chain 3", "[ atoms ]"]
+        lines += [f"{i} C 1 PE C{i} {i} 0.0 12.011" for i in range(1, 201)]
+        lines.append("[ bonds ]")
+        for i in range(1, 200):
+            lines.append(f"{i} {i + 1} 1 0.153 334720.0 ; 键{i}")
+            if i % 50 == 0:
+                lines += ["", "; 注释行", "1 2"]
+        lines.append("[ angles ]")
+        lines += [f"{i} {i + 1} {i + 2} 1 111.0 {400 + i}" for i in range(1, 199)]
+        lines.append("[ dihedrals ]")
+        lines += [f"{i} {i + 1} {i + 2} {i + 3} 3 9.28 12.16 -13.12 -3.06 26.24 -31.5"
+                  for i in range(1, 198)]
+        itp_file = self.temp_dir / "chain.itp"
+        itp_file.write_text("\n".join(lines) + "\n")
+        
+        serial = GromacsParser(self.logger)._parse_itp_file(str(itp_file))
+        parser = GromacsParser(self.logger, jobs=2)
+        parser.parallel_min_lines = 10
+        parallel = parser._parse_itp_file(str(itp_file))
+        
+        self.assertEqual(len(find_bonded_spans(str(itp_file), 10)), 3)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(len(parallel['molecules']['Chain']['bonds']), 199)
+
+
+class TestTopologyCache(unittest.TestCase):
+    """测试拓扑磁盘缓存"""
+    
+    def setUp(self):
+        """设置测试环境"""
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.logger = setup_logger(verbose=False)
+        self.itp_file = self.temp_dir / "water.itp"
+        self.itp_file.write_text(
+            "[ moleculetype ]\nWater 2\n"
+            "[ atoms ]\n1 OW 1 WAT OW 1 -0.834 15.999\n2 HW 1 WAT HW1 1 0.417 1.008\n"
+            "[ bonds ]\n1 2 1 0.1 345000\n"
+        )
+    
+    def tearDown(self):
+        """清理测试环境"""
+        shutil.rmtree(self.temp_dir)
+    
+    def test_cache_hit_and_invalidation(self):
+        """测试缓存命中以及文件内容变化后失效"""
+        cache = TopologyCache(str(self.temp_dir / "cache"))
+        parser = GromacsParser(self.logger, cache=cache)
+        
+        first = parser._parse_itp_file(str(self.itp_file))
+        second = parser._parse_itp_file(str(self.itp_file))
+        self.assertEqual(first, second)
+        self.assertEqual(cache.stats['hits'], 1)
+        
+        self.itp_file.write_text(self.itp_file.read_text().replace("Water 2", "Water   3"))
+        third = parser._parse_itp_file(str(self.itp_file))
+        self.assertEqual(third['molecules']['Water']['nrexcl'], 3)
+        self.assertEqual(cache.stats['hits'], 1)
+    
+    def test_cache_key_follows_include_resolution(self):
+        """测试内容相同、但#include解析到不同文件的拓扑不共用缓存项"""
+        cache = TopologyCache(str(self.temp_dir / "cache"))
+        parser = GromacsParser(self.logger, cache=cache)
+        atoms = {'a': 1, 'b': 2}
+        for name, n_atoms in atoms.items():
+            directory = self.temp_dir / name
+            directory.mkdir()
+            (directory / "topol.top").write_text('#include "lig.itp"\n')
+            (directory / "lig.itp").write_text(
+                "[ moleculetype ]\nLIG 3\n[ atoms ]\n" +
+                "".join(f"{i} C 1 LIG C{i} 1 0.0 12.0\n" for i in range(1, n_atoms + 1)))
+        
+        for name, n_atoms in atoms.items():
+            data = parser._parse_topology_file(str(self.temp_dir / name / "topol.top"))
+            self.assertEqual(len(data['molecules']['LIG']['atoms']), n_atoms)
+        self.assertEqual(cache.stats['hits'], 0)
+        
+        data = parser._parse_topology_file(str(self.temp_dir / "b" / "topol.top"))
+        self.assertEqual(len(data['molecules']['LIG']['atoms']), 2)
+        self.assertEqual(cache.stats['hits'], 1)
+    
+    def test_cache_eviction(self):
+        """测试按大小的LRU淘汰"""
+        cache = TopologyCache(str(self.temp_dir / "cache"), max_size_mb=0)
+        parser = GromacsParser(self.logger, cache=cache)
+        parser._parse_itp_file(str(self.itp_file))
+        
+        self.assertEqual(cache.stats['evictions'], 1)
+        self.assertEqual(cache.summary()['entries'], 0)
 
 
 class TestForceFieldManager(unittest.TestCase):
@@ -169,6 +523,110 @@ class TestForceFieldManager(unittest.TestCase):
         self.assertIn('atom_types', ff_data)
         self.assertIn('bond_types', ff_data)
 
+    def test_canonical_type_keys(self):
+        """测试正反方向的成键类型合并为一个规范类型"""
+        codes = [[2, 1], [1, 2], [3, 1, 0], [0, 1, 3], [1, 2, 2, 1], [2, 2, 1, 0]]
+        names = ['A', 'B', 'C', 'D']
+        for section in (codes[:2], codes[2:4], codes[4:]):
+            rows = np.array(section)
+            for row, canonical in zip(rows.tolist(), canonical_codes(rows).tolist()):
+                self.assertEqual(tuple(names[c] for c in canonical),
+                                 canonical_type_key(names[c] for c in row))
+        self.assertEqual(canonical_codes(np.array(codes[2:4])).tolist(), [[0, 1, 3], [0, 1, 3]])
+
+        system_data = {
+            'global_force_field': {
+                'bond_types': {'OW-HW': {'atom1': 'OW', 'atom2': 'HW', 'parameters': []}},
+                'dihedral_types': {
+                    'HC-CT-CT-OH': {'atom1': 'HC', 'atom2': 'CT', 'atom3': 'CT', 'atom4': 'OH',
+                                    'parameters': [0.0, 0.6, 3]},
+                },
+            },
+            'molecules': {
+                'Water': {
+                    'bond_types': {'HW-OW': {'atom1': 'HW', 'atom2': 'OW', 'parameters': [0.1, 1.0]}},
+                    'dihedral_types': {
+                        'OH-CT-CT-HC': {'atom1': 'OH', 'atom2': 'CT', 'atom3': 'CT', 'atom4': 'HC',
+                                        'parameters': [0.0, 1.0, 3]},
+                    },
+                }
+            }
+        }
+        ff_data = self.ff_manager._process_custom_force_field(system_data)
+
+        # 先出现的没有参数时取有参数的定义；都有参数时保留先出现的
+        self.assertEqual(ff_data['bond_types'],
+                         {'HW-OW': {'atom1': 'HW', 'atom2': 'OW', 'parameters': [0.1, 1.0]}})
+        self.assertEqual(list(ff_data['dihedral_types']), ['HC-CT-CT-OH'])
+        self.assertEqual(ff_data['dihedral_types']['HC-CT-CT-OH']['parameters'], [0.0, 0.6, 3])
+
+    def test_subset_force_field(self):
+        """测试精简力场只保留体系原子类型相关的参数，且规则匹配结果不变"""
+        temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, temp_dir)
+        system_data = {
+            'molecules': {
+                'Ethane': {'atoms': [{'index': 1, 'type': 'c3'}, {'index': 2, 'type': 'hc'}]}
+            }
+        }
+        ff_data = self.ff_manager._process_standard_force_field('gaff2')
+        subset_data = self.ff_manager.subset_force_field(system_data, ff_data, temp_dir, "system")
+
+        self.assertEqual(subset_data['file'], "system_gaff2.lt")
+        subset = load_force_field(str(temp_dir / subset_data['file']))
+        full = load_force_field(str(GAFF2_FILE))
+        self.assertEqual(sorted(subset.masses), ['c3', 'hc'])
+        self.assertEqual(len(subset.pair_coeffs), 2)
+        for kind, types in [('bond', ('c3', 'hc')), ('angle', ('hc', 'c3', 'c3')),
+                            ('dihedral', ('hc', 'c3', 'c3', 'hc'))]:
+            name = full.rules[kind].match(types)
+            self.assertEqual(subset.rules[kind].match(types), name)
+            self.assertEqual(subset.coeffs[kind][name], full.coeffs[kind][name])
+        self.assertLess(len(subset.rules['dihedral']), len(full.rules['dihedral']) // 100)
+
+    def test_force_field_index_cache(self):
+        """测试力场索引缓存的复用与失效，以及行号定位"""
+        temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, temp_dir)
+        ff_file = temp_dir / "tiny.lt"
+        ff_file.write_text(
+            'TINY {\n'
+            '  write_once("Data Masses") {\n    @atom:c3 12.01\n    @atom:hc 1.008\n  }\n'
+            '  write_once("In Settings") {\n    bond_coeff @bond:c3-hc harmonic 337.3 1.092\n  }\n'
+            '  write_once("Data Bonds By Type") {\n    @bond:c3-hc @atom:c3 @atom:hc\n  }\n'
+            '}\n'
+        )
+
+        ff = load_force_field(str(ff_file))
+        self.assertEqual(ff.where('atom', 'hc'), "tiny.lt:4")
+        self.assertEqual(ff.where('bond', 'c3-hc'), "tiny.lt:7")
+        self.assertEqual(ff.rules['bond'].locations[0], ("tiny.lt", 10))
+        self.assertTrue((temp_dir / ".tiny.lt.idx").exists())
+
+        # 另一进程（清空进程内缓存）直接读取索引
+        from parsers import lt_force_field
+        lt_force_field._loaded.clear()
+        cached = load_force_field(str(ff_file))
+        self.assertIsNot(cached, ff)
+        self.assertEqual(cached.rules['bond'].match(('hc', 'c3')), 'c3-hc')
+
+        lt_force_field._loaded.clear()
+        ff_file.write_text(ff_file.read_text().replace("1.008", "2.0141"))
+        self.assertEqual(load_force_field(str(ff_file)).masses['hc'], 2.0141)
+
+        system_data = {'molecules': {'M': {
+            'atoms': [{'index': 1, 'type': 'c3'}, {'index': 2, 'type': 'c3'},
+                      {'index': 3, 'type': 'hc'}],
+            'bonds': [{'atom1': 1, 'atom2': 3, 'function_type': 1, 'parameters': []}],
+        }}}
+        ff_data = {'type': 'standard', 'name': 'tiny', 'file': str(ff_file)}
+        self.assertTrue(self.ff_manager.validate_force_field_compatibility(system_data, ff_data))
+        system_data['molecules']['M']['bonds'].append(
+            {'atom1': 1, 'atom2': 2, 'function_type': 1, 'parameters': []})
+        self.assertFalse(self.ff_manager.validate_force_field_compatibility(system_data, ff_data))
+        system_data['molecules']['M']['atoms'].append({'index': 4, 'type': 'zz'})
+        self.assertFalse(self.ff_manager.validate_force_field_compatibility(system_data, ff_data))
+
 
 class TestMoltemplateGenerator(unittest.TestCase):
     """测试moltemplate生成器"""
@@ -198,6 +656,694 @@ class TestMoltemplateGenerator(unittest.TestCase):
         self.assertIn("TestSystem.lt", header)
         self.assertIn("系统文件", header)
 
+    def test_custom_ff_bonded_output(self):
+        """测试自定义力场成键项写出（未定义原子的处理）"""
+        atoms = [{'index': 1, 'type': 'OW', 'name': 'OW'},
+                 {'index': 2, 'type': 'HW', 'name': 'HW1'},
+                 {'index': 3, 'type': 'HW', 'name': 'HW2'}]
+        lookup = AtomLookup(atoms)
+        bonds = InteractionView(InteractionTable.from_rows(
+            [{'atom1': 1, 'atom2': 2}, {'atom1': 1, 'atom2': 9}, {'atom1': 1, 'atom2': 3}], 2))
+        angles = InteractionView(InteractionTable.from_rows(
+            [{'atom1': 2, 'atom2': 1, 'atom3': 9}], 3))
+
+        out = io.StringIO()
+        self.generator._write_bonds_for_custom_ff(out, bonds, lookup)
+        self.generator._write_angles_for_custom_ff(out, angles, lookup)
+        self.assertEqual(out.getvalue(), (
+            '  write("Data Bonds") {\n'
+            '    $bond:bond1 @bond:HW-OW $atom:OW $atom:HW1\n'
+            '    $bond:bond3 @bond:HW-OW $atom:OW $atom:HW2\n'
+            '  }\n'
+            '  write("Data Angles") {\n'
+            '    $angle:angle1 @angle:HW-OW-UNK $atom:HW1 $atom:OW $atom:atom9\n'
+            '  }\n'
+        ))
+
+    def test_buffered_writers(self):
+        """测试批量写出与逐行f.write逐字节一致，并按buffer_size与block_rows写出"""
+        rng = np.random.default_rng(1)
+        n_atoms = 2500
+        atoms = [{'index': i, 'type': f"T{i % 5}", 'charge': float(q)}
+                 for i, q in enumerate(rng.normal(0, 1, n_atoms), 1)]
+        chain = np.arange(1, n_atoms, dtype=np.int32)
+        bonds = InteractionTable(
+            np.stack([chain, chain + 1], axis=1), np.ones(n_atoms - 1, dtype=np.int8),
+            np.zeros(n_atoms - 1, dtype=np.int32), np.zeros((1, 0)), np.zeros(1, dtype=np.int8))
+        positions = rng.normal(0, 50, (n_atoms, 3))
+        table = CoordinateTable(np.ones(n_atoms, np.int32), np.zeros(n_atoms, np.int32), ['SOL'],
+                                np.arange(n_atoms, dtype=np.int32) % 3, ['OW', 'HW1', 'HW2'],
+                                np.arange(1, n_atoms + 1, dtype=np.int32), positions)
+
+        # 原逐行写出的格式
+        expected = ['  write("Data Atoms") {\n']
+        for atom in atoms:
+            expected.append(f"    ${atom['index']} 1 {atom['type']} {atom['charge']:.6f} 0.0 0.0 0.0\n")
+        expected.append('  }\n  write("Data Bonds") {\n')
+        for i, (atom1, atom2) in enumerate(bonds.atoms.tolist(), 1):
+            expected.append(f"    ${i} bond_{atom1}_{atom2} ${atom1} ${atom2}\n")
+        expected.append('  }\n')
+        expected_xyz = ''.join(f"{name} {x:.6f} {y:.6f} {z:.6f}\n" for name, (x, y, z)
+                               in zip(table.atom_name_array(), positions.tolist()))
+
+        lt_file, xyz_file = self.temp_dir / "MOL.lt", self.temp_dir / "system.xyz"
+        generator = MoltemplateGenerator(self.logger, buffer_size=4096)
+        with mock.patch('generators.bulk_writer.open', create=True, side_effect=open) as opened:
+            with generator._open_output(lt_file) as f:
+                generator._write_atoms(f, atoms)
+                generator._write_bonds(f, InteractionView(bonds))
+            with generator._open_output(xyz_file) as f:
+                generator._write_xyz_table(f, table)
+        self.assertEqual([call.kwargs['buffering'] for call in opened.call_args_list], [4096, 4096])
+        self.assertEqual(lt_file.read_bytes(), ''.join(expected).encode())
+        self.assertEqual(xyz_file.read_bytes(), expected_xyz.encode())
+
+        class CountingWriter(io.StringIO):
+            def __init__(self):
+                super().__init__()
+                self.writes = 0
+
+            def write(self, text):
+                self.writes += 1
+                return super().write(text)
+
+        fmt = "%s %.6f %.6f %.6f\n"
+        columns = [table.atom_name_array(), positions[:, 0], positions[:, 1], positions[:, 2]]
+        lines = expected_xyz.splitlines(keepends=True)
+        for write, data in ((write_rows, columns), (write_fixed_rows, columns),
+                            (lambda f, _, rows, block_rows: write_lines(f, rows, block_rows), lines)):
+            out = CountingWriter()
+            write(out, fmt, data, block_rows=1000)
+            self.assertEqual(out.getvalue(), expected_xyz)
+            self.assertEqual(out.writes, 3)
+
+    def test_custom_ff_bonded_output_scales_linearly(self):
+        """测试成键项写出时间随原子数线性增长（10k到200k原子）"""
+        def emission_time(n_atoms, repeats=3):
+            atoms = [{'index': i, 'type': f"T{i % 7}", 'name': f"A{i}"}
+                     for i in range(1, n_atoms + 1)]
+            chain = np.arange(1, n_atoms, dtype=np.int32)
+            bonds = InteractionView(InteractionTable(
+                np.stack([chain, chain + 1], axis=1), np.ones(n_atoms - 1, dtype=np.int8),
+                np.zeros(n_atoms - 1, dtype=np.int32), np.zeros((1, 0)), np.zeros(1, dtype=np.int8)))
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                lookup = AtomLookup(atoms)
+                self.generator._write_bonds_for_custom_ff(io.StringIO(), bonds, lookup)
+                times.append(time.perf_counter() - start)
+            return min(times)
+
+        small = emission_time(10000)
+        large = emission_time(200000)
+        # 线性增长约为20倍，平方增长则为400倍
+        self.assertLess(large / small, 100)
+
+    def test_parallel_molecule_files(self):
+        """测试并行生成的分子.lt文件与串行逐字节一致"""
+        molecules = {}
+        for m, n_atoms in enumerate((40, 3, 200, 17, 5)):
+            atoms = [{'index': i, 'type': f"T{(i + m) % 4}", 'name': f"A{i}",
+                      'charge': 0.01 * i, 'mass': 12.0} for i in range(1, n_atoms + 1)]
+            chain = np.arange(1, n_atoms, dtype=np.int32)
+            bonds = InteractionView(InteractionTable(
+                np.stack([chain, chain + 1], axis=1), np.ones(n_atoms - 1, dtype=np.int8),
+                np.zeros(n_atoms - 1, dtype=np.int32), np.array([[0.1, 1000.0]]),
+                np.array([2], dtype=np.int8)))
+            molecules[f"MOL{m}"] = {'atoms': atoms, 'bonds': bonds}
+        system_data = {'molecules': molecules, 'global_force_field': {},
+                       'system_composition': [(name, 1) for name in molecules]}
+
+        for force_field, custom_ff in (({'type': 'custom'}, True), ({'type': 'generic'}, False),
+                                       ({'type': 'standard', 'name': 'gaff2'}, False)):
+            outputs = []
+            for jobs in (1, 3):
+                out_dir = self.temp_dir / f"{force_field['type']}_{jobs}"
+                MoltemplateGenerator(self.logger, jobs=jobs).generate_moltemplate_files(
+                    system_data, force_field, out_dir, "system", custom_ff=custom_ff)
+                outputs.append({path.name: path.read_bytes() for path in out_dir.iterdir()})
+            self.assertEqual(outputs[0], outputs[1])
+            self.assertIn("MOL2.lt", outputs[0])
+
+    def test_incremental_regeneration(self):
+        """测试增量生成：输入未变的文件不改写，只重写变化的分子文件"""
+        def molecule(n_atoms, charge):
+            atoms = [{'index': i, 'type': 'CT', 'name': f"C{i}", 'charge': charge,
+                      'x': 0.1 * i, 'y': 0.0, 'z': 0.0} for i in range(1, n_atoms + 1)]
+            return {'atoms': atoms}
+        system_data = {'molecules': {'A': molecule(4, 0.1), 'B': molecule(6, -0.2)},
+                       'global_force_field': {'atom_types': {
+                           'CT': {'name': 'CT', 'mass': 12.0, 'sigma': 0.34, 'epsilon': 0.36}}},
+                       'system_composition': [('A', 2), ('B', 1)]}
+        out_dir = self.temp_dir / "incremental"
+
+        def generate(jobs=1):
+            generator = MoltemplateGenerator(self.logger, jobs=jobs, incremental=True)
+            generator.generate_moltemplate_files(system_data, {'type': 'custom'}, out_dir,
+                                                 "system", custom_ff=True)
+            return generator.manifest, {path.name: path.stat().st_mtime_ns
+                                        for path in out_dir.iterdir()}
+
+        manifest, first = generate()
+        self.assertIn("A.lt", manifest.written)
+        self.assertTrue((out_dir / "system.manifest.json").exists())
+        time.sleep(0.01)
+
+        manifest, second = generate()
+        self.assertEqual(manifest.written, [])
+        self.assertEqual(sorted(manifest.skipped), ["A.lt", "B.lt"])
+        self.assertEqual(first, second)
+
+        # 只修改分子B，且被外部改动的A.lt也会重新生成
+        system_data['molecules']['B'] = molecule(6, -0.3)
+        (out_dir / "A.lt").write_text("edited\n")
+        manifest, third = generate(jobs=2)
+        self.assertEqual(sorted(manifest.written), ["A.lt", "B.lt"])
+        self.assertIn("system.lt", manifest.unchanged)
+        self.assertEqual(third["system.lt"], first["system.lt"])
+        self.assertIn("-0.3", (out_dir / "B.lt").read_text())
+        self.assertEqual(sorted(p.name for p in out_dir.iterdir() if p.name.endswith('.tmp')), [])
+
+    def test_fixed_precision_coordinates(self):
+        """测试向量化定点格式化与%格式化逐字节一致，坐标按coordinate_precision写出"""
+        rng = np.random.default_rng(0)
+        values = np.concatenate([rng.normal(0, 100, 10000),
+                                 [0.0, -0.0, -1e-9, 0.5, 2.5, 9.9999995, -1234567.0000005]])
+        names = np.array(['C1', 'HW', 'OXYZ'], dtype=object)[np.arange(len(values)) % 3]
+        ids = np.arange(len(values)) - 5
+        for precision in (0, 3, 6):
+            fmt = f"%s %d %.{precision}f\n"
+            expected = ''.join(fmt % row for row in zip(names, ids.tolist(), values.tolist()))
+            self.assertEqual(format_rows(fmt, [names, ids, values]), expected)
+
+        table = CoordinateTable(np.ones(2, np.int32), np.zeros(2, np.int32), ['SOL'],
+                                np.array([0, 1], np.int32), ['OW', 'HW1'],
+                                np.array([1, 2], np.int32), np.array([[1.0, -2.5, 0.12345],
+                                                                      [10.0, 0.0, -0.0005]]))
+        out = io.StringIO()
+        MoltemplateGenerator(self.logger, coordinate_precision=3)._write_xyz_table(out, table)
+        self.assertEqual(out.getvalue(), "OW 1.000 -2.500 0.123\nHW1 10.000 0.000 -0.001\n")
+
+        # 非有限坐标回退到%格式化，字节串名称列同样按文本写出
+        table.positions[1, 1] = np.nan
+        out = io.StringIO()
+        MoltemplateGenerator(self.logger, coordinate_precision=3)._write_xyz_table(out, table)
+        self.assertEqual(out.getvalue(), "OW 1.000 -2.500 0.123\nHW1 10.000 nan -0.001\n")
+
+
+
+class TestLammpsDataWriter(unittest.TestCase):
+    """测试直接生成LAMMPS数据文件"""
+
+    def setUp(self):
+        """设置测试环境"""
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.logger = setup_logger(verbose=False)
+
+        itp_file = self.temp_dir / "water.itp"
+        itp_file.write_text(
+            "[ atomtypes ]\n"
+            "OW 8 15.999 0.0 A 0.315 0.636\n"
+            "HW 1 1.008 0.0 A 0.0 0.0\n"
+            "[ moleculetype ]\nWater 2\n"
+            "[ atoms ]\n"
+            "1 OW 1 WAT OW 1 -0.834 15.999\n"
+            "2 HW 1 WAT HW1 1 0.417 1.008\n"
+            "3 HW 1 WAT HW2 1 0.417 1.008\n"
+            "[ bonds ]\n1 2 1 0.1 345000\n1 3 1 0.1 345000\n"
+            "[ angles ]\n2 1 3 1 109.5 383\n"
+        )
+        top_file = self.temp_dir / "water.top"
+        top_file.write_text("[ system ]\nWater box\n[ molecules ]\nWater 3\n")
+        gro_lines = ["Water box", "9"]
+        for i in range(9):
+            name = ['OW', 'HW1', 'HW2'][i % 3]
+            gro_lines.append(f"{i // 3 + 1:5d}WATER{name:>5s}{i + 1:5d}"
+                             f"{0.1 * i:8.3f}{0.2:8.3f}{0.3:8.3f}")
+        gro_lines.append("   3.00000   3.00000   3.00000")
+        gro_file = self.temp_dir / "water.gro"
+        gro_file.write_text("\n".join(gro_lines) + "\n")
+
+        self.system_data = GromacsParser(self.logger).parse_system(
+            str(top_file), str(gro_file), itp_files=[str(itp_file)])
+
+    def tearDown(self):
+        """清理测试环境"""
+        shutil.rmtree(self.temp_dir)
+
+    def _read_sections(self, data_file):
+        """读取data文件中的各section（去掉注释）"""
+        sections = {}
+        current = None
+        for line in data_file.read_text().splitlines():
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            if line in ('Masses', 'Atoms', 'Velocities', 'Bonds', 'Angles', 'Dihedrals'):
+                current = sections[line] = []
+            elif current is not None:
+                current.append(line.split())
+        return sections
+
+    def test_equivalent_to_moltemplate_route(self):
+        """测试data文件与moltemplate路线的.lt定义逐项一致"""
+        out_dir = self.temp_dir / "out"
+        MoltemplateGenerator(self.logger).generate_moltemplate_files(
+            self.system_data, {'type': 'custom'}, out_dir, "system", custom_ff=True)
+        files = LammpsDataWriter(self.logger).write_data_files(self.system_data, out_dir, "system")
+
+        # 从.lt文件中读出原子与成键项（按原子名引用）
+        lt_atoms, lt_bonded = [], {'Bonds': [], 'Angles': []}
+        current = None
+        for line in (out_dir / "Water.lt").read_text().splitlines():
+            line = line.strip()
+            if line.startswith('write("Data '):
+                current = line.split('"')[1][5:]
+            elif line.startswith('$') and current == 'Atoms':
+                lt_atoms.append(line.split())
+            elif line.startswith('$') and current in lt_bonded:
+                lt_bonded[current].append(line.split())
+        names = [atom[0] for atom in lt_atoms]
+
+        sections = self._read_sections(files['data'])
+        settings = files['settings'].read_text()
+        type_names = {}
+        for line in settings.splitlines():
+            if line.startswith(('bond_coeff', 'angle_coeff')):
+                command, type_id = line.split()[:2]
+                type_names[(command, type_id)] = line.split('#')[1].strip()
+        mass_names = {}
+        for line in files['data'].read_text().split('Masses')[1].split('Atoms')[0].splitlines():
+            if '#' in line:
+                mass_names[line.split()[0]] = line.split('#')[1].strip()
+
+        atoms = sections['Atoms']
+        self.assertEqual(len(atoms), 9)
+        for i, atom in enumerate(atoms):
+            lt_atom = lt_atoms[i % 3]
+            self.assertEqual(int(atom[0]), i + 1)
+            self.assertEqual(int(atom[1]), i // 3 + 1)
+            self.assertEqual('@atom:' + mass_names[atom[2]], lt_atom[2])
+            self.assertAlmostEqual(float(atom[3]), float(lt_atom[3]), places=3)
+            self.assertAlmostEqual(float(atom[4]), i * 1.0, places=4)
+
+        for section, command in (('Bonds', 'bond_coeff'), ('Angles', 'angle_coeff')):
+            expected = []
+            for instance in range(3):
+                for row in lt_bonded[section]:
+                    ids = [names.index(ref) + 1 + 3 * instance for ref in row[2:]]
+                    expected.append((row[1].split(':')[1], ids))
+            actual = [(type_names[(command, row[1])], [int(x) for x in row[2:]])
+                      for row in sections[section]]
+            self.assertEqual(actual, expected)
+            self.assertEqual([int(row[0]) for row in sections[section]],
+                             list(range(1, len(expected) + 1)))
+
+        self.assertIn("pair_coeff 1 1 0.152008 3.150000  # OW", settings)
+
+    def test_collapse_identical_types(self):
+        """测试合并参数相同的类型：引用改写为保留的类型并写出映射报告"""
+        global_ff = self.system_data['global_force_field']
+        self.system_data['molecules']['Water']['atoms'][2]['type'] = 'HX'
+        global_ff['atom_types']['HX'] = dict(global_ff['atom_types']['HW'])
+        global_ff['bond_types']['HX-OW'] = dict(global_ff['bond_types']['HW-OW'], atom1='HX')
+        angle = global_ff['angle_types']['HW-OW-HW']
+        global_ff['angle_types']['HW-OW-HX'] = dict(angle, atom3='HX')
+        global_ff['angle_types']['HX-OW-HX'] = dict(angle, atom1='HX', atom3='HX',
+                                                    parameters=[109.5, 400.0])
+
+        out_dir = self.temp_dir / "out"
+        force_field_data = ForceFieldManager(self.logger).process_force_field(
+            self.system_data, custom_ff=True)
+        aliases = ForceFieldManager(self.logger).collapse_identical_types(
+            self.system_data, force_field_data, out_dir, "system")
+
+        self.assertEqual(aliases, {'atom_types': {'HX': 'HW'}, 'bond_types': {'HX-OW': 'HW-OW'},
+                                   'angle_types': {'HW-OW-HX': 'HW-OW-HW'}})
+        self.assertEqual(list(force_field_data['angle_types']), ['HW-OW-HW', 'HX-OW-HX'])
+        self.assertIn("HX-OW -> HW-OW", (out_dir / "system.type_map").read_text())
+
+        files = LammpsDataWriter(self.logger).write_data_files(self.system_data, out_dir, "system")
+        sections = self._read_sections(files['data'])
+        self.assertEqual({row[2] for row in sections['Atoms']}, {'1', '2'})
+        self.assertEqual({row[1] for row in sections['Bonds']}, {'1'})
+        self.assertEqual({row[1] for row in sections['Angles']}, {'1'})
+        self.assertNotIn("HW-OW-HX", files['settings'].read_text())
+
+        MoltemplateGenerator(self.logger).generate_moltemplate_files(
+            self.system_data, force_field_data, out_dir, "system", custom_ff=True)
+        molecule = (out_dir / "Water.lt").read_text()
+        self.assertNotIn("HX", molecule)
+        self.assertEqual(molecule.count("@bond:HW-OW"), 2)
+        self.assertNotIn("@bond:HX-OW", (out_dir / "system_forcefield.lt").read_text())
+
+    def test_identical_molecule_definitions(self):
+        """测试拓扑相同的分子只生成一份定义，系统文件中以别名实例化"""
+        molecules = self.system_data['molecules']
+        water = molecules['Water']
+        molecules['WaterB'] = dict(water, atoms=[dict(atom) for atom in water['atoms']])
+        molecules['WaterC'] = dict(water, atoms=[dict(atom) for atom in water['atoms']])
+        molecules['WaterC']['atoms'][0]['charge'] = -0.8
+        self.system_data['system_composition'] = [('Water', 1), ('WaterB', 1), ('WaterC', 1)]
+
+        self.assertEqual(molecule_aliases(molecules),
+                         {'Water': 'Water', 'WaterB': 'Water', 'WaterC': 'WaterC'})
+
+        out_dir = self.temp_dir / "out"
+        MoltemplateGenerator(self.logger).generate_moltemplate_files(
+            self.system_data, {'type': 'custom'}, out_dir, "system", custom_ff=True)
+        self.assertFalse((out_dir / "WaterB.lt").exists())
+        self.assertTrue((out_dir / "WaterC.lt").exists())
+        system_lt = (out_dir / "system.lt").read_text()
+        self.assertNotIn('import "WaterB.lt"', system_lt)
+        self.assertIn("waterbs = new Water [1]", system_lt)
+        self.assertIn("watercs = new WaterC [1]", system_lt)
+
+        files = LammpsDataWriter(self.logger).write_data_files(self.system_data, out_dir, "system")
+        atoms = self._read_sections(files['data'])['Atoms']
+        self.assertEqual([row[3] for row in atoms[::3]], ['-0.834000', '-0.834000', '-0.800000'])
+
+    def test_stream_coordinates(self):
+        """测试流式坐标与一次性读取的结果相同"""
+        out_dir = self.temp_dir / "out"
+        writer = LammpsDataWriter(self.logger)
+        expected = writer.write_data_files(self.system_data, out_dir, "full")['data'].read_text()
+
+        table = self.system_data.pop('coordinate_table')
+        self.system_data['coordinate_chunks'] = iter([table])
+        self.system_data['n_coordinates'] = len(table)
+        streamed = writer.write_data_files(self.system_data, out_dir, "stream")['data'].read_text()
+        self.assertEqual(streamed, expected)
+
+        self.system_data['coordinate_chunks'] = iter([])
+        self.system_data['n_coordinates'] = 8
+        with self.assertRaises(ValueError):
+            writer.write_data_files(self.system_data, out_dir, "bad")
+
+    def test_missing_pair_coeff_warning(self):
+        """测试用到但没有非键参数的原子类型在写出前给出警告"""
+        del self.system_data['global_force_field']['atom_types']['HW']
+        with self.assertLogs(self.logger, level='WARNING') as logs:
+            files = LammpsDataWriter(self.logger).write_data_files(
+                self.system_data, self.temp_dir / "out", "system")
+        self.assertTrue(any("没有非键参数" in line and "HW" in line for line in logs.output))
+        self.assertEqual(files['settings'].read_text().count("pair_coeff"), 1)
+
+    def test_chunked_instances(self):
+        """测试按chunk_size切分实例块后data文件不变，流式坐标也按块对齐"""
+        out_dir = self.temp_dir / "out"
+        whole = LammpsDataWriter(self.logger).write_data_files(
+            self.system_data, out_dir, "whole")['data'].read_bytes()
+        chunked = LammpsDataWriter(self.logger, chunk_size=4).write_data_files(
+            self.system_data, out_dir, "chunked")['data'].read_bytes()
+        self.assertEqual(chunked, whole)
+
+        stream_data = GromacsParser(self.logger).parse_system(
+            str(self.temp_dir / "water.top"), str(self.temp_dir / "water.gro"),
+            itp_files=[str(self.temp_dir / "water.itp")], stream_coordinates=True, chunk_size=2)
+        streamed = LammpsDataWriter(self.logger, chunk_size=2).write_data_files(
+            stream_data, out_dir, "streamed")['data'].read_bytes()
+        self.assertEqual(streamed, whole)
+
+        template = SimpleNamespace(n_atoms=3)
+        blocks = _split_instances([(template, 1000000)], 1000000)
+        self.assertEqual({count for _, count in blocks}, {333333, 1})
+        self.assertEqual(sum(count for _, count in blocks), 1000000)
+
+    def test_refresh_coordinates(self):
+        """测试只刷新data文件的坐标与盒子，其余section逐字节不变"""
+        out_dir = self.temp_dir / "out"
+        data_file = LammpsDataWriter(self.logger).write_data_files(
+            self.system_data, out_dir, "system")['data']
+        original = data_file.read_bytes()
+        original_atoms = self._read_sections(data_file)['Atoms']
+
+        gro_lines = ["Water box frame 2", "9"]
+        for i in range(9):
+            name = ['OW', 'HW1', 'HW2'][i % 3]
+            gro_lines.append(f"{i // 3 + 1:5d}WATER{name:>5s}{i + 1:5d}"
+                             f"{0.1 * i + 0.05:8.3f}{-0.2:8.3f}{1.25:8.3f}")
+        gro_lines.append("   3.50000   3.00000   3.00000")
+        new_gro = self.temp_dir / "frame2.gro"
+        new_gro.write_text("\n".join(gro_lines) + "\n")
+
+        result = DataCoordinateRefresher(self.logger, block_rows=4).refresh(
+            str(data_file), str(new_gro))
+        self.assertEqual(result, {'atoms': 9, 'box': True})
+        refreshed = data_file.read_bytes()
+        self.assertEqual(refreshed.split(b"\nBonds")[1], original.split(b"\nBonds")[1])
+        self.assertIn(b"0.000000 35.000000 xlo xhi", refreshed)
+
+        atoms = self._read_sections(data_file)['Atoms']
+        self.assertEqual(len(atoms), 9)
+        for i, atom in enumerate(atoms):
+            self.assertEqual(atom[:4], original_atoms[i][:4])
+            self.assertEqual(atom[4:], [f"{i + 0.5:.6f}", "-2.000000", "12.500000"])
+
+        # 保留原有的盒子原点
+        data_file.write_bytes(refreshed.replace(b"0.000000 35.000000 xlo xhi",
+                                                b"-1.500000 30.000000 xlo xhi"))
+        DataCoordinateRefresher(self.logger).refresh(str(data_file), str(new_gro))
+        self.assertIn(b"-1.500000 33.500000 xlo xhi", data_file.read_bytes())
+
+        # 多MODEL的PDB：第0帧与其他帧按同一路径只读取各自的MODEL
+        pdb_lines = ["CRYST1   35.000   30.000   30.000  90.00  90.00  90.00 P 1           1"]
+        for model in (1, 2):
+            pdb_lines.append(f"MODEL     {model:4d}")
+            for i in range(9):
+                name = ['OW', 'HW1', 'HW2'][i % 3]
+                pdb_lines.append(f"ATOM  {i + 1:5d} {name:<4s} WAT A{i // 3 + 1:4d}    "
+                                 f"{float(i):8.3f}{float(model):8.3f}{0.0:8.3f}  1.00  0.00")
+            pdb_lines.append("ENDMDL")
+        pdb_file = self.temp_dir / "models.pdb"
+        pdb_file.write_text("\n".join(pdb_lines) + "\nEND\n")
+        for frame in (0, 1):
+            DataCoordinateRefresher(self.logger).refresh(str(data_file), str(pdb_file), frame=frame)
+            atoms = self._read_sections(data_file)['Atoms']
+            self.assertEqual(atoms[4][4:], ["4.000000", f"{frame + 1.0:.6f}", "0.000000"])
+        refreshed = data_file.read_bytes()
+
+        # 原子数不一致时不改动原文件
+        gro_lines[1] = "8"
+        del gro_lines[-2]
+        new_gro.write_text("\n".join(gro_lines) + "\n")
+        with self.assertRaises(ValueError):
+            DataCoordinateRefresher(self.logger).refresh(str(data_file), str(new_gro))
+        self.assertEqual(data_file.read_bytes(), refreshed)
+        self.assertEqual([p.name for p in out_dir.iterdir() if p.name.endswith('.tmp')], [])
+
+    def test_write_all_frames(self):
+        """测试多帧.gro/.pdb按帧偏移逐帧输出（拓扑与data文件只生成一次）"""
+        out_dir = self.temp_dir / "out"
+        data_file = LammpsDataWriter(self.logger).write_data_files(
+            self.system_data, out_dir, "system")['data']
+
+        gro_lines = []
+        pdb_lines = ["CRYST1   30.000   30.000   30.000  90.00  90.00  90.00 P 1           1"]
+        for frame in range(3):
+            gro_lines += [f"Water box t= {frame}.0", "9"]
+            pdb_lines.append(f"MODEL     {frame + 1:4d}")
+            for i in range(9):
+                name = ['OW', 'HW1', 'HW2'][i % 3]
+                gro_lines.append(f"{i // 3 + 1:5d}WATER{name:>5s}{i + 1:5d}"
+                                 f"{0.1 * i:8.3f}{0.1 * frame:8.3f}{1.0:8.3f}")
+                pdb_lines.append(f"ATOM  {i + 1:5d} {name:<4s} WAT  {i // 3 + 1:4d}    "
+                                 f"{i:8.3f}{frame:8.3f}{10.0:8.3f}  1.00  0.00")
+            gro_lines.append(f"   {3.0 + frame:.5f}   3.00000   3.00000")
+            pdb_lines.append("ENDMDL")
+        gro_file = self.temp_dir / "traj.gro"
+        gro_file.write_text("\n".join(gro_lines) + "\n\n")
+        pdb_file = self.temp_dir / "traj.pdb"
+        pdb_file.write_text("\n".join(pdb_lines + ["END"]) + "\n")
+
+        offsets = index_coordinate_frames(str(gro_file))
+        self.assertEqual(len(offsets), 3)
+        self.assertEqual(read_gro_table(str(gro_file))['title'], "Water box t= 0.0")
+        self.assertEqual(read_gro_table(str(gro_file), offset=offsets[2])['box_vectors'],
+                         [50.0, 30.0, 30.0])
+
+        outputs = FrameWriter(self.logger, jobs=2).write_frames(
+            str(gro_file), out_dir, "system", n_atoms=9, data_file=data_file)
+        self.assertEqual([p.name for p in outputs],
+                         ["system_frame0.data", "system_frame1.data", "system_frame2.data"])
+        for frame, path in enumerate(outputs):
+            atoms = self._read_sections(path)['Atoms']
+            self.assertEqual([atom[5] for atom in atoms], [f"{frame:.6f}"] * 9)
+            self.assertIn(f"0.000000 {30.0 + 10 * frame:.6f} xlo xhi".encode(), path.read_bytes())
+
+        # 多MODEL的PDB：默认只读取第一个MODEL，其余MODEL逐帧写为xyz
+        self.assertEqual(read_pdb_header(str(pdb_file))['n_atoms'], 9)
+        outputs = FrameWriter(self.logger).write_frames(str(pdb_file), out_dir, "system", n_atoms=9)
+        self.assertEqual(len(outputs), 3)
+        lines = outputs[2].read_text().splitlines()
+        self.assertEqual(lines[0], "9")
+        self.assertEqual(lines[3], "HW1 1.000000 2.000000 10.000000")
+
+        with self.assertRaises(ValueError):
+            FrameWriter(self.logger).write_frames(str(pdb_file), out_dir, "system", n_atoms=8)
+
+    def _write_trr(self, path, frames, real='>f4'):
+        """按GROMACS的XDR格式写出未压缩的.trr（frames: (坐标, 速度或None, 盒子边长)）"""
+        with open(path, 'wb') as f:
+            for step, (x, v, box) in enumerate(frames):
+                x = np.asarray(x, dtype=real)
+                v = None if v is None else np.asarray(v, dtype=real)
+                size = np.dtype(real).itemsize
+                f.write(np.array([1993, 13, 12], dtype='>i4').tobytes() + b"GMX_trn_file")
+                f.write(np.array([0, 0, 9 * size, 0, 0, 0, 0, x.size * size,
+                                  0 if v is None else v.size * size, 0, len(x), step * 100, 0],
+                                 dtype='>i4').tobytes())
+                f.write(np.array([step * 0.2, 0.0], dtype=real).tobytes())
+                f.write(np.diag(box).astype(real).tobytes() + x.tobytes())
+                if v is not None:
+                    f.write(v.tobytes())
+
+    def test_trr_frame(self):
+        """测试.trr帧的解码、按帧号读取以及速度写入data文件"""
+        x = np.array([[0.1 * i, 0.2, 0.3] for i in range(9)])
+        v = np.array([[0.5, -0.25, 0.125 * i] for i in range(9)])
+        trr_file = self.temp_dir / "traj.trr"
+        self._write_trr(trr_file, [(x, None, [3.0] * 3), (x + 1.0, v, [3.5, 3.0, 3.0])])
+        # 末尾不完整的帧（轨迹仍在写出）不计入
+        with open(trr_file, 'ab') as f:
+            f.write(np.array([1993, 13], dtype='>i4').tobytes())
+
+        offsets = index_coordinate_frames(str(trr_file))
+        self.assertEqual(len(offsets), 2)
+        frame = read_coordinate_frame(str(trr_file), offsets[1])
+        np.testing.assert_allclose(frame['positions'], (x + 1.0) * 10, rtol=1e-6)
+        np.testing.assert_allclose(frame['velocities'], v * 0.01, rtol=1e-6)
+        self.assertEqual(frame['box_vectors'], [35.0, 30.0, 30.0])
+
+        double_file = self.temp_dir / "double.trr"
+        self._write_trr(double_file, [(x, v, [3.0] * 3)], real='>f8')
+        frame = read_coordinate_frame(str(double_file), 0)
+        np.testing.assert_array_equal(frame['positions'], x * 10)
+
+        # 拓扑解析一次，坐标与速度取最后一帧，原子名按拓扑展开
+        system_data = GromacsParser(self.logger).parse_system(
+            str(self.temp_dir / "water.top"), str(trr_file),
+            itp_files=[str(self.temp_dir / "water.itp")], frame=-1)
+        table = system_data['coordinate_table']
+        self.assertEqual(table.atom_name_array().tolist(), ['OW', 'HW1', 'HW2'] * 3)
+        self.assertEqual(table.residue_numbers.tolist(), [1, 1, 1, 2, 2, 2, 3, 3, 3])
+        self.assertEqual(system_data['box_vectors'], [35.0, 30.0, 30.0])
+
+        out_dir = self.temp_dir / "out"
+        data_file = LammpsDataWriter(self.logger).write_data_files(
+            system_data, out_dir, "system")['data']
+        sections = self._read_sections(data_file)
+        self.assertEqual(sections['Atoms'][2][4:], ["12.000000", "12.000000", "13.000000"])
+        self.assertEqual(sections['Velocities'][3],
+                         ["4", "0.0050000000", "-0.0025000000", "0.0037500000"])
+
+        # 刷新坐标时插入（或替换已有的）Velocities section
+        gro_data = LammpsDataWriter(self.logger).write_data_files(
+            self.system_data, out_dir, "gro")['data']
+        original = gro_data.read_bytes()
+        refresher = DataCoordinateRefresher(self.logger, block_rows=4)
+        for _ in range(2):
+            refresher.refresh(str(gro_data), str(trr_file), frame=1)
+            refreshed = self._read_sections(gro_data)
+            self.assertEqual(refreshed['Velocities'], sections['Velocities'])
+            self.assertEqual(refreshed['Atoms'], sections['Atoms'])
+            self.assertEqual(gro_data.read_bytes().count(b"Velocities"), 1)
+            self.assertEqual(gro_data.read_bytes().split(b"\nBonds")[1],
+                             original.split(b"\nBonds")[1])
+
+        with self.assertRaises(ValueError):
+            read_coordinate_frame(str(trr_file), offsets[1] + 4)
+        with self.assertRaises(ValueError):
+            GromacsParser(self.logger).parse_system(
+                str(self.temp_dir / "water.top"), str(trr_file),
+                itp_files=[str(self.temp_dir / "water.itp")], frame=2)
+
+class TestStandardForceFieldDataWriter(unittest.TestCase):
+    """测试标准力场直接生成LAMMPS数据文件"""
+
+    def setUp(self):
+        """设置测试环境"""
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.logger = setup_logger(verbose=False)
+
+    def tearDown(self):
+        """清理测试环境"""
+        shutil.rmtree(self.temp_dir)
+
+    def _molecule(self, types, bonds):
+        atoms = [{'index': i, 'type': t, 'charge': 0.0} for i, t in enumerate(types, 1)]
+        bonds = [{'atom1': a, 'atom2': b, 'function_type': 1, 'parameters': []} for a, b in bonds]
+        return {'atoms': atoms, 'bonds': bonds}
+
+    def test_force_field_index(self):
+        """测试力场索引：By Type规则按后出现优先匹配，并支持通配符"""
+        ff = load_force_field(str(GAFF2_FILE))
+        self.assertEqual(ff.masses['c3'], 12.01)
+        self.assertEqual(ff.rules['bond'].match(('hc', 'c3')), 'c3-hc')
+        self.assertEqual(ff.rules['angle'].match(('c3', 'c3', 'hc')), 'c3-c3-hc')
+        self.assertEqual(ff.rules['dihedral'].match(('hc', 'c3', 'c3', 'hc')), 'hc-c3-c3-hc')
+        self.assertEqual(ff.rules['improper'].match(('ca', 'ca', 'ca', 'ha')), 'X-X-ca-ha')
+        self.assertEqual(ff.improper_center, 2)
+        self.assertIs(load_force_field(str(GAFF2_FILE)), ff)
+
+    def test_ethane(self):
+        """测试由键推断角度和二面角，并只输出用到的类型参数"""
+        ethane = self._molecule(['c3', 'hc', 'hc', 'hc', 'c3', 'hc', 'hc', 'hc'],
+                                [(1, 2), (1, 3), (1, 4), (1, 5), (5, 6), (5, 7), (5, 8)])
+        system_data = {'molecules': {'ETH': ethane}, 'system_composition': [('ETH', 2)],
+                       'box_vectors': [30.0, 30.0, 30.0]}
+        writer = StandardForceFieldDataWriter(self.logger, 'force_fields/gaff2.lt')
+        files = writer.write_data_files(system_data, self.temp_dir, "ethane")
+
+        data = files['data'].read_text()
+        for line in ("16 atoms", "14 bonds", "24 angles", "18 dihedrals", "0 impropers",
+                     "2 atom types", "2 bond types", "2 angle types", "1 dihedral types"):
+            self.assertIn(line, data)
+
+        settings = files['settings'].read_text()
+        self.assertIn("bond_coeff 1 harmonic 375.9 1.0970  # c3-hc", settings)
+        self.assertIn("bond_coeff 2 harmonic 232.5 1.5380  # c3-c3", settings)
+        self.assertIn("dihedral_coeff 1 fourier 1 0.12 3 0.0  # hc-c3-c3-hc", settings)
+        self.assertEqual(settings.count("pair_coeff"), 2)
+        self.assertIn("units           real", files['init'].read_text())
+
+    def test_generated_topology(self):
+        """测试由邻接表向量化生成的角度/二面角/improper与逐个枚举的结果一致"""
+        rng = np.random.default_rng(2)
+        n_atoms = 60
+        bond_rows = np.concatenate([
+            np.stack([np.arange(1, n_atoms), rng.integers(0, np.arange(1, n_atoms))], axis=1),
+            [[0, 1], [5, 5], [2, 1], [7, 3]],
+        ])
+        bonds, indptr, neighbors = bond_graph(bond_rows, n_atoms)
+        pairs = {tuple(sorted(b)) for b in bond_rows.tolist() if b[0] != b[1]}
+        self.assertEqual(sorted(tuple(sorted(b)) for b in bonds.tolist()), sorted(pairs))
+        nbrs = [sorted({b for a, b in pairs if a == atom} | {a for a, b in pairs if b == atom})
+                for atom in range(n_atoms)]
+        self.assertEqual(neighbors.tolist(), [n for atom in nbrs for n in atom])
+
+        self.assertEqual(angle_rows(indptr, neighbors).tolist(),
+                         [[i, j, k] for j, ns in enumerate(nbrs) for i, k in combinations(ns, 2)])
+        self.assertEqual(dihedral_rows(indptr, neighbors).tolist(),
+                         [[i, j, k, l] for j, ns in enumerate(nbrs) for k in ns if k > j
+                          for i in ns if i != k for l in nbrs[k] if l != j and l != i])
+        centers, leaves = improper_candidates(indptr, neighbors)
+        self.assertEqual([[c] + row for c, row in zip(centers.tolist(), leaves.tolist())],
+                         [[c] + list(t) for c, ns in enumerate(nbrs) for t in combinations(ns, 3)])
+
+    def test_impropers_and_unknown_types(self):
+        """测试improper按中心原子位置匹配，未知原子类型报错"""
+        writer = StandardForceFieldDataWriter(self.logger, 'force_fields/gaff2.lt')
+        tables = writer._build_type_tables({})
+        template = writer._build_template(
+            'ARO', self._molecule(['ca', 'ca', 'ca', 'ha'], [(1, 2), (1, 3), (1, 4)]), tables)
+        rows, type_ids = template.bonded['impropers']
+        self.assertEqual(rows.tolist(), [[1, 2, 0, 3]])
+        self.assertEqual(tables['improper_types'].coeffs['X-X-ca-ha'], ['cvff 1.1 -1 2'])
+
+        with self.assertRaises(ValueError):
+            writer._build_template('BAD', self._molecule(['c3', 'XX'], [(1, 2)]), tables)
+
 
 class TestIntegration(unittest.TestCase):
     """集成测试"""
@@ -228,9 +1374,9 @@ Water 1
         
         gro_content = """Test System
 3
-    1WATER     OW    1   1.000   1.000   1.000
-    1WATER    HW1    2   1.100   1.000   1.000
-    1WATER    HW2    3   0.900   1.000   1.000
+    1WATER   OW    1   1.000   1.000   1.000
+    1WATER  HW1    2   1.100   1.000   1.000
+    1WATER  HW2    3   0.900   1.000   1.000
    3.000   3.000   3.000
 """
         
@@ -279,6 +1425,7 @@ def run_tests():
     
     # 添加测试用例
     test_suite.addTest(unittest.makeSuite(TestGromacsParser))
+    test_suite.addTest(unittest.makeSuite(TestTopologyCache))
     test_suite.addTest(unittest.makeSuite(TestForceFieldManager))
     test_suite.addTest(unittest.makeSuite(TestMoltemplateGenerator))
     test_suite.addTest(unittest.makeSuite(TestIntegration))
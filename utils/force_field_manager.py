@@ -4,9 +4,59 @@
 处理不同类型的力场（通用和自定义）
 """
 
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 
+import numpy as np
+
+from generators.lammps_data_writer import COEFF_FORMATTERS, UNIT_CONVERSIONS
+from parsers.bonded_parameters import TYPE_TABLES
+from parsers.interaction_table import INTERACTION_ATOMS, as_interaction_table, canonical_type_table
+from parsers.lt_force_field import load_force_field, resolve_force_field_file
+
+# GROMACS [ dihedrals ] 中表示improper的函数类型
+IMPROPER_FUNCTION_TYPES = (2, 4)
+
+# 可合并的类型表 -> 类型名中的原子数（原子类型为0）
+COLLAPSIBLE_TYPES = {'atom_types': 0, 'bond_types': 2, 'angle_types': 3, 'dihedral_types': 4}
+
+
+def converted_parameters(ff_type: str, data: Dict) -> Optional[Tuple[Tuple, List[float]]]:
+    """类型写出到LAMMPS时的参数：返回(分组键, 参数值)，没有可写出的参数时返回None"""
+    if ff_type == 'atom_types':
+        return ('atom',), [data.get('mass', 1.0) * UNIT_CONVERSIONS['mass'],
+                           data.get('epsilon', 0.0) * UNIT_CONVERSIONS['epsilon'],
+                           data.get('sigma', 0.0) * UNIT_CONVERSIONS['sigma']]
+    coeff = COEFF_FORMATTERS[ff_type](data)
+    if coeff is None:
+        return None
+    values = coeff[1].split()
+    return (data.get('function_type', 1), len(values)), [float(x) for x in values]
+
+
+def identical_type_aliases(values: Dict[str, Tuple[Tuple, List[float]]],
+                           tolerance: float) -> Dict[str, str]:
+    """参数在容差内相同的类型 -> 先出现的同参数类型
+    
+    按分组键分组后，每个类型与已保留的类型整体比较一次（numpy按行比较）。
+    """
+    aliases = {}
+    kept: Dict[Tuple, Tuple[List[str], List[List[float]]]] = {}
+    for name, (key, params) in values.items():
+        names, rows = kept.setdefault(key, ([], []))
+        if rows:
+            reference = np.asarray(rows)
+            vector = np.asarray(params)
+            close = np.abs(reference - vector) <= tolerance * np.maximum(1.0, np.abs(vector))
+            match = np.flatnonzero(close.all(axis=1))
+            if len(match):
+                aliases[name] = names[match[0]]
+                continue
+        names.append(name)
+        rows.append(params)
+    return aliases
+
+
 class ForceFieldManager:
     """力场管理器"""
     
@@ -79,6 +129,80 @@ class ForceFieldManager:
             'description': ff_info['description']
         }
     
+    def subset_force_field(self, system_data: Dict, force_field_data: Dict,
+                           output_dir: Path, output_name: str) -> Dict:
+        """生成只包含体系所用原子类型的精简力场文件
+        
+        返回的力场信息中file指向精简文件（相对于输出目录），
+        原力场文件记录在source_file中。
+        """
+        
+        source_file = resolve_force_field_file(force_field_data['file'])
+        force_field = load_force_field(str(source_file))
+        
+        atom_types = sorted({
+            atom['type']
+            for mol_data in system_data['molecules'].values()
+            for atom in mol_data.get('atoms', [])
+        })
+        missing = [t for t in atom_types if force_field.full_type(t) not in force_field.masses]
+        if missing:
+            self.logger.warning(f"以下原子类型不在力场 {force_field_data['name']} 中: {missing}")
+        
+        output_dir.mkdir(exist_ok=True)
+        subset_file = output_dir / f"{output_name}_{force_field_data['name']}.lt"
+        n_lines, n_kept = force_field.write_subset(atom_types, subset_file)
+        self.logger.info(f"生成精简力场文件: {subset_file} "
+                         f"({len(atom_types)} 种原子类型, {n_kept}/{n_lines} 行)")
+        
+        return dict(force_field_data, file=subset_file.name, source_file=str(source_file))
+    
+    def collapse_identical_types(self, system_data: Dict, force_field_data: Dict,
+                                 output_dir: Path, output_name: str,
+                                 tolerance: float = 1e-6) -> Dict[str, Dict[str, str]]:
+        """合并换算后参数相同的原子、键、角度和二面角类型
+        
+        参数按写出时的单位与精度比较，各分量的差不超过tolerance×max(1, |值|)
+        即视为相同，保留先定义的类型。被合并的类型从全局力场中删除，
+        类型名 -> 保留类型名的映射记录在system_data['type_aliases']中，
+        各写出器据此改写相互作用引用的类型；映射同时写出到{output_name}.type_map。
+        """
+        
+        global_ff = system_data.setdefault('global_force_field', {})
+        type_aliases = system_data.setdefault('type_aliases', {})
+        
+        for ff_type, n_atoms in COLLAPSIBLE_TYPES.items():
+            types = global_ff.get(ff_type)
+            if not types:
+                continue
+            if n_atoms:
+                types = canonical_type_table(types, n_atoms)
+            values = {}
+            for name, data in types.items():
+                converted = converted_parameters(ff_type, data)
+                if converted is not None:
+                    values[name] = converted
+            aliases = identical_type_aliases(values, tolerance)
+            if not aliases:
+                continue
+            global_ff[ff_type] = {name: data for name, data in types.items() if name not in aliases}
+            if ff_type in force_field_data:
+                force_field_data[ff_type] = dict(global_ff[ff_type])
+            type_aliases.setdefault(ff_type, {}).update(aliases)
+            self.logger.info(f"合并参数相同的{ff_type}: {len(types)} -> {len(global_ff[ff_type])}")
+        
+        output_dir.mkdir(exist_ok=True)
+        report_file = output_dir / f"{output_name}.type_map"
+        with open(report_file, 'w') as f:
+            f.write(f"# 参数相同（容差 {tolerance:g}）而被合并的类型: 原类型 -> 保留的类型\n")
+            for ff_type, aliases in type_aliases.items():
+                f.write(f"\n[ {ff_type} ]\n")
+                for name, kept in aliases.items():
+                    f.write(f"{name} -> {kept}\n")
+        self.logger.info(f"生成类型合并报告: {report_file}")
+        
+        return type_aliases
+    
     def _process_custom_force_field(self, system_data: Dict) -> Dict:
         """处理自定义力场"""
         
@@ -127,6 +251,11 @@ class ForceFieldManager:
                     if ff_type in mol_global_ff:
                         force_field_data[ff_type].update(mol_global_ff[ff_type])
         
+        # 成键类型按规范名称重建，合并正反方向重复的类型
+        for section, ff_type in TYPE_TABLES.items():
+            force_field_data[ff_type] = canonical_type_table(
+                force_field_data[ff_type], INTERACTION_ATOMS[section])
+        
         # 统计力场参数
         n_atom_types = len(force_field_data['atom_types'])
         n_bond_types = len(force_field_data['bond_types'])
@@ -161,9 +290,97 @@ class ForceFieldManager:
             self.logger.warning(f"缺少以下原子类型的力场参数: {unique_missing}")
             return False
         
+        if force_field_data['type'] == 'standard':
+            if not self._validate_standard_force_field(system_data, force_field_data):
+                return False
+        
+        # 检查成键相互作用引用的原子是否都已定义
+        dangling = False
+        for mol_name, mol_data in system_data['molecules'].items():
+            if not mol_data.get('atoms'):
+                continue
+            atom_indices = np.array([atom['index'] for atom in mol_data['atoms']])
+            for section, n_atoms in INTERACTION_ATOMS.items():
+                table = as_interaction_table(mol_data.get(section), n_atoms)
+                if not len(table):
+                    continue
+                n_bad = int(np.count_nonzero(~np.isin(table.atoms, atom_indices).all(axis=1)))
+                if n_bad:
+                    self.logger.warning(f"分子 {mol_name} 的 [ {section} ] 中有 {n_bad} 项引用了未定义的原子")
+                    dangling = True
+        
+        if dangling:
+            return False
+        
         self.logger.info("力场兼容性检查通过")
         return True
     
+    def _validate_standard_force_field(self, system_data: Dict, force_field_data: Dict) -> bool:
+        """按力场索引检查原子类型和成键参数是否齐全
+        
+        原子类型缺失或键没有匹配的By Type规则/bond_coeff时返回False；
+        拓扑中列出的角度和二面角没有参数时只给出警告（moltemplate会跳过它们）。
+        """
+        
+        force_field = load_force_field(str(resolve_force_field_file(
+            force_field_data.get('source_file', force_field_data['file']))))
+        ff_name = force_field_data['name']
+        
+        missing_types = sorted({
+            atom['type']
+            for mol_data in system_data['molecules'].values()
+            for atom in mol_data.get('atoms', [])
+            if force_field.full_type(atom['type']) not in force_field.masses
+        })
+        if missing_types:
+            self.logger.warning(f"力场 {ff_name} 中没有以下原子类型: {missing_types}")
+            return False
+        
+        # 成键种类 -> {原子类型组合: 说明}
+        problems = {kind: {} for kind in ('bond', 'angle', 'dihedral')}
+        for mol_data in system_data['molecules'].values():
+            type_of = {atom['index']: atom['type'] for atom in mol_data.get('atoms', [])}
+            for kind in problems:
+                section = f"{kind}s"
+                table = as_interaction_table(mol_data.get(section), INTERACTION_ATOMS[section])
+                if not len(table):
+                    continue
+                rows = table.atoms
+                if kind == 'dihedral':
+                    # GROMACS中函数类型2和4为improper
+                    rows = rows[~np.isin(table.function_types, IMPROPER_FUNCTION_TYPES)]
+                for row in np.unique(rows, axis=0).tolist():
+                    if not all(i in type_of for i in row):
+                        continue
+                    types = tuple(type_of[i] for i in row)
+                    if types in problems[kind]:
+                        continue
+                    problem = self._check_bonded_parameters(force_field, kind, types)
+                    if problem:
+                        problems[kind][types] = problem
+        
+        for kind, found in problems.items():
+            for types, problem in sorted(found.items()):
+                self.logger.warning(f"{kind} {'-'.join(types)}: {problem}")
+        
+        if problems['bond']:
+            self.logger.warning(f"力场 {ff_name} 缺少 {len(problems['bond'])} 种键的参数")
+            return False
+        return True
+    
+    def _check_bonded_parameters(self, force_field, kind: str, types) -> Optional[str]:
+        """原子类型组合在力场中缺少参数时返回说明"""
+        
+        rules = force_field.rules[kind]
+        position = rules.match_position(tuple(force_field.full_type(t) for t in types))
+        if position is None:
+            return f"没有匹配的By Type规则 ({force_field.path.name})"
+        name = rules.names[position]
+        if name not in force_field.coeffs[kind]:
+            file_name, lineno = rules.locations[position] or (force_field.path.name, 0)
+            return f"规则 {name} ({file_name}:{lineno}) 没有对应的{kind}_coeff"
+        return None
+    
     def get_atom_type_mapping(self, system_data: Dict, force_field_data: Dict) -> Dict[str, str]:
         """获取原子类型映射"""
         
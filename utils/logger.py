@@ -94,4 +94,24 @@ def get_memory_info():
         memory = psutil.virtual_memory()
         return f"{memory.total / (1024**3):.1f} GB"
     except ImportError:
-        return "未知 (需要安装psutil)" 
\ No newline at end of file
+        return "未知 (需要安装psutil)"
+
+
+def get_peak_memory() -> float:
+    """获取当前进程的峰值常驻内存（MB）"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux以KB为单位，macOS以字节为单位
+        if sys.platform == 'darwin':
+            return peak / (1024 ** 2)
+        return peak / 1024
+    except ImportError:
+        pass
+    
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / (1024 ** 2)
+    except ImportError:
+        return 0.0
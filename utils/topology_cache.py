@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+拓扑解析结果的磁盘缓存
+按文件内容哈希和解析器版本索引，使用LRU策略按总大小淘汰
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config import VERSION
+from parsers.topology_lexer import gc_paused
+from parsers.topology_preprocessor import file_digest
+
+# 解析结果结构变化时递增，使旧缓存自动失效
+TOPOLOGY_CACHE_FORMAT = 4
+
+CACHE_SUFFIX = '.topo.pkl'
+
+
+class TopologyCache:
+    """拓扑解析结果的持久化缓存"""
+
+    def __init__(self, cache_dir: str, max_size_mb: float = 2048, logger=None):
+        self.cache_dir = Path(cache_dir).expanduser()
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.logger = logger
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'stores': 0, 'evictions': 0}
+
+    def make_key(self, path: str, kind: str, include_dirs: List[str],
+                 defines: Dict[str, List[str]]) -> str:
+        """由文件内容哈希、解析器版本和预处理设置生成缓存键
+
+        #include按文件所在目录、-I路径、GMXLIB的顺序查找，因此键中包含文件的绝对路径、
+        -I路径的绝对路径和GMXLIB：内容相同但旁边的被包含文件不同的拓扑不会共用缓存项。
+        """
+        h = hashlib.sha256()
+        h.update(f"{VERSION}:{TOPOLOGY_CACHE_FORMAT}:{kind}\n".encode())
+        h.update(file_digest(path).encode())
+        h.update(f"P:{os.path.abspath(path)}\n".encode())
+        for include_dir in include_dirs:
+            h.update(f"I:{os.path.abspath(include_dir)}\n".encode())
+        h.update(f"G:{os.environ.get('GMXLIB', '')}\n".encode())
+        for name in sorted(defines):
+            h.update(f"D:{name}={' '.join(defines[name])}\n".encode())
+        return h.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}{CACHE_SUFFIX}"
+
+    def load(self, key: str) -> Optional[Dict]:
+        """读取缓存项；被包含文件发生变化时视为失效"""
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'rb') as f, gc_paused():
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            self.stats['misses'] += 1
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            if self.logger:
+                self.logger.warning(f"缓存项损坏，已忽略: {entry_path} ({e})")
+            self._remove(entry_path)
+            self.stats['misses'] += 1
+            return None
+
+        if not self._dependencies_valid(entry.get('dependencies', [])):
+            self._remove(entry_path)
+            self.stats['stale'] += 1
+            self.stats['misses'] += 1
+            return None
+
+        # 更新修改时间作为LRU的访问时间
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        self.stats['hits'] += 1
+        return entry['data']
+
+    def store(self, key: str, data: Dict, dependencies: List[Tuple[str, str]]):
+        """写入缓存项（先写临时文件再原子替换），随后按大小淘汰"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        entry = {'dependencies': dependencies, 'data': data}
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._entry_path(key))
+        except BaseException:
+            self._remove(Path(tmp_path))
+            raise
+
+        self.stats['stores'] += 1
+        self.evict()
+
+    def evict(self):
+        """总大小超过上限时删除最久未使用的缓存项"""
+        entries = []
+        total = 0
+        for entry_path in self.cache_dir.glob(f"*{CACHE_SUFFIX}"):
+            try:
+                stat = entry_path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+            total += stat.st_size
+
+        if total <= self.max_size:
+            return
+
+        entries.sort()
+        for _, size, entry_path in entries:
+            if total <= self.max_size:
+                break
+            self._remove(entry_path)
+            total -= size
+            self.stats['evictions'] += 1
+
+    def summary(self) -> Dict:
+        """返回缓存目录与命中统计"""
+        sizes = []
+        if self.cache_dir.exists():
+            sizes = [p.stat().st_size for p in self.cache_dir.glob(f"*{CACHE_SUFFIX}")]
+        return dict(self.stats, entries=len(sizes), size_mb=sum(sizes) / (1024 * 1024),
+                    cache_dir=str(self.cache_dir))
+
+    def log_summary(self, logger):
+        """输出缓存统计信息"""
+        summary = self.summary()
+        logger.info(f"拓扑缓存: {summary['cache_dir']}")
+        logger.info(f"  命中: {summary['hits']}, 未命中: {summary['misses']} "
+                    f"(其中失效: {summary['stale']})")
+        logger.info(f"  写入: {summary['stores']}, 淘汰: {summary['evictions']}")
+        logger.info(f"  缓存项: {summary['entries']}, 占用: {summary['size_mb']:.1f} MB")
+
+    def _dependencies_valid(self, dependencies: List[Tuple[str, str]]) -> bool:
+        for path, digest in dependencies:
+            try:
+                if file_digest(path) != digest:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def _remove(self, path: Path):
+        try:
+            path.unlink()
+        except OSError:
+            pass